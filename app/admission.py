@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryAdmission:
+    # token buckets and concurrency slots for one worker process
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take_token(self, key: str, rate: float, burst: float) -> float:
+        # 0 when a token was taken, otherwise the seconds until one is available
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # the least recently seen client has the fullest bucket, dropping it
+            # only hands it a full burst a little earlier
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def acquire_slot(self, name: str, limit: int):
+        # a token for release_slot, None when `limit` requests already hold one
+        with self._lock:
+            if self._slots.get(name, 0) >= limit:
+                return None
+            self._slots[name] = self._slots.get(name, 0) + 1
+            return name
+
+    def release_slot(self, name: str, token) -> None:
+        with self._lock:
+            self._slots[name] -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "buckets": len(self._buckets), "in_flight": dict(self._slots)}
+
+
+class SqliteAdmission:
+    # the same buckets and slots in a local sqlite file, so the limits hold for
+    # every worker process on the host together instead of for each of them
+    def __init__(self, path: str, slot_lease: float = 300.0, bucket_idle: float = 3600.0):
+        self.path = path
+        # a slot left behind by a worker that died mid request is freed after this many seconds
+        self.slot_lease = slot_lease
+        # buckets untouched this long are refilled anyway and get deleted
+        self.bucket_idle = bucket_idle
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS slots (id INTEGER PRIMARY KEY, name TEXT NOT NULL, acquired_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS slots_name ON slots (name)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, and never reuse one inherited across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, work):
+        # BEGIN IMMEDIATE takes the write lock up front, so the read and the
+        # write of a bucket or slot count cannot interleave with another worker
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def take_token(self, key: str, rate: float, burst: float) -> float:
+        def take(conn):
+            # wall clock, monotonic clocks are not comparable across processes
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            self._takes += 1
+            if self._takes % 1000 == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.bucket_idle,))
+            return wait
+        return self._transaction(take)
+
+    def acquire_slot(self, name: str, limit: int):
+        def acquire(conn):
+            now = time.time()
+            conn.execute("DELETE FROM slots WHERE name = ? AND acquired_at < ?", (name, now - self.slot_lease))
+            if conn.execute("SELECT COUNT(*) FROM slots WHERE name = ?", (name,)).fetchone()[0] >= limit:
+                return None
+            return conn.execute("INSERT INTO slots (name, acquired_at) VALUES (?, ?)", (name, now)).lastrowid
+        return self._transaction(acquire)
+
+    def release_slot(self, name: str, token) -> None:
+        self._connection().execute("DELETE FROM slots WHERE id = ?", (token,))
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        buckets = conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+        in_flight = dict(conn.execute("SELECT name, COUNT(*) FROM slots GROUP BY name").fetchall())
+        return {"backend": "sqlite", "buckets": buckets, "in_flight": in_flight}
+
+
+def make_admission(backend: str, path: str | None = None):
+    if backend == "memory":
+        return MemoryAdmission()
+    if backend == "sqlite":
+        return SqliteAdmission(path)
+    raise ValueError(f"unknown admission backend: {backend}")
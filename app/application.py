@@ -1,49 +1,256 @@
-from flask import Flask, request, Blueprint
+from flask import Flask, request, Blueprint, Response, current_app, g, has_app_context, make_response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-import boto3
 import json
-from instance.aws_ddb_setup import initialize_dynamodb
+import os
+import functools
+import hashlib
+import importlib
+import math
+import re
+import socket
+import threading
+import time
+import uuid
+from instance.aws_ddb_setup import initialize_dynamodb, TEAM_INDEXES
 from instance.aws_s3_setup import initialize_s3
+from botocore.exceptions import ClientError
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, validates
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import NotFound
+from app.aws_clients import ClientProxy, configure_clients, pool_stats
+from app.admission import make_admission
+from app.batch import batch_write_items, chunked
+from app.cache import make_cache
+from app.change_feed import ChangeNotifier, parse_since, parse_wait, wait_for_changes, stream_changes
+from app.executor import fetch_all, submit_legs, collect_legs, hedged
+from app.export import parse_export_args, export_filename, export_mimetype, export_chunks
+from app.replication import OutboxWorker, backoff_delay
+from app.s3_format import (DRAFT_KEY_PREFIX, MANIFEST_KEY, encode_record, decode_record, encode_snapshot,
+                           decode_snapshot, snapshot_key, snapshot_manifest, snapshot_page, decode_manifest,
+                           manifest_is_current)
+from app.scheduler import PeriodicTask
+from app.singleflight import SingleFlight
+from app.serialization import (DRAFT_COLUMNS, DRAFT_FIELDS, DraftJSONProvider, draft_to_dict, draft_to_dict_with_id, draft_fields,
+                               draft_columns, apply_draft_fields, dynamodb_item_to_dict, dynamodb_string_attributes)
+from app.compression import compress_response
+from app.metrics import registry, Counter, Gauge, RequestTimings, current_timings, record_backend_call, request_latency, response_size
+from app.pagination import PAGE_STORES, start_positions, encode_page_token, decode_page_token, parse_limit
+from app.sqlite_tuning import sqlite_pragmas, sqlite_engine_options, apply_pragmas, create_read_engine
 
 #high level config variables
 S3_BUCKET_NAME='draft-bucket'
 DDB_TABLE_NAME='drafts'
+# page sizes for GET /drafts
+DEFAULT_PAGE_LIMIT=100
+MAX_PAGE_LIMIT=1000
+# max drafts accepted by POST /drafts:batch
+MAX_BATCH_SIZE=5000
 
 #https://discuss.localstack.cloud/t/set-up-s3-bucket-using-docker-compose/646.html
-s3_client = boto3.client(
-    "s3",
-    endpoint_url="http://localhost:4566",
-    aws_access_key_id="test",
-    aws_secret_access_key="test",
-    region_name="us-east-1"
-)
-
-ddb_client = boto3.client(
-    "dynamodb",
-    endpoint_url="http://localhost:4566",
-    aws_access_key_id="test",
-    aws_secret_access_key="test",
-    region_name="us-east-1"
-)
+# clients come from the pooled factory in app/aws_clients.py, see AWS_SETTINGS for tuning
+s3_client = ClientProxy("s3")
+ddb_client = ClientProxy("dynamodb")
 
 db = SQLAlchemy()
-app = Flask(__name__)
-# configurations for sqlite db
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///data.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATION"] = False
-db.init_app(app)
+# default configuration, create_app() layers DRAFT_* environment variables and
+# any explicit overrides on top of it
+DEFAULT_CONFIG = {
+    # configurations for sqlite db
+    "SQLALCHEMY_DATABASE_URI": "sqlite:///data.db",
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    # sqlite pragmas applied to every new connection, "performance" or "default"
+    # (see app/sqlite_tuning.py), SQLITE_PRAGMAS overrides single pragmas
+    "SQLITE_PROFILE": "performance",
+    "SQLITE_PRAGMAS": {},
+    # connection pool and per connection prepared statement cache
+    "SQLITE_POOL_SIZE": 10,
+    "SQLITE_MAX_OVERFLOW": 20,
+    "SQLITE_POOL_TIMEOUT": 10.0,
+    "SQLITE_STATEMENT_CACHE": 256,
+    # GET handlers read through a separate pool of read only connections
+    "SQLITE_READ_ONLY_GETS": True,
+    # max number of s3 objects fetched at the same time when listing drafts
+    "S3_FETCH_CONCURRENCY": 16,
+    # how draft_{id}.json objects are written: "json", "gzip" or "zstd" (needs
+    # the zstandard package). reads follow each object's metadata, so objects
+    # in different formats can sit side by side (see app/s3_format.py)
+    "S3_RECORD_FORMAT": "json",
+    # consolidated snapshot of the whole table, "ndjson" or "columnar" layout.
+    # unfiltered GET /drafts reads it instead of one object per draft while it
+    # is as new as sqlite. written by POST /api/v1/s3/snapshot and, when
+    # S3_SNAPSHOT_INTERVAL is set, every that many seconds
+    "S3_SNAPSHOT_LAYOUT": "ndjson",
+    "S3_SNAPSHOT_FORMAT": "gzip",
+    "S3_SNAPSHOT_READS": True,
+    "S3_SNAPSHOT_INTERVAL": None,
+    # consistency check of dynamodb and s3 against sqlite (app/reconcile.py)
+    # every RECONCILE_INTERVAL seconds when set, repairing drift when RECONCILE_REPAIR
+    "RECONCILE_INTERVAL": None,
+    "RECONCILE_REPAIR": False,
+    "RECONCILE_PAGE_SIZE": 1000,
+    # thread pool and per backend timeouts (seconds) for the parallel dynamodb/s3 legs
+    "BACKEND_CONCURRENCY": 32,
+    "BACKEND_TIMEOUTS": {"dynamodb": 5.0, "s3": 5.0},
+    # which stores GET /drafts and GET /drafts/<id> read, ?source= overrides it
+    # per request: "all" reads and returns all three copies, "primary" only
+    # sqlite, "sqlite"/"dynamodb"/"s3" that one store, "fastest" hedges across
+    # READ_HEDGE_ORDER, starting the next store when the ones in flight have
+    # not answered within READ_HEDGE_DELAY seconds, and returns the first answer
+    "READ_SOURCE": "all",
+    "READ_HEDGE_ORDER": ["sqlite", "dynamodb", "s3"],
+    "READ_HEDGE_DELAY": 0.01,
+    # read-through cache for GET /drafts/<id>, the backend is "memory", "sqlite"
+    # (a local file shared by every worker process) or None to turn it off
+    "DRAFT_CACHE_BACKEND": "memory",
+    "DRAFT_CACHE_SIZE": 1024,
+    "DRAFT_CACHE_TTL": 30.0,
+    "DRAFT_CACHE_PATH": "draft_cache.db",
+    # concurrent identical GET /drafts and GET /drafts/<id> reads share one
+    # backend fetch (app/singleflight.py). per key counts are kept for the
+    # SINGLE_FLIGHT_TRACKED_KEYS most recently used keys
+    "SINGLE_FLIGHT": True,
+    "SINGLE_FLIGHT_TRACKED_KEYS": 1000,
+    # "sync" writes dynamodb and s3 inside the request, "async" commits an outbox
+    # entry with the sqlite row and replicates it from a background worker
+    "REPLICATION_MODE": "sync",
+    "OUTBOX_BATCH_SIZE": 100,
+    "OUTBOX_MAX_ATTEMPTS": 10,
+    "OUTBOX_RETRY_BASE": 0.5,
+    "OUTBOX_POLL_INTERVAL": 0.5,
+    # seconds an entry stays claimed by the process replicating it, longer
+    # than the slowest dynamodb + s3 write. after that another process retries it
+    "OUTBOX_LEASE": 60.0,
+    # start the outbox worker in create_app(), so entries left pending by a
+    # crash or restart replicate without waiting for a write. gunicorn.conf.py
+    # turns it off in the master and starts one in each worker after the fork
+    "OUTBOX_AUTOSTART": True,
+    # "sync" serves /api/v1 from blocking views on the request thread, "async"
+    # from coroutine views sharing one event loop per process (app/async_views.py)
+    "API_MODE": "sync",
+    # "auto" uses orjson when it is installed, "orjson" or "stdlib" to choose
+    "JSON_BACKEND": "auto",
+    # gzip/brotli ("br", needs the brotli package) for clients that accept it,
+    # on bodies of at least COMPRESSION_MIN_SIZE bytes and on streamed bodies
+    "RESPONSE_COMPRESSION": True,
+    "COMPRESSION_MIN_SIZE": 1024,
+    "COMPRESSION_ENCODINGS": ["br", "gzip"],
+    # brotli quality 4 and gzip level 6 are cheap enough to run per response
+    "COMPRESSION_LEVELS": {"br": 4, "gzip": 6},
+    # admission control for /api/v1 (app/admission.py), off while the backend
+    # is None. "memory" limits each worker process on its own, "sqlite" shares
+    # the buckets and slots between the workers on a host through a local file
+    "ADMISSION_BACKEND": None,
+    "ADMISSION_PATH": "admission.db",
+    # token buckets per client and route, "METHOD rule" -> [tokens per second,
+    # burst], "default" covers the other routes. over the rate is a 429
+    "RATE_LIMITS": {
+        "default": [50, 100],
+        "GET /api/v1/drafts": [5, 10],
+        "POST /api/v1/drafts:batch": [1, 2],
+    },
+    # clients are told apart by this header (e.g. X-Api-Key) when set, else by address
+    "RATE_LIMIT_CLIENT_HEADER": None,
+    # requests running at once on the expensive routes, over it is a 503
+    "CONCURRENCY_LIMITS": {
+        "GET /api/v1/drafts": 8,
+        "POST /api/v1/drafts:batch": 2,
+        "POST /api/v1/s3/snapshot": 1,
+        "GET /api/v1/drafts/export": 2,
+    },
+    "CONCURRENCY_RETRY_AFTER": 1,
+    # GET /api/v1/drafts/export reads sqlite EXPORT_BATCH_SIZE rows at a time,
+    # parquet exports are written in row groups of EXPORT_PARQUET_ROW_GROUP rows
+    "EXPORT_BATCH_SIZE": 1000,
+    "EXPORT_PARQUET_ROW_GROUP": 65536,
+    # change feed at GET /api/v1/drafts/changes (app/change_feed.py). a long
+    # poll waits up to CHANGES_MAX_WAIT seconds and an event stream stays open
+    # for CHANGES_STREAM_DURATION, both re-read sqlite every
+    # CHANGES_POLL_INTERVAL for writes made by other worker processes
+    "CHANGES_MAX_WAIT": 30.0,
+    "CHANGES_POLL_INTERVAL": 1.0,
+    "CHANGES_STREAM_DURATION": 300.0,
+    "CHANGES_HEARTBEAT": 15.0,
+    # every CHANGES_PRUNE_INTERVAL seconds when set, changes older than
+    # CHANGES_RETENTION seconds are deleted. a client asking for changes from
+    # before the oldest one left gets a 410 and has to sync in full again
+    "CHANGES_PRUNE_INTERVAL": None,
+    "CHANGES_RETENTION": 7 * 24 * 3600,
+}
+
+
+def parse_pick_number(pick_number):
+    # picks are free form strings like "(77)", 0 when there is no number in it
+    # or it is not a string at all
+    if not isinstance(pick_number, str):
+        return 0
+    match = re.search(r'\d+', pick_number)
+    return int(match.group()) if match else 0
 
 
 class Draft(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     draft_pick_number = db.Column(db.String(255), nullable=False)
-    pro_team_name = db.Column(db.String(255), nullable=False)
+    pro_team_name = db.Column(db.String(255), nullable=False, index=True)
     player_name = db.Column(db.String(255), unique=True, nullable=False)
-    amateur_team_name = db.Column(db.String(255))
+    amateur_team_name = db.Column(db.String(255), index=True)
+    # numeric, sortable copy of draft_pick_number for pick range filters
+    pick_number_value = db.Column(db.Integer, nullable=False, default=0, index=True)
+    # bumped on every update, used for the record etag. as the mapper's version
+    # column every UPDATE/DELETE also matches on it, so a write based on a row
+    # another request has changed in the meantime hits no row and fails
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {"version_id_col": version}
+
+    @validates('draft_pick_number')
+    def set_pick_number_value(self, key, value):
+        self.pick_number_value = parse_pick_number(value)
+        return value
 
     def __repr__(self):
         return f"{self.draft_pick_number} - {self.pro_team_name} - {self.player_name} - {self.amateur_team_name}"
 
+# draft fields that may be null, the others need a string
+NULLABLE_DRAFT_FIELDS = tuple(f for f, column in DRAFT_COLUMNS.items() if Draft.__table__.c[column].nullable)
+
+
+class CollectionVersion(db.Model):
+    # single row counter bumped by every write, used for the /drafts etag
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class OutboxEntry(db.Model):
+    # pending dynamodb/s3 replication, committed with the draft row it describes
+    id = db.Column(db.Integer, primary_key=True)
+    draft_id = db.Column(db.Integer, nullable=False, index=True)
+    # "put" or "delete"
+    operation = db.Column(db.String(16), nullable=False)
+    payload = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.Float, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    # the drain replicating the entry and until when, see claim_outbox_entries()
+    owner = db.Column(db.String(64))
+    lease_until = db.Column(db.Float)
+
+
+class DraftChange(db.Model):
+    # change feed entry, committed with the write it describes. AUTOINCREMENT
+    # keeps a sequence number from being handed out twice, even after pruning
+    __table_args__ = {"sqlite_autoincrement": True}
+    seq = db.Column(db.Integer, primary_key=True)
+    draft_id = db.Column(db.Integer, nullable=False)
+    # "insert", "update" or "delete"
+    operation = db.Column(db.String(16), nullable=False)
+    # the draft fields after the write, None for a delete
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+
+
 #create API version blueprints
 v1 = Blueprint('v1', __name__, url_prefix='/api/v1')
 @v1.route('/')
@@ -51,195 +258,1465 @@ def index():
     return "Hello World!"
 
 
-@v1.route('/drafts')
-def get_drafts():
-    drafts = Draft.query.all()
-    sqlite_output = []
-    for d in drafts:
-        draft_data = {
-            "pick_number": d.draft_pick_number,
-            "pro_team": d.pro_team_name,
-            "player_name": d.player_name,
-            "amateur_team": d.amateur_team_name
-        }
-        sqlite_output.append(draft_data)
+def draft_etag(draft_rec):
+    # strong etag from the per record version, bumped on every update
+    return f"{draft_rec.id}-{draft_rec.version}"
+
+
+def collection_etag(session=None):
+    return collection_version_etag((session or db.session).get(CollectionVersion, 1))
+
+
+def collection_version(session=None):
+    version = (session or db.session).get(CollectionVersion, 1)
+    return version.version if version else 0
+
+
+def collection_version_etag(version):
+    return f"drafts-{version.version if version else 0}"
+
+
+def collection_version_update():
+    return db.update(CollectionVersion).where(CollectionVersion.id == 1).values(version=CollectionVersion.version + 1)
+
+
+def bump_collection_version():
+    # called inside the same transaction as the write it tracks
+    updated = db.session.execute(collection_version_update()).rowcount
+    if not updated:
+        db.session.add(CollectionVersion(id=1, version=1))
+
+
+def not_modified(etag):
+    # If-None-Match uses the weak comparison, * matches anything
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(results, etag):
+    response = make_response(results)
+    if etag is not None:
+        response.set_etag(etag)
+        # clients may keep the body but have to revalidate before using it
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def read_session():
+    # session for the GET handlers, on the read only pool when there is one,
+    # closed at the end of the request. one per thread, a session must not be
+    # shared by the pool threads reading stores for the same request
+    sessions = g.setdefault("read_sessions", {})
+    session = sessions.get(threading.get_ident())
+    if session is None:
+        engine = current_app.extensions.get("sqlite_read_engine") or db.engine
+        session = sessions[threading.get_ident()] = Session(engine)
+    return session
+
+
+def close_read_session(exc):
+    # runs at request teardown, or with the app context when a test client
+    # keeps the request context around longer than its app context
+    if not has_app_context():
+        return
+    for session in g.pop("read_sessions", {}).values():
+        session.close()
+
+
+def parse_draft_filters(args):
+    filters = {}
+    for name in ("pro_team", "amateur_team", "player_name"):
+        if args.get(name):
+            filters[name] = args[name]
+    for name in ("pick_from", "pick_to"):
+        if args.get(name) is not None:
+            try:
+                filters[name] = int(args[name])
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+    return filters
+
+
+def draft_filter_clauses(filters):
+    # each filter maps onto an indexed column of the draft table
+    clauses = []
+    if "pro_team" in filters:
+        clauses.append(Draft.pro_team_name == filters["pro_team"])
+    if "amateur_team" in filters:
+        clauses.append(Draft.amateur_team_name == filters["amateur_team"])
+    if "pick_from" in filters:
+        clauses.append(Draft.pick_number_value >= filters["pick_from"])
+    if "pick_to" in filters:
+        clauses.append(Draft.pick_number_value <= filters["pick_to"])
+    if "player_name" in filters:
+        # a range on the unique player_name index instead of LIKE, which sqlite
+        # cannot serve from the index
+        prefix = filters["player_name"]
+        clauses.extend([Draft.player_name >= prefix, Draft.player_name < prefix + "\U0010ffff"])
+    return clauses
+
+
+def filtered_draft_query(filters, session=None):
+    return (session or db.session).query(Draft).filter(*draft_filter_clauses(filters))
+
+
+def sqlite_draft_data(draft_rec, with_id=False):
+    return draft_to_dict_with_id(draft_rec) if with_id else draft_to_dict(draft_rec)
+
+
+dynamodb_draft_data = dynamodb_item_to_dict
+
+
+def s3_draft_key(draft_id):
+    return f'{DRAFT_KEY_PREFIX}{draft_id}.json'
+
+
+def page_after(drafts, limit, position):
+    # trims a limit + 1 keyset query to one page and returns the next position
+    if limit is not None and len(drafts) > limit:
+        drafts = drafts[:limit]
+        return drafts, position(drafts[-1])
+    return drafts, None
+
+
+def sqlite_page_query(query, after_id, limit):
+    query = query.order_by(Draft.id)
+    if after_id is not None:
+        query = query.filter(Draft.id > after_id)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def sqlite_draft_page(after_id, limit, filters):
+    # keyset pagination on the primary key so deep pages stay cheap
+    drafts = sqlite_page_query(filtered_draft_query(filters, read_session()), after_id, limit).all()
+    drafts, next_position = page_after(drafts, limit, lambda d: d.id)
+    return [sqlite_draft_data(d) for d in drafts], [], next_position
+
+
+def dynamodb_filter_args(filters):
+    # returns the index to query (or None to scan) and the expression arguments
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/query.html
+    team = next((t for t in TEAM_INDEXES if t in filters), None)
+    names = {}
+    values = {}
+    key_conditions = []
+    conditions = []
+    for attribute in ("pro_team", "amateur_team"):
+        if attribute in filters:
+            names[f"#{attribute}"] = attribute
+            values[f":{attribute}"] = {'S': filters[attribute]}
+            target = key_conditions if attribute == team else conditions
+            target.append(f"#{attribute} = :{attribute}")
+    if "pick_from" in filters or "pick_to" in filters:
+        names["#pick_value"] = "pick_value"
+        target = key_conditions if team else conditions
+        if "pick_from" in filters and "pick_to" in filters:
+            target.append("#pick_value BETWEEN :pick_from AND :pick_to")
+        elif "pick_from" in filters:
+            target.append("#pick_value >= :pick_from")
+        else:
+            target.append("#pick_value <= :pick_to")
+        for bound in ("pick_from", "pick_to"):
+            if bound in filters:
+                values[f":{bound}"] = {'N': str(filters[bound])}
+    if "player_name" in filters:
+        names["#player_name"] = "player_name"
+        values[":player_name"] = {'S': filters["player_name"]}
+        conditions.append("begins_with(#player_name, :player_name)")
+
+    args = {"ExpressionAttributeNames": names, "ExpressionAttributeValues": values}
+    if key_conditions:
+        args["KeyConditionExpression"] = " AND ".join(key_conditions)
+    if conditions:
+        args["FilterExpression"] = " AND ".join(conditions)
+    return (TEAM_INDEXES[team] if team else None), args
+
+
+def dynamodb_page_args(start_key, limit, filters):
     # dynamoDB
     # https://stackoverflow.com/questions/10450962/how-can-i-fetch-all-items-from-a-dynamodb-table-without-specifying-the-primary-k
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/scan.html
-    dynamodb_output = []
-    try:
-        ddb_draft_response = ddb_client.scan(TableName=DDB_TABLE_NAME)
-        items = ddb_draft_response['Items']
-        for item in items:
-            draft_data={
-                "id": item['id']['N'],
-                "pick_number": item['pick_number']['S'],
-                "pro_team": item['pro_team']['S'],
-                "player_name": item['player_name']['S'],
-                "amateur_team": item['amateur_team']['S']
-            }
-            dynamodb_output.append(draft_data)
-            print(f"Successfull retrieved records from DynamoDB table: {DDB_TABLE_NAME}")
-    except Exception as e:
-        print(f"Error retrieving DynamoDB records: {e}")
+    scan_args = {"TableName": DDB_TABLE_NAME}
+    if limit is not None:
+        scan_args["Limit"] = limit
+    if start_key is not None:
+        scan_args["ExclusiveStartKey"] = start_key
+    index_name = None
+    if filters:
+        index_name, filter_args = dynamodb_filter_args(filters)
+        scan_args.update(filter_args)
+    return index_name, scan_args
+
+
+def index_unavailable(error, index_name, scan_args):
+    # tables created before the team indexes existed fall back to a filtered
+    # scan, turns scan_args into scan arguments and returns True when it did
+    if error.response['Error']['Code'] not in ('ValidationException', 'ResourceNotFoundException'):
+        return False
+    print(f"DynamoDB index {index_name} unavailable, scanning instead: {error}")
+    key_condition = scan_args.pop("KeyConditionExpression")
+    scan_args["FilterExpression"] = " AND ".join(
+        c for c in (key_condition, scan_args.get("FilterExpression")) if c)
+    return True
+
+
+def dynamodb_page_output(ddb_draft_response):
+    return ([dynamodb_draft_data(item) for item in ddb_draft_response['Items']], [],
+            ddb_draft_response.get('LastEvaluatedKey'))
+
+
+def dynamodb_draft_page(start_key, limit, filters):
+    index_name, scan_args = dynamodb_page_args(start_key, limit, filters)
+    ddb_draft_response = None
+    if index_name is not None:
+        try:
+            ddb_draft_response = ddb_client.query(IndexName=index_name, **scan_args)
+        except ClientError as e:
+            if not index_unavailable(e, index_name, scan_args):
+                raise
+    if ddb_draft_response is None:
+        ddb_draft_response = ddb_client.scan(**scan_args)
+    return dynamodb_page_output(ddb_draft_response)
+
+
+def fetch_s3_draft(key):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/get_object.html
+    file_response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=key)
+    return decode_record(file_response['Body'].read(), file_response)
 
+
+def s3_draft_page(position, limit, filters):
     # s3
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/list_objects_v2.html
+    if filters:
+        # s3 has no index, so filtered reads follow the matching sqlite ids
+        # and fetch just those objects instead of listing the bucket
+        query = sqlite_page_query(filtered_draft_query(filters, read_session()).with_entities(Draft.id), position, limit)
+        ids, next_position = page_after([draft_id for (draft_id,) in query], limit, lambda draft_id: draft_id)
+        keys = [s3_draft_key(draft_id) for draft_id in ids]
+    else:
+        snapshot = s3_snapshot_drafts()
+        if snapshot is not None:
+            # one cached object instead of a listing and a GET per draft
+            drafts, next_position = snapshot_page(snapshot, position, limit)
+            return drafts, [], next_position
+        keys, next_position = s3_listing_keys(s3_client.list_objects_v2(**s3_list_args(position, limit)))
+    # fetch the objects in parallel, a failed object is reported on its own
+    # instead of dropping the whole page
+    fetched = fetch_all(fetch_s3_draft, keys, current_app.config["S3_FETCH_CONCURRENCY"], "s3_fetch")
+    return s3_page_output(fetched, next_position)
+
+
+def s3_list_args(position, limit):
+    # only the draft objects, not the snapshots. the position is the last key
+    # of the previous page, which a snapshot page can hand out as well
+    list_args = {"Bucket": S3_BUCKET_NAME, "Prefix": DRAFT_KEY_PREFIX}
+    if limit is not None:
+        list_args["MaxKeys"] = limit
+    if position is not None:
+        list_args["StartAfter"] = position
+    return list_args
+
+
+def s3_listing_keys(response):
+    keys = [object['Key'] for object in response.get('Contents', [])]
+    return keys, keys[-1] if response.get('IsTruncated') and keys else None
+
+
+def s3_snapshot_drafts():
+    # the drafts of the latest snapshot when it is as new as sqlite, else None
+    if not current_app.config["S3_SNAPSHOT_READS"]:
+        return None
+    manifest = current_s3_manifest()
+    if not manifest_is_current(manifest, collection_version(read_session())):
+        return None
+    drafts = cached_s3_snapshot(manifest)
+    if drafts is None:
+        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=manifest["key"])
+        drafts = cache_s3_snapshot(manifest, decode_snapshot(response['Body'].read(), response))
+    return drafts
+
+
+def cached_s3_snapshot(manifest):
+    # a snapshot object never changes once written, so the decoded drafts are
+    # kept until the manifest points somewhere else
+    cached = current_app.extensions.get("s3_snapshot")
+    if cached is not None and cached[0] == (manifest["key"], manifest["created_at"]):
+        return cached[1]
+    return None
+
+
+def cache_s3_snapshot(manifest, drafts):
+    current_app.extensions["s3_snapshot"] = ((manifest["key"], manifest["created_at"]), drafts)
+    return drafts
+
+
+def s3_snapshot_objects(version, draft_recs, config):
+    # put_object arguments for the snapshot of draft_recs and for its manifest
+    drafts = [sqlite_draft_data(d, with_id=True) for d in draft_recs]
+    layout, record_format = config["S3_SNAPSHOT_LAYOUT"], config["S3_SNAPSHOT_FORMAT"]
+    key = snapshot_key(version, layout, record_format)
+    snapshot = encode_snapshot(drafts, layout, record_format)
+    manifest = snapshot_manifest(key, version, drafts, layout, record_format, len(snapshot["Body"]), time.time())
+    manifest_object = {"Bucket": S3_BUCKET_NAME, "Key": MANIFEST_KEY, "Body": json.dumps(manifest),
+                       "ContentType": "application/json"}
+    return dict(snapshot, Bucket=S3_BUCKET_NAME, Key=key), manifest_object, manifest
+
+
+def write_s3_snapshot():
+    # the version and the rows are read in one sqlite transaction, so the
+    # snapshot is exactly the table at that collection version
+    s = read_session()
+    version = collection_version(s)
+    draft_recs = s.query(Draft).order_by(Draft.id).all()
+    snapshot_object, manifest_object, manifest = s3_snapshot_objects(version, draft_recs, current_app.config)
+    previous = current_s3_manifest()
+    s3_client.put_object(**snapshot_object)
+    # the manifest goes last, readers never see a manifest for a missing snapshot
+    s3_client.put_object(**manifest_object)
+    if previous is not None and previous["key"] != manifest["key"]:
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=previous["key"])
+    return manifest
+
+
+def current_s3_manifest():
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=MANIFEST_KEY)
+    except ClientError as e:
+        if missing_s3_object(e):
+            return None
+        raise
+    return decode_manifest(response['Body'].read())
+
+
+def s3_page_output(fetched, next_position):
     s3_output = []
+    s3_errors = []
+    for key, draft_data, error in fetched:
+        if error is not None:
+            print(f"Error retrieving s3 object {key}: {error}")
+            s3_errors.append({"key": key, "error": str(error)})
+        else:
+            s3_output.append(draft_data)
+    return s3_output, s3_errors, next_position
+
+
+draft_page_readers = {
+    "sqlite": sqlite_draft_page,
+    "dynamodb": dynamodb_draft_page,
+    "s3": s3_draft_page
+}
+
+
+def read_draft_page(store, position, limit, filters):
+    # a failing store is reported as empty rather than failing the whole request
     try:
-        s3_draft_response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME)
-        if 'Contents' in s3_draft_response:
-            for object in s3_draft_response['Contents']:
-                file_response = s3_client.get_object(Bucket=S3_BUCKET_NAME)
-                draft_data = json.loads(file_response['Body'].read())
-                s3_output.append(draft_data)
+        return draft_page_readers[store](position, limit, filters)
     except Exception as e:
-        print(f"Error retrieving s3 Contents: {e}")
+        print(f"Error retrieving {store} records: {e}")
+        return [], [{"error": str(e)}], None
+
+
+def iter_draft_records(positions, filters, read_page=read_draft_page):
+    # walk every store page by page so memory stays bounded by one page
+    for store, position in positions.items():
+        while True:
+            records, errors, position = read_page(store, position, DEFAULT_PAGE_LIMIT, filters)
+            for record in records:
+                yield {"source": store, **record}
+            for error in errors:
+                yield {"source": store, **error}
+            if position is None:
+                break
+
+
+READ_SOURCES = ("all", "primary", "fastest") + PAGE_STORES
+RESPONSE_KEYS = {"sqlite": "sqlite_draft_data", "dynamodb": "dynamo_db_draft_data", "s3": "s3_draft_data"}
+
+
+def parse_read_source(args):
+    source = args.get('source', current_app.config["READ_SOURCE"])
+    if source not in READ_SOURCES:
+        raise ValueError(f"source must be one of {', '.join(READ_SOURCES)}")
+    return source
+
+
+def source_stores(source):
+    # the stores a read starts from, in the order they are tried
+    if source == "all":
+        return PAGE_STORES
+    if source == "primary":
+        return ("sqlite",)
+    if source == "fastest":
+        return tuple(current_app.config["READ_HEDGE_ORDER"])
+    return (source,)
+
+
+def parse_drafts_args(args):
+    # limit, filters, start positions and read source of a GET /drafts
+    # request, ValueError when invalid
+    limit = parse_limit(args.get('limit'), MAX_PAGE_LIMIT)
+    filters = parse_draft_filters(args)
+    source = parse_read_source(args)
+    token = args.get('next_token')
+    # stores missing from a token are already exhausted, and a token from a
+    # single source read carries on with the store that served the first page
+    positions = decode_page_token(token) if token else start_positions(source_stores(source))
+    return limit, filters, positions, source
+
+
+def hedge_first_page(source, args):
+    # "fastest" races the stores for the first page only, later pages follow the winner
+    return source == "fastest" and not args.get('next_token')
+
+
+def output_stores(source, positions):
+    return PAGE_STORES if source == "all" else tuple(positions)
+
+
+def hedge_settings():
+    config = current_app.config
+    return config["READ_HEDGE_DELAY"], max(config["BACKEND_TIMEOUTS"].values())
+
+
+def fastest_page(stores, limit, filters):
+    # hedged first page, returns the store that answered first and its page
+    delay, timeout = hedge_settings()
+    calls = {store: functools.partial(draft_page_readers[store], None, limit, filters) for store in stores}
+    store, page, errors = hedged(calls, delay, timeout, current_app.config["BACKEND_CONCURRENCY"])
+    return hedged_page_result(stores, store, page, errors)
+
+
+def hedged_page_result(stores, store, page, errors):
+    for name, error in errors.items():
+        print(f"Error retrieving {name} records: {error}")
+    if store is None:
+        return stores[0], ([], [{"error": str(errors.get(stores[0]))}], None)
+    return store, page
+
+
+def prefetched_reader(store, page, read_page=read_draft_page):
+    # read_page that answers the first read of store with a page already fetched
+    prefetched = {store: page}
+
+    def read(name, position, limit, filters):
+        if position is None and name in prefetched:
+            return prefetched.pop(name)
+        return read_page(name, position, limit, filters)
+    return read
+
+
+def ndjson_drafts_response(records, etag, stream=stream_with_context):
+    # bound here, the lines may be encoded after the app context is gone
+    dumps_line = current_app.json.dumps_line
+    lines = (dumps_line(record) for record in records)
+    response = Response(stream(lines), mimetype='application/x-ndjson')
+    response.set_etag(etag)
+    return response
+
+
+def drafts_response(output, errors, limit, next_positions, etag):
+    # only the stores that were read, all three unless a single source was asked for
+    results = {RESPONSE_KEYS[store]: records for store, records in output.items()}
+    if errors:
+        results["errors"] = errors
+    if limit is not None:
+        results["next_token"] = encode_page_token(next_positions)
+    return with_etag(results, etag)
+
+
+@v1.route('/drafts')
+def get_drafts():
+    etag = collection_etag(read_session())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    try:
+        limit, filters, positions, source = parse_drafts_args(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    hedge = hedge_first_page(source, request.args)
+
+    if request.args.get('format') == 'ndjson':
+        read_page = read_draft_page
+        if hedge:
+            store, page = fastest_page(tuple(positions), limit or DEFAULT_PAGE_LIMIT, filters)
+            positions = {store: None}
+            read_page = prefetched_reader(store, page)
+        return ndjson_drafts_response(iter_draft_records(positions, filters, read_page), etag)
+
+    output, errors, next_positions = coalesced(
+        "drafts", drafts_flight_key(etag), lambda: read_drafts(source, positions, limit, filters, hedge))
+    return drafts_response(output, errors, limit, next_positions, etag)
+
+
+def drafts_flight_key(etag):
+    # the same arguments at the same collection version read the same pages
+    return etag, tuple(sorted(request.args.items(multi=True)))
+
+
+def read_drafts(source, positions, limit, filters, hedge):
+    # the pages of a json GET /drafts: records and errors per store and the next positions
+    read_page = read_draft_page
+    if hedge:
+        store, page = fastest_page(tuple(positions), limit or MAX_PAGE_LIMIT, filters)
+        positions = {store: None}
+        read_page = prefetched_reader(store, page)
+
+    output = {store: [] for store in output_stores(source, positions)}
+    errors = {}
+    next_positions = {}
+    for store, position in positions.items():
+        if limit is not None:
+            output[store], store_errors, next_positions[store] = read_page(store, position, limit, filters)
+            if store_errors:
+                errors[store] = store_errors
+            continue
+        # no limit requested, so keep following pages instead of truncating
+        # at the 1MB dynamodb scan page or the 1000 key s3 listing
+        while True:
+            records, store_errors, position = read_page(store, position, MAX_PAGE_LIMIT, filters)
+            output[store].extend(records)
+            if store_errors:
+                errors.setdefault(store, []).extend(store_errors)
+            if position is None:
+                break
+    return output, errors, next_positions
+
+
+# the columns of an export, in order
+EXPORT_COLUMNS = ("id",) + DRAFT_FIELDS
+
+
+def export_batches(filters, batch_size):
+    # yield_per makes sqlite step through the rows batch_size at a time
+    # instead of loading the table, and only the exported columns are read
+    columns = [Draft.id] + [getattr(Draft, DRAFT_COLUMNS[field]) for field in DRAFT_FIELDS]
+    query = (db.select(*columns).where(*draft_filter_clauses(filters)).order_by(Draft.id)
+             .execution_options(yield_per=batch_size))
+    for partition in read_session().execute(query).partitions():
+        yield [tuple(row) for row in partition]
+
+
+@v1.route('/drafts/export')
+def export_drafts():
+    # the whole table, or the rows matching the GET /drafts filters, as one
+    # flat file from sqlite alone
+    etag = collection_etag(read_session())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    try:
+        export_format, compression = parse_export_args(request.args)
+        filters = parse_draft_filters(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if export_format == "parquet":
+        # pip install pyarrow to offer ?format=parquet. it is imported here and
+        # not at startup, and a missing package fails before the stream starts
+        try:
+            importlib.import_module("pyarrow.parquet")
+        except ImportError:
+            return {"error": "parquet exports need the pyarrow package"}, 501
+    config = current_app.config
+    chunks = export_chunks(export_format, compression, EXPORT_COLUMNS,
+                           export_batches(filters, config["EXPORT_BATCH_SIZE"]), current_app.json.dumps_line,
+                           gzip_level=config["COMPRESSION_LEVELS"]["gzip"],
+                           row_group_size=config["EXPORT_PARQUET_ROW_GROUP"])
+    response = Response(stream_with_context(chunks), mimetype=export_mimetype(export_format, compression))
+    response.set_etag(etag)
+    response.headers["Content-Disposition"] = f'attachment; filename="{export_filename(export_format, compression)}"'
+    return response
+
+
+def get_dynamodb_draft(id):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/get_item.html
+    ddb_response = ddb_client.get_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}})
+    if 'Item' not in ddb_response:
+        return None
+    return dynamodb_draft_data(ddb_response['Item'])
+
+
+def get_s3_draft(id):
+    return fetch_s3_draft(s3_draft_key(id))
+
+
+def dynamodb_draft_item(draft_id, draft_data):
     return {
-        "sqlite_draft_data": sqlite_output,
-        "dynamo_db_draft_data": dynamodb_output,
-        "s3_draft_data": s3_output
-        }
+        'id': {'N': str(draft_id)},
+        **dynamodb_string_attributes(draft_data),
+        'pick_value': {'N': str(parse_pick_number(draft_data["pick_number"]))}
+    }
+
+
+def put_dynamodb_draft(draft_id, draft_data):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/put_item.html
+    ddb_client.put_item(TableName=DDB_TABLE_NAME, Item=dynamodb_draft_item(draft_id, draft_data))
+
+
+def s3_draft_object(draft_id, draft_data):
+    # put_object arguments for a draft
+    s3_data = {"id": int(draft_id), **draft_fields(draft_data)}
+    return dict(encode_record(s3_data, current_app.config["S3_RECORD_FORMAT"]),
+                Bucket=S3_BUCKET_NAME, Key=s3_draft_key(draft_id))
+
+
+def put_s3_draft(draft_id, draft_data):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/put_object.html
+    s3_client.put_object(**s3_draft_object(draft_id, draft_data))
+
+
+# https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.ConditionExpressions.html
+# updates and deletes only apply to an item that is there, so they replace the
+# get_item existence check and a PUT racing a DELETE cannot bring the item back
+ITEM_EXISTS = "attribute_exists(id)"
+
+
+def update_dynamodb_draft(draft_id, draft_data):
+    ddb_client.put_item(TableName=DDB_TABLE_NAME, Item=dynamodb_draft_item(draft_id, draft_data),
+                        ConditionExpression=ITEM_EXISTS)
+
+
+def s3_draft_etag(draft_id, draft_data):
+    # etag s3 reports for the object put_s3_draft writes for draft_data. single
+    # part uploads have the md5 of the body as etag
+    return f'"{hashlib.md5(s3_draft_object(draft_id, draft_data)["Body"]).hexdigest()}"'
+
+
+def update_s3_draft(draft_id, draft_data, previous_data):
+    # https://docs.aws.amazon.com/AmazonS3/latest/userguide/conditional-writes.html
+    # the object written for the row before this update has a known etag, so
+    # the put is conditional on it without reading s3 first: one round trip,
+    # NoSuchKey when the object is gone
+    try:
+        s3_client.put_object(**s3_draft_object(draft_id, draft_data), IfMatch=s3_draft_etag(draft_id, previous_data))
+    except ClientError as e:
+        if error_code(e) != 'PreconditionFailed':
+            raise
+        # the object is not what the previous row gives: written in another
+        # S3_RECORD_FORMAT, left behind by a failed put, or already replaced
+        # by a later update. sqlite decides, so the row as it is now goes over
+        # the object just looked at, a conflict only when another write lands
+        # in between. a row deleted since is not brought back
+        current = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_draft_key(draft_id))
+        draft_rec = read_session().get(Draft, draft_id)
+        if draft_rec is None:
+            raise
+        s3_client.put_object(**s3_draft_object(draft_id, draft_to_dict(draft_rec)), IfMatch=current["ETag"])
+
+
+def delete_dynamodb_draft(draft_id):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/delete_item.html
+    ddb_client.delete_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(draft_id)}},
+                           ConditionExpression=ITEM_EXISTS)
+
+
+def delete_s3_draft(draft_id):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_object.html
+    # deleting a missing key succeeds, which is what a retried DELETE wants
+    s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_draft_key(draft_id))
+
+
+def run_backend_legs(legs):
+    # dynamodb and s3 are independent once the id is known, so run them
+    # together and wait for the slowest instead of the sum of both
+    futures = submit_legs(legs, current_app.config["BACKEND_CONCURRENCY"])
+    return collect_legs(futures, current_app.config["BACKEND_TIMEOUTS"])
+
+
+def get_draft_cache():
+    backend = current_app.config["DRAFT_CACHE_BACKEND"]
+    if not backend:
+        return None
+    cache = current_app.extensions.get("draft_cache")
+    if cache is None:
+        cache = make_cache(backend,
+                           max_size=current_app.config["DRAFT_CACHE_SIZE"],
+                           ttl=current_app.config["DRAFT_CACHE_TTL"],
+                           path=os.path.join(current_app.instance_path, current_app.config["DRAFT_CACHE_PATH"]))
+        current_app.extensions["draft_cache"] = cache
+    return cache
+
+
+def draft_cache_key(id):
+    # normalize so /drafts/01 and /drafts/1 share an entry, non numeric ids are not cached
+    try:
+        return str(int(id))
+    except ValueError:
+        return None
+
+
+def invalidate_cached_drafts(*ids):
+    cache = get_draft_cache()
+    if cache is None:
+        return
+    for id in ids:
+        cache.invalidate(str(id))
+
+
+@v1.route('/cache/stats')
+def get_cache_stats():
+    cache = get_draft_cache()
+    if cache is None:
+        return {"backend": None}
+    return cache.stats()
+
+
+def get_single_flight():
+    if not current_app.config["SINGLE_FLIGHT"]:
+        return None
+    flight = current_app.extensions.get("single_flight")
+    if flight is None:
+        flight = current_app.extensions.setdefault(
+            "single_flight", SingleFlight(current_app.config["SINGLE_FLIGHT_TRACKED_KEYS"]))
+    return flight
+
+
+def coalesced(group, detail, fn):
+    # fn(), shared with the concurrent requests for the same group and detail
+    flight = get_single_flight()
+    if flight is None:
+        return fn()
+    result, _ = flight.do((group, detail), fn)
+    return result
+
+
+def active_single_flight():
+    # the views of the current API_MODE coalesce through one of these
+    return current_app.extensions.get("async_single_flight" if current_app.config["API_MODE"] == "async"
+                                      else "single_flight")
+
+
+@v1.route('/coalescing/stats')
+def get_coalescing_stats():
+    flight = active_single_flight()
+    if flight is None:
+        return {"enabled": current_app.config["SINGLE_FLIGHT"], "in_flight": 0, "groups": {}, "keys": []}
+    return dict(flight.stats(), enabled=current_app.config["SINGLE_FLIGHT"])
+
+
+@v1.route('/admission/stats')
+def get_admission_stats():
+    admission = get_admission()
+    if admission is None:
+        return {"backend": None}
+    return admission.stats()
+
+
+@v1.route('/pools/stats')
+def get_pool_stats():
+    return {"s3": pool_stats("s3"), "dynamodb": pool_stats("dynamodb")}
 
 
 @v1.route('/drafts/<id>')
 def get_draft_record(id):
+    try:
+        source = parse_read_source(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if source == "fastest":
+        return fastest_draft_record(id)
+    stores = source_stores(source)
     results = {}
+    # only cache complete answers, not ones where a backend failed or timed out
+    cacheable = True
+    etag = None
+    # sqlite first, it is local and its version decides whether the
+    # remote stores need to be touched at all. a primary key lookup is cheap
+    # and not shared, so a read after a write always sees that write
     try:
-        draft_rec = db.get_or_404(Draft, id)
-        results["sqlite"] = {
-            "id": draft_rec.id,
-            "pick_number": draft_rec.draft_pick_number,
-            "pro_team": draft_rec.pro_team_name,
-            "player_name": draft_rec.player_name,
-            "amateur_team": draft_rec.amateur_team_name
-        }
+        etag, results["sqlite"] = read_sqlite_record(id)
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
     except Exception as e:
         print(f"Error retrieving record from sqlite db: {e}")
         results["sqlite"]={"error": "Record not found"}
-    
-    # dynamo db
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/get_item.html
-    try:
-        ddb_response = ddb_client.get_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}})
-        if 'Item' in ddb_response:
-            item = ddb_response['Item']
-            results["dynamodb"] = {
-                "id": item['id']['N'],
-                "pick_number": item['pick_number']['S'],
-                "pro_team": item['pro_team']['S'],
-                "player_name": item['player_name']['S'],
-                "amateur_team": item['amateur_team']['S']
-            }
+        cacheable = cacheable and isinstance(e, NotFound)
+    if "sqlite" not in stores:
+        # still read above, its version answers If-None-Match without a remote call
+        del results["sqlite"]
+    remote = [store for store in ("dynamodb", "s3") if store in stores]
+    if not remote:
+        return with_etag(results, etag)
+
+    # the cache holds complete tri-store answers
+    if source == "all":
+        cached = cached_draft_record(id, etag)
+        if cached is not None:
+            return with_etag(cached, etag)
+
+    # requests that saw the same version share the remote reads
+    flight_key = (draft_cache_key(id) or id, etag, tuple(remote))
+    legs = coalesced("draft", flight_key, lambda: read_remote_records(id, remote))
+    cacheable = add_backend_records(results, legs) and cacheable
+    if cacheable and source == "all":
+        cache_draft_record(id, etag, results)
+    return with_etag(results, etag)
+
+
+def read_sqlite_record(id):
+    # etag and data of the sqlite row, NotFound when there is none
+    draft_rec = read_session().get(Draft, id)
+    if draft_rec is None:
+        raise NotFound()
+    return draft_etag(draft_rec), sqlite_draft_data(draft_rec, with_id=True)
+
+
+def read_remote_records(id, remote):
+    readers = {"dynamodb": get_dynamodb_draft, "s3": get_s3_draft}
+    legs = submit_legs({store: functools.partial(readers[store], id) for store in remote},
+                       current_app.config["BACKEND_CONCURRENCY"])
+    return collect_legs(legs, current_app.config["BACKEND_TIMEOUTS"])
+
+
+def fastest_draft_record(id):
+    # hedged read of one record: the first store in READ_HEDGE_ORDER that has
+    # it answers, a store without the record or with an error does not count
+    delay, timeout = hedge_settings()
+    readers = {"sqlite": lambda draft_id: read_session().get(Draft, draft_id),
+               "dynamodb": get_dynamodb_draft, "s3": get_s3_draft}
+    stores = source_stores("fastest")
+    calls = {store: functools.partial(readers[store], id) for store in stores}
+    store, record, errors = hedged(calls, delay, timeout, current_app.config["BACKEND_CONCURRENCY"],
+                                   accept=lambda record: record is not None)
+    return fastest_record_response(stores, store, record, errors)
+
+
+def fastest_record_response(stores, store, record, errors):
+    for name, error in errors.items():
+        if not isinstance(error, LookupError) and not missing_s3_object(error):
+            print(f"Error retrieving record from {name}:{error}")
+    if store is None:
+        return {name: {"error": "Record not found"} for name in stores}
+    if store != "sqlite":
+        return {store: record}
+    # only a sqlite answer has the version an etag is built from
+    etag = draft_etag(record)
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    return with_etag({"sqlite": sqlite_draft_data(record, with_id=True)}, etag)
+
+
+def error_code(error):
+    return error.response['Error']['Code'] if isinstance(error, ClientError) else None
+
+
+def missing_s3_object(error):
+    return error_code(error) in ('NoSuchKey', '404')
+
+
+def add_backend_records(results, legs):
+    # copies the dynamodb/s3 answers into results, True when every answer can be cached
+    cacheable = True
+    for store, (record, error) in legs.items():
+        if error is not None:
+            print(f"Error retrieving record from {store}:{error}")
+            cacheable = cacheable and missing_s3_object(error)
+        if record is None:
+            results[store] = {"error": "Record not found"}
         else:
-            results["dynamodb"] = {"error": "Record not found"}
-    except Exception as e:
-        print(f"Error retrieving record from dynamodb:{e}")
-        results["dynamodb"] = {"error": "Record not found"}
+            results[store] = record
+    return cacheable
+
+
+def cached_draft_record(id, etag):
+    cache = get_draft_cache()
+    cache_key = draft_cache_key(id)
+    if cache is None or cache_key is None:
+        return None
+    cached = cache.get(cache_key)
+    # an entry written for another version is stale, treat it as a miss
+    if cached is not None and cached["etag"] == etag:
+        return cached["results"]
+    return None
 
-    # s3
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/get_object.html
-    try:
-        s3_response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{id}.json')
-        results["s3"] = json.loads(s3_response['Body'].read())
-    except Exception as e:
-        print(f"Error retrieving record from s3:{e}")
-        results["s3"] = {"error": "Record not found"}
-    return results
+
+def cache_draft_record(id, etag, results):
+    cache = get_draft_cache()
+    cache_key = draft_cache_key(id)
+    if cache is not None and cache_key is not None:
+        cache.set(cache_key, {"etag": etag, "results": results})
+
+
+def draft_payload_error(draft_data):
+    # why a POST /drafts or PUT /drafts/<id> body or a batch item cannot be
+    # stored, None when it can
+    if not isinstance(draft_data, dict):
+        return "expected a JSON object"
+    missing = [f for f in DRAFT_FIELDS
+               if f not in draft_data or (draft_data[f] is None and f not in NULLABLE_DRAFT_FIELDS)]
+    if missing:
+        return f"missing required field: {', '.join(missing)}"
+    wrong_type = [f for f in DRAFT_FIELDS if draft_data[f] is not None and not isinstance(draft_data[f], str)]
+    if wrong_type:
+        return f"field must be a string: {', '.join(wrong_type)}"
+    return None
 
 
 @v1.route('/drafts', methods=['POST'])
 def add_draft_record():
+    error = draft_payload_error(request.json)
+    if error:
+        return {"error": error}, 400
     # dupe check
     dupe_player = Draft.query.filter_by(player_name=request.json["player_name"]).first()
     if dupe_player:
         return {"error": "Player already exists in draft db"}, 409
-    draft_rec = Draft(draft_pick_number=request.json["pick_number"], 
-                      pro_team_name=request.json["pro_team"], 
-                      player_name=request.json["player_name"], 
-                      amateur_team_name=request.json["amateur_team"])
+    draft_rec = new_draft_record(request.json)
     db.session.add(draft_rec)
+    bump_collection_version()
+    # the change row, and the outbox row in async mode, land in the same
+    # commit as the draft row
+    db.session.flush()
+    record_draft_change(draft_rec.id, "insert", request.json)
+    if replicate_async():
+        enqueue_replication(draft_rec.id, "put", request.json)
+        db.session.commit()
+        notify_changes()
+        notify_replication()
+        invalidate_cached_drafts(draft_rec.id)
+        return {"id": draft_rec.id}, 201
     db.session.commit()
+    notify_changes()
     # store the auto incrementing pk generated from sqlalchemy
     draft_id = draft_rec.id
-    
-    # dynamo db
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/put_item.html
-    try:
-        ddb_client.put_item(
-            TableName=DDB_TABLE_NAME,
-            Item={
-                'id': {'N': str(draft_id)},
-                'pick_number': {'S': request.json["pick_number"]},
-                'pro_team': {'S': request.json["pro_team"]},
-                'player_name': {'S': request.json["player_name"]},
-                'amateur_team': {'S': request.json["amateur_team"]}
-            }
-        )
-    except Exception as e:
-        print(f"DynamoDB put error: {e}")
+    draft_data = request.json
 
-    # s3
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/put_object.html
-    try:
-        s3_data = {
-            "id": draft_id,
-            "pick_number": request.json["pick_number"],
-            "pro_team": request.json["pro_team"],
-            "player_name": request.json["player_name"],
-            "amateur_team": request.json["amateur_team"]
-        }
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=f'draft_{draft_id}.json',
-            Body=json.dumps(s3_data)
-        )
-    except Exception as e:
-        print(f"S3 put error: {e}")
+    legs = run_backend_legs({
+        "dynamodb": lambda: put_dynamodb_draft(draft_id, draft_data),
+        "s3": lambda: put_s3_draft(draft_id, draft_data)
+    })
+    # a not found answer for this id may already be cached
+    invalidate_cached_drafts(draft_id)
+    if legs["dynamodb"][1] is not None:
+        print(f"DynamoDB put error: {legs['dynamodb'][1]}")
+    if legs["s3"][1] is not None:
+        print(f"S3 put error: {legs['s3'][1]}")
 
     return {"id": draft_rec.id}, 201
 
 
-@v1.route('/drafts/<id>', methods=['DELETE'])
-def delete_draft_record(id):
-    # existence validation
-    draft_rec = db.get_or_404(Draft, id)
-    # s3
+def new_draft_record(draft_data):
+    return Draft(**draft_columns(draft_data))
+
+
+def read_batch_payload():
+    # a json array, or one json object per line when sent as ndjson
+    if request.mimetype == 'application/x-ndjson':
+        return [json.loads(line) for line in request.stream if line.strip()]
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, list):
+        raise ValueError("expected a JSON array of drafts")
+    return payload
+
+
+@v1.route('/drafts:batch', methods=['POST'])
+def add_draft_records_batch():
     try:
-        s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{id}.json')
-    except s3_client.exceptions.NoSuchKey:
-        return {"message": "s3 object not found"}, 404
+        payload = read_batch_payload()
+    except ValueError as e:
+        return {"error": f"invalid batch payload: {e}"}, 400
+    if len(payload) > MAX_BATCH_SIZE:
+        return {"error": f"batch is limited to {MAX_BATCH_SIZE} drafts"}, 413
 
-    # dynamodb
+    results, valid = validate_batch(payload)
+    # dupe check against the db with IN queries instead of one query per draft
+    existing = set()
+    for chunk in chunked(batch_player_names(payload, valid), 500):
+        existing.update(name for (name,) in db.session.query(Draft.player_name).filter(Draft.player_name.in_(chunk)))
+    to_insert = new_batch_drafts(payload, valid, existing, results)
+
+    # one transaction for every new row
+    draft_recs = [new_draft_record(payload[i]) for i in to_insert]
     try:
-        ddb_response = ddb_client.get_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}})
-        if 'Item' not in ddb_response:
-            return {"message": "dynamodb item not found"}, 404
+        db.session.add_all(draft_recs)
+        bump_collection_version()
+        db.session.flush()
+        for i, draft_rec in zip(to_insert, draft_recs):
+            record_draft_change(draft_rec.id, "insert", payload[i])
+            if replicate_async():
+                enqueue_replication(draft_rec.id, "put", payload[i])
+        db.session.commit()
     except Exception as e:
-        print(f"Error during dynamodb get operation:{e}")
-        return {"message": "Error during dynamodb get operation"}, 500
-    
-    # delete from all 3 storage systems after validating existence
-    db.session.delete(draft_rec)
+        db.session.rollback()
+        print(f"Error during batch insert: {e}")
+        for i in to_insert:
+            results[i].update(status=500, error="Failed to insert record")
+        return {"results": results, "created": 0, "failed": len(payload)}, 207
+    for i, draft_rec in zip(to_insert, draft_recs):
+        results[i].update(status=201, id=draft_rec.id)
+    if draft_recs:
+        notify_changes()
+    if replicate_async():
+        notify_replication()
+        invalidate_cached_drafts(*(draft_rec.id for draft_rec in draft_recs))
+        return batch_response(results, len(payload), len(draft_recs))
+
+    # dynamodb in 25 item BatchWriteItem chunks, s3 uploads in parallel
+    index_by_id = {draft_rec.id: i for i, draft_rec in zip(to_insert, draft_recs)}
+    failed = batch_write_items(ddb_client, DDB_TABLE_NAME, batch_put_requests(payload, index_by_id))
+    uploads = fetch_all(lambda draft_id: put_s3_draft(draft_id, payload[index_by_id[draft_id]]),
+                        list(index_by_id), current_app.config["S3_FETCH_CONCURRENCY"], "s3_upload")
+    add_batch_errors(results, index_by_id, failed, uploads)
+    invalidate_cached_drafts(*index_by_id)
+    return batch_response(results, len(payload), len(draft_recs))
+
+
+def validate_batch(payload):
+    # per draft results, and the indexes of the drafts that can be stored
+    results = [{"index": i} for i in range(len(payload))]
+    valid = []
+    for i, draft_data in enumerate(payload):
+        error = draft_payload_error(draft_data)
+        if error:
+            results[i].update(status=400, error=error)
+        else:
+            valid.append(i)
+    return results, valid
+
+
+def batch_player_names(payload, valid):
+    return list({payload[i]["player_name"] for i in valid})
+
+
+def new_batch_drafts(payload, valid, existing, results):
+    # indexes of the drafts to insert, existing is the set of names already in the db
+    to_insert = []
+    for i in valid:
+        name = payload[i]["player_name"]
+        if name in existing:
+            results[i].update(status=409, error="Player already exists in draft db")
+            continue
+        # also catches the same player twice in one batch
+        existing.add(name)
+        to_insert.append(i)
+    return to_insert
+
+
+def batch_put_requests(payload, index_by_id):
+    return [{"PutRequest": {"Item": dynamodb_draft_item(draft_id, payload[i])}}
+            for draft_id, i in index_by_id.items()]
+
+
+def add_batch_errors(results, index_by_id, failed_writes, uploads):
+    for failed in failed_writes:
+        draft_id = int(failed["PutRequest"]["Item"]["id"]["N"])
+        results[index_by_id[draft_id]].setdefault("errors", {})["dynamodb"] = "DynamoDB batch write failed"
+    for draft_id, _, error in uploads:
+        if error is not None:
+            print(f"S3 put error: {error}")
+            results[index_by_id[draft_id]].setdefault("errors", {})["s3"] = str(error)
+
+
+def batch_response(results, total, created):
+    status = 201 if created == total and all("errors" not in r for r in results) else 207
+    return {"results": results, "created": created, "failed": total - created}, status
+
+
+def replicate_async():
+    return current_app.config["REPLICATION_MODE"] == "async"
+
+
+def outbox_entry(draft_id, operation, draft_data=None):
+    payload = None
+    if draft_data is not None:
+        payload = json.dumps(draft_fields(draft_data))
+    return OutboxEntry(draft_id=draft_id, operation=operation, payload=payload)
+
+
+def enqueue_replication(draft_id, operation, draft_data=None):
+    # joins the caller's transaction, nothing is written until it commits
+    db.session.add(outbox_entry(draft_id, operation, draft_data))
+
+
+def claim_outbox_entries(owner, now):
+    # marks the entries this drain replicates as owned by it until the lease
+    # runs out. every process can drain the same outbox: sqlite runs one write
+    # transaction at a time, so the UPDATE below never hands a row to two
+    # owners. an entry is claimed only when it is the newest one of its draft
+    # and no entry of that draft is under a live lease, so one owner at a
+    # time writes a draft to dynamodb/s3 and never with an older state
+    config = current_app.config
+    max_attempts = config["OUTBOX_MAX_ATTEMPTS"]
+    pending = db.aliased(OutboxEntry)
+    newer = db.aliased(OutboxEntry)
+    leased = db.aliased(OutboxEntry)
+    not_leased = db.or_(OutboxEntry.lease_until.is_(None), OutboxEntry.lease_until < now)
+    # the newest entry carries the full state, older unclaimed ones are done
+    superseded = db.session.execute(
+        db.delete(OutboxEntry)
+        .where(OutboxEntry.attempts < max_attempts, not_leased,
+               db.exists().where(newer.draft_id == OutboxEntry.draft_id, newer.id > OutboxEntry.id))
+    ).rowcount
+    claimable = (db.select(pending.id)
+                 .where(pending.attempts < max_attempts, pending.next_attempt_at <= now,
+                        ~db.exists().where(newer.draft_id == pending.draft_id, newer.id > pending.id),
+                        ~db.exists().where(leased.draft_id == pending.draft_id, leased.lease_until >= now))
+                 .order_by(pending.id)
+                 .limit(config["OUTBOX_BATCH_SIZE"]))
+    db.session.execute(db.update(OutboxEntry)
+                       .where(OutboxEntry.id.in_(claimable))
+                       .values(owner=owner, lease_until=now + config["OUTBOX_LEASE"]))
     db.session.commit()
-    # s3
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_object.html
+    return OutboxEntry.query.filter_by(owner=owner).order_by(OutboxEntry.id).all(), superseded
+
+
+def drain_outbox():
+    # replicate one batch of outbox entries, returns how many were handled
+    config = current_app.config
+    now = time.time()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    entries, superseded = claim_outbox_entries(owner, now)
+    if not entries:
+        return superseded
+    latest = {entry.draft_id: entry for entry in entries}
+
+    failures = {}
+    write_requests = []
+    for draft_id, entry in latest.items():
+        if entry.operation == "put":
+            write_requests.append({"PutRequest": {"Item": dynamodb_draft_item(draft_id, json.loads(entry.payload))}})
+        else:
+            write_requests.append({"DeleteRequest": {"Key": {'id': {'N': str(draft_id)}}}})
+    for failed in batch_write_items(ddb_client, DDB_TABLE_NAME, write_requests):
+        request_key = failed.get("PutRequest", {}).get("Item") or failed["DeleteRequest"]["Key"]
+        failures[int(request_key["id"]["N"])] = "DynamoDB batch write failed"
+
+    def replicate_s3(draft_id):
+        entry = latest[draft_id]
+        if entry.operation == "put":
+            put_s3_draft(draft_id, json.loads(entry.payload))
+        else:
+            s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_draft_key(draft_id))
+    for draft_id, _, error in fetch_all(replicate_s3, list(latest), config["S3_FETCH_CONCURRENCY"], "s3_upload"):
+        if error is not None:
+            failures[draft_id] = f"S3 replication failed: {error}"
+
+    stats = current_app.extensions.setdefault("outbox_stats", {"replicated": 0, "failures": 0})
+    now = time.time()
+    # matching on the owner leaves an entry alone when the lease ran out and
+    # another process claimed it in the meantime
+    for draft_id, error in failures.items():
+        attempts = latest[draft_id].attempts + 1
+        db.session.execute(
+            db.update(OutboxEntry)
+            .where(OutboxEntry.id == latest[draft_id].id, OutboxEntry.owner == owner)
+            .values(attempts=attempts, owner=None, lease_until=None, last_error=error,
+                    next_attempt_at=now + backoff_delay(attempts, config["OUTBOX_RETRY_BASE"])))
+        stats["failures"] += 1
+        print(f"Replication of draft {draft_id} failed: {error}")
+    replicated = [entry.id for draft_id, entry in latest.items() if draft_id not in failures]
+    db.session.execute(db.delete(OutboxEntry).where(OutboxEntry.owner == owner, OutboxEntry.id.in_(replicated)),
+                       execution_options={"synchronize_session": False})
+    stats["replicated"] += len(replicated)
+    db.session.commit()
+    invalidate_cached_drafts(*(draft_id for draft_id in latest if draft_id not in failures))
+    return len(latest) + superseded
+
+
+def pending_outbox_entries():
+    return OutboxEntry.query.filter(OutboxEntry.attempts < current_app.config["OUTBOX_MAX_ATTEMPTS"]).count()
+
+
+def get_outbox_worker():
+    worker = current_app.extensions.get("outbox_worker")
+    if worker is None:
+        worker = OutboxWorker(current_app._get_current_object(), drain_outbox, pending_outbox_entries,
+                              poll_interval=current_app.config["OUTBOX_POLL_INTERVAL"])
+        current_app.extensions["outbox_worker"] = worker
+    return worker
+
+
+def start_outbox_worker(app):
+    # nothing to replicate in sync mode
+    if app.config["REPLICATION_MODE"] == "async":
+        with app.app_context():
+            get_outbox_worker().start()
+
+
+def notify_replication():
+    get_outbox_worker().notify()
+
+
+def flush_outbox(timeout=10.0):
+    # barrier: returns once dynamodb and s3 have caught up with sqlite
+    return get_outbox_worker().flush(timeout)
+
+
+@v1.route('/outbox/stats')
+def get_outbox_stats():
+    max_attempts = current_app.config["OUTBOX_MAX_ATTEMPTS"]
+    oldest = db.session.query(db.func.min(OutboxEntry.created_at)).filter(OutboxEntry.attempts < max_attempts).scalar()
+    stats = current_app.extensions.get("outbox_stats", {"replicated": 0, "failures": 0})
+    return {
+        "mode": current_app.config["REPLICATION_MODE"],
+        "pending": pending_outbox_entries(),
+        "dead": OutboxEntry.query.filter(OutboxEntry.attempts >= max_attempts).count(),
+        "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+        **stats
+    }
+
+
+@v1.route('/outbox/flush', methods=['POST'])
+def post_outbox_flush():
+    drained = flush_outbox(float(request.args.get('timeout', 10)))
+    return get_outbox_stats(), 200 if drained else 504
+
+
+def draft_change(draft_id, operation, draft_data=None):
+    payload = None
+    if draft_data is not None:
+        payload = json.dumps(draft_fields(draft_data))
+    return DraftChange(draft_id=draft_id, operation=operation, payload=payload)
+
+
+def record_draft_change(draft_id, operation, draft_data=None):
+    # joins the caller's transaction like enqueue_replication
+    db.session.add(draft_change(draft_id, operation, draft_data))
+
+
+def get_change_notifier():
+    notifier = current_app.extensions.get("change_notifier")
+    if notifier is None:
+        notifier = current_app.extensions.setdefault("change_notifier", ChangeNotifier())
+    return notifier
+
+
+def notify_changes():
+    # after the commit, wakes the change feed waiters of this process
+    get_change_notifier().notify()
+
+
+def change_data(change):
+    data = {"seq": change.seq, "id": change.draft_id, "operation": change.operation}
+    if change.payload is not None:
+        data["draft"] = {"id": change.draft_id, **json.loads(change.payload)}
+    data["created_at"] = change.created_at
+    return data
+
+
+def change_engine():
+    return current_app.extensions.get("sqlite_read_engine") or db.engine
+
+
+def changes_after(since, limit, engine=None):
+    # a new session per read, a long poll or an event stream has to see rows
+    # committed after it started instead of the snapshot of its first query
+    with Session(engine or change_engine()) as s:
+        changes = (s.query(DraftChange).filter(DraftChange.seq > since)
+                   .order_by(DraftChange.seq).limit(limit).all())
+        return [change_data(change) for change in changes]
+
+
+def change_seq_bounds():
+    # oldest and newest sequence number still recorded, (None, None) before the first write
+    with Session(change_engine()) as s:
+        return s.query(db.func.min(DraftChange.seq), db.func.max(DraftChange.seq)).one()
+
+
+def prune_draft_changes():
+    # deletes changes older than CHANGES_RETENTION, the newest one is always
+    # kept so the feed knows where it stands
+    cutoff = time.time() - current_app.config["CHANGES_RETENTION"]
+    newest = db.session.query(db.func.max(DraftChange.seq)).scalar()
+    if newest is None:
+        return 0
+    pruned = (DraftChange.query.filter(DraftChange.seq < newest, DraftChange.created_at < cutoff)
+              .delete(synchronize_session=False))
+    db.session.commit()
+    return pruned
+
+
+def wants_event_stream():
+    return request.args.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream'
+
+
+@v1.route('/drafts/changes')
+def get_draft_changes():
+    # inserts, updates and tombstones after ?since=<seq>, or after the
+    # Last-Event-ID an EventSource sends when it reconnects. without either
+    # the feed starts at the newest change, the position to hold on to
+    # before a full GET /drafts
+    config = current_app.config
     try:
-        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{id}.json')
-    except Exception as e:
-        print(f"Error occured during S3 object deletion: {e}")
-        return {"message": "Error occured during s3 delete operation"}, 500
+        since = parse_since(request.args.get('since', request.headers.get('Last-Event-ID')))
+        limit = parse_limit(request.args.get('limit'), MAX_PAGE_LIMIT) or DEFAULT_PAGE_LIMIT
+        wait = parse_wait(request.args.get('wait'), config["CHANGES_MAX_WAIT"])
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    oldest, newest = change_seq_bounds()
+    if since is None:
+        since = newest or 0
+    elif oldest is not None and since < oldest - 1:
+        # the changes right after since were pruned
+        return {"error": "changes since this sequence number are no longer kept, sync in full again",
+                "oldest_seq": oldest, "next_since": newest}, 410
+    if wants_event_stream():
+        return change_stream_response(since, limit)
+    changes = wait_for_changes(functools.partial(changes_after, since, limit), get_change_notifier(),
+                               wait, config["CHANGES_POLL_INTERVAL"])
+    return {
+        "changes": changes,
+        "next_since": changes[-1]["seq"] if changes else since,
+        "has_more": len(changes) == limit
+    }
 
-    # ddb
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/delete_item.html
 
+def change_stream_response(since, limit):
+    # bound here, the stream runs after the view has returned
+    config = current_app.config
+    engine = change_engine()
+    events = stream_changes(lambda seq: changes_after(seq, limit, engine), get_change_notifier(), since,
+                            config["CHANGES_STREAM_DURATION"], config["CHANGES_HEARTBEAT"],
+                            config["CHANGES_POLL_INTERVAL"], current_app.json.dumps_line)
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    # no-transform keeps compress_api_response, and proxies, from holding
+    # events back to fill a compression block
+    response.headers["Cache-Control"] = "no-cache, no-transform"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@v1.route('/s3/snapshot')
+def get_s3_snapshot():
+    manifest = current_s3_manifest()
+    if manifest is None:
+        return {"error": "no snapshot"}, 404
+    return dict(manifest, current=manifest_is_current(manifest, collection_version(read_session())))
+
+
+@v1.route('/s3/snapshot', methods=['POST'])
+def post_s3_snapshot():
+    return write_s3_snapshot(), 201
+
+
+def scheduled_reconcile():
+    # imported here, app/reconcile.py builds on this module
+    from app.reconcile import scheduled_reconcile
+    return scheduled_reconcile()
+
+
+# extension name -> (interval config key, job, thread name)
+PERIODIC_TASKS = {
+    "s3_snapshot_task": ("S3_SNAPSHOT_INTERVAL", write_s3_snapshot, "s3-snapshot"),
+    "reconcile_task": ("RECONCILE_INTERVAL", scheduled_reconcile, "reconcile"),
+    "change_prune_task": ("CHANGES_PRUNE_INTERVAL", prune_draft_changes, "change-prune"),
+}
+
+
+def start_periodic_tasks():
+    # runs before each request, starts the periodic threads of this process
+    # whose interval is set
+    for name, (interval_key, job, thread_name) in PERIODIC_TASKS.items():
+        interval = current_app.config[interval_key]
+        if not interval:
+            continue
+        task = current_app.extensions.get(name)
+        if task is None:
+            task = PeriodicTask(current_app._get_current_object(), job, float(interval), thread_name)
+            current_app.extensions[name] = task
+        task.start()
+
+
+def version_conflict(draft_rec, payload=None):
+    # optimistic concurrency: a client can send the etag it read as If-Match,
+    # or the version in the body, and gets a 409 with the current version when
+    # the record has moved on, instead of overwriting someone else's update
+    expected = payload.get("version") if isinstance(payload, dict) else None
+    # weak comparison, a compressed response carries the etag as weak
+    if request.if_match and not request.if_match.contains_weak(draft_etag(draft_rec)):
+        return conflict_response(draft_rec.version)
+    if expected is not None and str(expected) != str(draft_rec.version):
+        return conflict_response(draft_rec.version)
+    return None
+
+
+def conflict_response(version=None):
+    results = {"error": "Draft was changed by another request, reload it and retry"}
+    if version is not None:
+        results["version"] = version
+    return results, 409
+
+
+def commit_versioned():
+    # commit a versioned update/delete, a 409 response when another request
+    # changed or deleted the row since it was loaded
     try:
-        ddb_client.delete_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}})
-    except Exception as e:
-        print(f"Error occured during DynamoDB item deletion: {e}")
-        return {"message": "Error occured during DynamoDB delete operation"}, 500
+        db.session.commit()
+    except StaleDataError as e:
+        db.session.rollback()
+        print(f"Version conflict: {e}")
+        return conflict_response()
+    return None
+
+
+@v1.route('/drafts/<id>', methods=['DELETE'])
+def delete_draft_record(id):
+    # existence validation
+    draft_rec = db.get_or_404(Draft, id)
+    conflict = version_conflict(draft_rec)
+    if conflict:
+        return conflict
+    # sqlite is the source of truth, the dynamodb/s3 deletes are conditional
+    # instead of being checked with a read first
+    db.session.delete(draft_rec)
+    bump_collection_version()
+    # a tombstone in the change feed
+    record_draft_change(draft_rec.id, "delete")
+    if replicate_async():
+        # the other stores catch up from the outbox
+        enqueue_replication(draft_rec.id, "delete")
+    conflict = commit_versioned()
+    if conflict:
+        return conflict
+    notify_changes()
+    if replicate_async():
+        notify_replication()
+        invalidate_cached_drafts(draft_rec.id)
+        return {"message": "Successful deleted record from all storage systems!"}, 200
+
+    legs = run_backend_legs({
+        "s3": lambda: delete_s3_draft(id),
+        "dynamodb": lambda: delete_dynamodb_draft(id)
+    })
+    invalidate_cached_drafts(draft_rec.id)
+    return delete_response(legs)
+
+
+def replica_status(error):
+    if error is None:
+        return "ok"
+    if missing_s3_object(error) or error_code(error) == 'ConditionalCheckFailedException':
+        return "not_found"
+    if error_code(error) == 'PreconditionFailed':
+        return "conflict"
+    return "error"
+
+
+def replicated_write_response(legs, operation, message):
+    # the dynamodb/s3 legs of a PUT or DELETE run after sqlite committed, so
+    # the write has happened whatever they answer. a replica without the
+    # record or that failed turns the response into a 207 with the state of
+    # each store instead of an error for a change that was applied
+    stores = {"sqlite": "ok"}
+    for store, (_, error) in legs.items():
+        stores[store] = replica_status(error)
+        if error is not None:
+            print(f"Error occurred during {store} {operation}: {error}")
+    if all(status == "ok" for status in stores.values()):
+        return {"message": message, "stores": stores}, 200
+    return {"message": f"Draft record {operation} applied to SQLite but not to every replica", "stores": stores}, 207
 
-    return {"message": "Successful deleted record from all storage systems!"}, 200
+
+def delete_response(legs):
+    return replicated_write_response(legs, "delete", "Successful deleted record from all storage systems!")
 
 
 @v1.route('/drafts/<id>', methods=['PUT'])
@@ -248,71 +1725,198 @@ def update_draft_record(id):
     draft_rec = db.get_or_404(Draft, id)
     if not request.json:
         return {"error": "No JSON data provided"}, 400
-    # s3
-    try:
-        s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{id}.json')
-    except s3_client.exceptions.NoSuchKey:
-        return {"message": "s3 object not found"}, 404
-
-    # dynamodb
-    try:
-        ddb_response = ddb_client.get_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}})
-        if 'Item' not in ddb_response:
-            return {"message": "dynamodb item not found"}, 404
-    except Exception as e:
-        print(f"Error during dynamodb get operation:{e}")
-        return {"message": "Error during dynamodb get operation"}, 500
+    error = draft_payload_error(request.json)
+    if error:
+        return {"error": error}, 400
+    conflict = version_conflict(draft_rec, request.json)
+    if conflict:
+        return conflict
     # update all 3 storage systems
     try:
-        draft_rec.draft_pick_number = request.json["pick_number"] 
-        draft_rec.pro_team_name = request.json["pro_team"]
-        draft_rec.player_name = request.json["player_name"]
-        draft_rec.amateur_team_name = request.json["amateur_team"]
-        db.session.commit()
+        previous_data = draft_to_dict(draft_rec)
+        draft_data = update_draft_fields(draft_rec, request.json)
+        bump_collection_version()
+        record_draft_change(draft_rec.id, "update", draft_data)
+        if replicate_async():
+            enqueue_replication(draft_rec.id, "put", draft_data)
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
+        notify_changes()
+        if replicate_async():
+            notify_replication()
+            invalidate_cached_drafts(draft_rec.id)
+            return {"message": "Draft record updated succesfully on all storage systems!"}, 200
 
-        try:
-            s3_data = {
-                "id": int(id),
-                "pick_number": request.json["pick_number"],
-                "pro_team": request.json["pro_team"],
-                "player_name": request.json["player_name"],
-                "amateur_team": request.json["amateur_team"]
-            }
-            s3_client.put_object(
-                Bucket=S3_BUCKET_NAME,
-                Key=f'draft_{id}.json',
-                Body=json.dumps(s3_data)
-            )
-        except Exception as e:
-            print(f"Error occurred during S3 object update: {e}")
-            return {"message": "Error occured during S3 update operation"}, 500
-        
-        try:
-            ddb_client.put_item(
-                TableName=DDB_TABLE_NAME,
-                Item={
-                    "id": {'N': str(id)},
-                    "pick_number": {'S': request.json["pick_number"]},
-                    "pro_team": {'S': request.json["pro_team"]},
-                    "player_name": {'S': request.json["player_name"]},
-                    "amateur_team": {'S': request.json["amateur_team"]}
-                }
-            )
-        except Exception as e:
-            print(f"Error occurred during DynamoDB item update: {e}")
-            return {"message": "Error occured during DynamoDB update operation"}, 500
-            
-        return {"message": "Draft record updated succesfully on all storage systems!"}, 200
+        # conditional writes, one round trip per store instead of a read then a write
+        legs = run_backend_legs({
+            "s3": lambda: update_s3_draft(id, draft_data, previous_data),
+            "dynamodb": lambda: update_dynamodb_draft(id, draft_data)
+        })
+        invalidate_cached_drafts(draft_rec.id)
+        return update_response(legs)
     except KeyError as e:
-        return {"error": f"missing requried field: {e}"}, 400
-    except Exception as e:
+        return {"error": f"missing required field: {e}"}, 400
+    except Exception:
         db.session.rollback()
         return {"error": "Failed to update record"}, 500
 
-#register the blueprint
-app.register_blueprint(v1)
+
+def update_draft_fields(draft_rec, payload):
+    # applies a PUT body to the row and returns the new draft data, KeyError on a missing field
+    draft_data = draft_fields(payload)
+    apply_draft_fields(draft_rec, draft_data)
+    return draft_data
+
+
+def update_response(legs):
+    return replicated_write_response(legs, "update", "Draft record updated succesfully on all storage systems!")
+
+# sqlite statements are timed on every engine
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["statement_started"].pop()
+    record_backend_call("sqlite", statement.split(None, 1)[0].lower(), time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "handle_error")
+def count_statement_error(exception_context):
+    statement = exception_context.statement or "unknown"
+    conn = exception_context.connection
+    started = conn.info["statement_started"].pop() if conn is not None and conn.info.get("statement_started") else time.perf_counter()
+    record_backend_call("sqlite", statement.split(None, 1)[0].lower(), time.perf_counter() - started, failed=True)
+
+
+def start_request_timer():
+    current_timings.set(RequestTimings())
+
+
+def record_request(response):
+    timings = current_timings.get()
+    if timings is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_latency.observe(time.perf_counter() - timings.started, request.method, route, str(response.status_code))
+    if response.content_length is not None:
+        response_size.observe(response.content_length, request.method, route)
+    response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+def get_admission():
+    backend = current_app.config["ADMISSION_BACKEND"]
+    if not backend:
+        return None
+    admission = current_app.extensions.get("admission")
+    if admission is None:
+        admission = make_admission(backend, os.path.join(current_app.instance_path, current_app.config["ADMISSION_PATH"]))
+        current_app.extensions["admission"] = admission
+    return admission
+
+
+def rejected(status, message, retry_after):
+    response = make_response({"error": message}, status)
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admit_request():
+    # runs before each request: rate limit per client and route, then a
+    # concurrency slot on the routes in CONCURRENCY_LIMITS. rejections are
+    # answered here, before any sqlite, dynamodb or s3 work
+    if request.blueprint != "v1" or request.url_rule is None:
+        return None
+    admission = get_admission()
+    if admission is None:
+        return None
+    config = current_app.config
+    route = f"{request.method} {request.url_rule.rule}"
+    rate, burst = config["RATE_LIMITS"].get(route, config["RATE_LIMITS"]["default"])
+    header = config["RATE_LIMIT_CLIENT_HEADER"]
+    client = (request.headers.get(header) if header else None) or request.remote_addr
+    wait = admission.take_token(f"{client} {route}", rate, burst)
+    if wait > 0:
+        admission_decisions.inc(route, "rate_limited")
+        return rejected(429, "rate limit exceeded", wait)
+    limit = config["CONCURRENCY_LIMITS"].get(route)
+    if limit is not None:
+        token = admission.acquire_slot(route, limit)
+        if token is None:
+            admission_decisions.inc(route, "over_capacity")
+            return rejected(503, "too many requests in progress", config["CONCURRENCY_RETRY_AFTER"])
+        g.admission_slot = (admission, route, token)
+    admission_decisions.inc(route, "admitted")
+    return None
+
+
+def release_admission_slot(exc):
+    # teardown runs after a streamed body has been sent, so an ndjson listing
+    # holds its slot until the last line. like close_read_session it also runs
+    # with the app context for test clients that keep the request context
+    if not has_app_context():
+        return
+    slot = g.pop("admission_slot", None)
+    if slot is not None:
+        admission, route, token = slot
+        admission.release_slot(route, token)
+
+
+def compress_api_response(response):
+    compress_response(response, request.accept_encodings, current_app.config)
+    return response
+
+
+def collect_cache_stats():
+    cache = current_app.extensions.get("draft_cache")
+    if cache is None:
+        return {}
+    stats = cache.stats()
+    return {(event,): stats[event] for event in ("hits", "misses", "evictions", "expirations", "invalidations")}
+
+
+def collect_reconcile_drift():
+    report = current_app.extensions.get("reconcile_report")
+    if report is None:
+        return {}
+    return {(store, kind): report[store][kind] for store in ("dynamodb", "s3") for kind in ("missing", "extra", "diverged")}
+
+
+def collect_coalescing():
+    flight = active_single_flight()
+    if flight is None:
+        return {}
+    counts = {}
+    for group, (executed, coalesced_calls) in flight.group_counts().items():
+        counts[(group, "executed")] = executed
+        counts[(group, "coalesced")] = coalesced_calls
+    return counts
+
+
+def collect_outbox_pending():
+    return {(): pending_outbox_entries()}
+
+
+admission_decisions = registry.register(Counter(
+    "draft_admission_total", "Requests admitted, rate limited (429) or over a concurrency limit (503)", ("route", "decision")))
+registry.register(Gauge("draft_cache_events", "Read-through cache counters for this process", ("event",), collect_cache_stats))
+registry.register(Gauge("draft_coalesced_reads", "Reads that ran a backend fetch or shared one already in flight",
+                        ("group", "outcome"), collect_coalescing))
+registry.register(Gauge("draft_outbox_pending", "Outbox entries waiting to replicate", (), collect_outbox_pending))
+registry.register(Gauge("draft_reconcile_drift", "Records that differed from sqlite in the last reconcile run",
+                        ("store", "kind"), collect_reconcile_drift))
+
+
+# prometheus text format
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 #root route for API info
-@app.route('/')
 def root():
     return{
         "message": "Draft API",
@@ -322,10 +1926,142 @@ def root():
         "current_version": "1.0"
     }
 
-if __name__ == '__main__':
+
+def sqlite_options(config):
+    return sqlite_engine_options(config["SQLALCHEMY_DATABASE_URI"],
+                                 pool_size=config["SQLITE_POOL_SIZE"],
+                                 max_overflow=config["SQLITE_MAX_OVERFLOW"],
+                                 pool_timeout=config["SQLITE_POOL_TIMEOUT"],
+                                 statement_cache=config["SQLITE_STATEMENT_CACHE"])
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    # e.g. DRAFT_REPLICATION_MODE=async or DRAFT_BACKEND_CONCURRENCY=64
+    app.config.from_prefixed_env("DRAFT")
+    if config:
+        app.config.update(config)
+    app.json = DraftJSONProvider(app, app.config["JSON_BACKEND"])
+    # an explicit SQLALCHEMY_ENGINE_OPTIONS replaces the sqlite pool settings
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", sqlite_options(app.config))
+    db.init_app(app)
+    pragmas = sqlite_pragmas(app.config["SQLITE_PROFILE"], app.config["SQLITE_PRAGMAS"])
+    with app.app_context():
+        apply_pragmas(db.engine, pragmas)
+        if app.config["SQLITE_READ_ONLY_GETS"]:
+            read_engine = create_read_engine(db.engine, pragmas, app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+            if read_engine is not None:
+                app.extensions["sqlite_read_engine"] = read_engine
+    app.teardown_request(close_read_session)
+    app.teardown_appcontext(close_read_session)
+    app.teardown_request(release_admission_slot)
+    app.teardown_appcontext(release_admission_slot)
+    #register the blueprint
+    if app.config["API_MODE"] == "async":
+        # imported here so aiobotocore and aiosqlite are only needed in async mode
+        from app.async_backends import ensure_sync
+        from app.async_views import v1_async
+        app.ensure_sync = ensure_sync
+        app.register_blueprint(v1_async)
+    elif app.config["API_MODE"] == "sync":
+        app.register_blueprint(v1)
+    else:
+        raise ValueError(f"unknown API_MODE: {app.config['API_MODE']}")
+    app.before_request(start_request_timer)
+    app.before_request(start_periodic_tasks)
+    app.before_request(admit_request)
+    app.after_request(record_request)
+    # after_request hooks run last registered first, so record_request sees the compressed size
+    app.after_request(compress_api_response)
+    app.add_url_rule('/metrics', view_func=metrics)
+    app.add_url_rule('/', view_func=root)
+    if app.config["OUTBOX_AUTOSTART"]:
+        start_outbox_worker(app)
+    return app
+
+
+def initialize_resources(app):
+    # creates the sqlite tables, s3 bucket and dynamodb table, run once per
+    # deployment (the gunicorn master does it before forking workers)
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         initialize_s3(s3_client=s3_client, bucket_name=S3_BUCKET_NAME)
         initialize_dynamodb(dynamodb_client=ddb_client, table_name=DDB_TABLE_NAME)
 
-    app.run(debug=True)
\ No newline at end of file
+
+def upgrade_schema():
+    # db.create_all() creates missing tables but leaves existing ones alone,
+    # so a database from an older release is missing the columns and indexes
+    # added since. add them with ALTER TABLE, a NOT NULL column gets its
+    # python default as the sql default for the rows already there
+    inspector = sqlalchemy.inspect(db.engine)
+    added = set()
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}"
+                if not column.nullable:
+                    ddl += f" NOT NULL DEFAULT {column.default.arg!r}"
+                conn.execute(sqlalchemy.text(ddl))
+                added.add((table.name, column.name))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        if ("draft", "pick_number_value") in added:
+            rows = conn.execute(db.select(Draft.id, Draft.draft_pick_number)).all()
+            if rows:
+                conn.execute(db.update(Draft).where(Draft.id == sqlalchemy.bindparam("draft_id"))
+                             .values(pick_number_value=sqlalchemy.bindparam("value")),
+                             [{"draft_id": draft_id, "value": parse_pick_number(pick)} for draft_id, pick in rows])
+    return sorted(added)
+
+
+def reset_worker_state(app):
+    # called in each worker right after fork: connections and threads from
+    # the parent process must not be shared with the child
+    with app.app_context():
+        # close=False leaves the parent's sqlite connections alone
+        db.engine.dispose(close=False)
+    if "sqlite_read_engine" in app.extensions:
+        app.extensions["sqlite_read_engine"].dispose(close=False)
+    configure_clients()
+    if app.config["API_MODE"] == "async":
+        from app.async_backends import reset_backend_loop
+        reset_backend_loop()
+    # background threads do not survive a fork, these are rebuilt on first
+    # use, the outbox worker by start_outbox_worker() in the post_fork hook
+    app.extensions.pop("outbox_worker", None)
+    app.extensions.pop("draft_cache", None)
+    app.extensions.pop("admission", None)
+    app.extensions.pop("s3_snapshot_task", None)
+    app.extensions.pop("reconcile_task", None)
+    app.extensions.pop("change_prune_task", None)
+    app.extensions.pop("change_notifier", None)
+    app.extensions.pop("single_flight", None)
+    app.extensions.pop("async_single_flight", None)
+    app.extensions.pop("s3_snapshot", None)
+
+
+_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # the module level `app` (tests, python app/application.py) is built on
+    # first use instead of at import, so importing this module for its
+    # helpers, as wsgi.py, gunicorn.conf.py and the scripts do, builds no app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if "app" not in globals():
+            globals()["app"] = create_app()
+    return globals()["app"]
+
+
+if __name__ == '__main__':
+    app = create_app()
+    initialize_resources(app)
+    app.run(debug=True)
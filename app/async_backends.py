@@ -0,0 +1,235 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import os
+import threading
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.aws_clients import AWS_SETTINGS, in_process_client
+from app.metrics import timed_async_call
+from app.sqlite_tuning import apply_pragmas, is_memory_database
+
+# one event loop thread per process runs every coroutine view, together with the
+# aiobotocore clients and async sqlite engines they use. those are bound to the
+# loop that created them, so they live and die with it and a forked worker
+# starts its own on first use
+_loops = {}
+_loops_lock = threading.Lock()
+
+
+def create_async_client(service: str, settings: dict = AWS_SETTINGS):
+    # https://aiobotocore.aio-libs.org/en/latest/tutorial.html
+    # same endpoint, pool size, retries and timeouts as the boto3 clients in app/aws_clients.py
+    return get_session().create_client(
+        service,
+        endpoint_url=settings["endpoint_url"],
+        region_name=settings["region_name"],
+        aws_access_key_id=settings["aws_access_key_id"],
+        aws_secret_access_key=settings["aws_secret_access_key"],
+        config=AioConfig(
+            max_pool_connections=settings["max_pool_connections"],
+            retries={"mode": "adaptive", "max_attempts": settings["max_attempts"]},
+            connect_timeout=settings["connect_timeout"],
+            read_timeout=settings["read_timeout"],
+        ),
+    )
+
+
+class BackendLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.clients = {}
+        self.engines = {}
+        self._clients_lock = asyncio.Lock()
+        self._exit_stack = contextlib.AsyncExitStack()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="backend-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        # runs coro on the loop and blocks the calling thread until it finishes.
+        # the task gets a copy of the caller's context, so the flask request and
+        # the per request metrics are visible inside it
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def client(self, service: str):
+        client = self.clients.get(service)
+        if client is None:
+            async with self._clients_lock:
+                client = self.clients.get(service)
+                if client is None:
+                    client = await self._exit_stack.enter_async_context(create_async_client(service))
+                    self.clients[service] = client
+        return client
+
+    def engine(self, url, options: dict, pragmas: dict, read_only: bool = False):
+        # only touched from the loop thread, so no lock is needed
+        key = (url.render_as_string(hide_password=False), read_only)
+        engine = self.engines.get(key)
+        if engine is None:
+            engine = self.engines[key] = create_async_engine(url, **options)
+            apply_pragmas(engine.sync_engine, pragmas, read_only=read_only)
+        return engine
+
+
+def get_backend_loop() -> BackendLoop:
+    pid = os.getpid()
+    backend_loop = _loops.get(pid)
+    if backend_loop is None:
+        with _loops_lock:
+            backend_loop = _loops.get(pid)
+            if backend_loop is None:
+                backend_loop = _loops[pid] = BackendLoop()
+    return backend_loop
+
+
+def reset_backend_loop() -> None:
+    # after a fork the parent's loop thread is gone, drop it without closing
+    # anything so the parent's connections are left alone
+    with _loops_lock:
+        _loops.clear()
+
+
+def run_coroutine(coro):
+    return get_backend_loop().run(coro)
+
+
+def ensure_sync(func):
+    # replaces Flask.ensure_sync: coroutine views run on the shared backend
+    # loop instead of a new event loop per request
+    # https://flask.palletsprojects.com/en/stable/async-await/
+    if not inspect.iscoroutinefunction(func):
+        return func
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        return run_coroutine(func(*args, **kwargs))
+    return run
+
+
+def async_session(url, options: dict, pragmas: dict, read_only: bool = False) -> AsyncSession:
+    # url is the sync engine url, sqlite is reached through aiosqlite with the
+    # same pool options and pragmas. an in memory database has no second pool
+    read_only = read_only and not is_memory_database(url)
+    engine = get_backend_loop().engine(url.set(drivername="sqlite+aiosqlite"), options, pragmas, read_only)
+    return AsyncSession(engine, expire_on_commit=False)
+
+
+class AsyncClientProxy:
+    # awaitable counterpart of app.aws_clients.ClientProxy. an override set with
+    # override_client() or the local backend (app/local_aws.py) runs on a worker thread
+    def __init__(self, service: str):
+        self._service = service
+
+    def __getattr__(self, name):
+        override = in_process_client(self._service)
+        if override is not None:
+            operation = getattr(override, name)
+
+            async def call(*args, **kwargs):
+                return await asyncio.to_thread(operation, *args, **kwargs)
+        else:
+            async def call(*args, **kwargs):
+                client = await get_backend_loop().client(self._service)
+                return await getattr(client, name)(*args, **kwargs)
+        return timed_async_call(self._service, name, call)
+
+    def __repr__(self):
+        return f"AsyncClientProxy({self._service!r})"
+
+
+async def read_body(body) -> bytes:
+    # aiobotocore bodies are read with await, the local fakes return plain bytes
+    data = body.read()
+    if inspect.isawaitable(data):
+        data = await data
+    return data
+
+
+async def gather_all(fetch, keys: list, max_concurrency: int) -> list:
+    # fetch_all for coroutines: (key, result, error) tuples in the order of keys,
+    # with at most max_concurrency fetches running at once
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def one(key):
+        async with semaphore:
+            try:
+                return key, await fetch(key), None
+            except Exception as e:
+                return key, None, e
+    return list(await asyncio.gather(*(one(key) for key in keys)))
+
+
+async def run_legs(legs: dict, timeouts: dict) -> dict:
+    # collect_legs for coroutines: legs maps a backend name to a coroutine,
+    # returns name -> (result, error) and cancels a leg that runs past its timeout
+    async def leg(name, coro):
+        timeout = timeouts.get(name)
+        try:
+            return await asyncio.wait_for(coro, timeout), None
+        except TimeoutError:
+            return None, TimeoutError(f"{name} did not respond within {timeout}s")
+        except Exception as e:
+            return None, e
+    results = await asyncio.gather(*(leg(name, coro) for name, coro in legs.items()))
+    return dict(zip(legs, results))
+
+
+async def hedged(calls: dict, delay: float, timeout: float, accept=None):
+    # app.executor.hedged for coroutines: calls maps a name to a zero argument
+    # coroutine function. the losers are really cancelled here, not just dropped
+    remaining = list(calls.items())
+    pending = {}
+    errors = {}
+    deadline = asyncio.get_running_loop().time() + timeout
+
+    def launch():
+        name, call = remaining.pop(0)
+        pending[asyncio.ensure_future(call())] = name
+
+    launch()
+    try:
+        while pending:
+            left = deadline - asyncio.get_running_loop().time()
+            if left <= 0:
+                break
+            done, _ = await asyncio.wait(pending, timeout=min(delay, left) if remaining else left,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = pending.pop(task)
+                if task.exception() is not None:
+                    errors[name] = task.exception()
+                elif accept is None or accept(task.result()):
+                    return name, task.result(), errors
+                else:
+                    errors[name] = LookupError(f"{name} had no answer")
+            if remaining:
+                launch()
+        for name in pending.values():
+            errors.setdefault(name, TimeoutError(f"{name} did not respond within {timeout}s"))
+        return None, None, errors
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def async_pool_stats(service: str) -> dict:
+    # connection usage of the aiohttp connectors behind the aiobotocore client
+    stats = {"max_pool_connections": AWS_SETTINGS["max_pool_connections"], "pools": []}
+    backend_loop = _loops.get(os.getpid())
+    client = backend_loop.clients.get(service) if backend_loop is not None else None
+    if client is None:
+        return stats
+    for session in list(getattr(client._endpoint.http_session, "_sessions", {}).values()):
+        connector = session.connector
+        if connector is None:
+            continue
+        stats["pools"].append({
+            "maxsize": connector.limit,
+            "in_use": len(connector._acquired),
+            "idle": sum(len(conns) for conns in connector._conns.values()),
+        })
+    return stats
@@ -0,0 +1,559 @@
+# coroutine versions of the /api/v1 views, registered instead of the blocking
+# ones when API_MODE is "async". every view runs on the process wide event loop
+# from app/async_backends.py, so a request waiting on sqlite, dynamodb or s3
+# does not hold a thread and the backend calls of one request overlap.
+# request parsing, validation and response building are shared with app/application.py
+import asyncio
+import functools
+
+from flask import Blueprint, current_app, request
+from botocore.exceptions import ClientError
+from sqlalchemy import select
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import NotFound
+
+from app.application import (
+    db, Draft, CollectionVersion, S3_BUCKET_NAME, DDB_TABLE_NAME, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, MAX_BATCH_SIZE,
+    index, get_cache_stats, get_admission_stats, get_outbox_stats, post_outbox_flush, get_s3_snapshot, post_s3_snapshot,
+    draft_etag, collection_version_etag, collection_version_update, not_modified, with_etag,
+    draft_filter_clauses, sqlite_page_query, page_after, sqlite_draft_data,
+    dynamodb_page_args, index_unavailable, dynamodb_page_output, dynamodb_draft_data, dynamodb_draft_item,
+    s3_draft_key, s3_draft_object, s3_draft_etag, s3_list_args, s3_listing_keys, s3_page_output,
+    cached_s3_snapshot, cache_s3_snapshot, missing_s3_object, error_code,
+    parse_drafts_args, iter_draft_records, ndjson_drafts_response, drafts_response,
+    parse_read_source, source_stores, hedge_first_page, output_stores, hedge_settings, hedged_page_result,
+    prefetched_reader, fastest_record_response,
+    add_backend_records, cached_draft_record, cache_draft_record, invalidate_cached_drafts,
+    new_draft_record, draft_payload_error, read_batch_payload, validate_batch, batch_player_names, new_batch_drafts,
+    batch_put_requests, add_batch_errors, batch_response, delete_response, ITEM_EXISTS,
+    update_draft_fields, update_response, version_conflict, conflict_response, replicate_async, outbox_entry, notify_replication,
+    get_draft_changes, draft_change, notify_changes, export_drafts, get_coalescing_stats, drafts_flight_key,
+    draft_cache_key
+)
+from app.async_backends import (
+    AsyncClientProxy, async_session, async_pool_stats, gather_all, hedged, read_body, run_coroutine, run_legs
+)
+from app.batch import batch_write_items_async, chunked
+from app.s3_format import MANIFEST_KEY, decode_manifest, decode_record, decode_snapshot, manifest_is_current, snapshot_page
+from app.serialization import draft_to_dict
+from app.singleflight import AsyncSingleFlight
+from app.sqlite_tuning import sqlite_pragmas
+
+s3_client = AsyncClientProxy("s3")
+ddb_client = AsyncClientProxy("dynamodb")
+
+v1_async = Blueprint('v1', __name__, url_prefix='/api/v1')
+# these only touch local state, the blocking views are fine as they are
+v1_async.add_url_rule('/', view_func=index)
+v1_async.add_url_rule('/cache/stats', view_func=get_cache_stats)
+v1_async.add_url_rule('/admission/stats', view_func=get_admission_stats)
+v1_async.add_url_rule('/coalescing/stats', view_func=get_coalescing_stats)
+v1_async.add_url_rule('/outbox/stats', view_func=get_outbox_stats)
+v1_async.add_url_rule('/outbox/flush', view_func=post_outbox_flush, methods=['POST'])
+# snapshots are written rarely and by one request at a time
+v1_async.add_url_rule('/s3/snapshot', view_func=get_s3_snapshot)
+v1_async.add_url_rule('/s3/snapshot', view_func=post_s3_snapshot, methods=['POST'])
+# a long poll or event stream waits on its request thread, not on the loop
+v1_async.add_url_rule('/drafts/changes', view_func=get_draft_changes)
+# an export streams from the blocking sqlite engine, one request at a time per slot
+v1_async.add_url_rule('/drafts/export', view_func=export_drafts)
+
+
+def session(read_only=False):
+    # same database, pool settings and pragmas as db.session, through aiosqlite
+    config = current_app.config
+    return async_session(db.engine.url, config["SQLALCHEMY_ENGINE_OPTIONS"],
+                         sqlite_pragmas(config["SQLITE_PROFILE"], config["SQLITE_PRAGMAS"]), read_only)
+
+
+def read_session():
+    # GET handlers read through the read only pool, see SQLITE_READ_ONLY_GETS
+    return session(read_only=current_app.config["SQLITE_READ_ONLY_GETS"])
+
+
+def get_async_single_flight():
+    # lives with the backend loop of this process, like the clients and engines
+    if not current_app.config["SINGLE_FLIGHT"]:
+        return None
+    flight = current_app.extensions.get("async_single_flight")
+    if flight is None:
+        flight = current_app.extensions.setdefault(
+            "async_single_flight", AsyncSingleFlight(current_app.config["SINGLE_FLIGHT_TRACKED_KEYS"]))
+    return flight
+
+
+async def coalesced(group, detail, fn):
+    flight = get_async_single_flight()
+    if flight is None:
+        return await fn()
+    result, _ = await flight.do((group, detail), fn)
+    return result
+
+
+async def get_or_404(s, id):
+    draft_rec = await s.get(Draft, id)
+    if draft_rec is None:
+        raise NotFound()
+    return draft_rec
+
+
+async def collection_etag():
+    async with read_session() as s:
+        return collection_version_etag(await s.get(CollectionVersion, 1))
+
+
+async def bump_collection_version(s):
+    updated = (await s.execute(collection_version_update())).rowcount
+    if not updated:
+        s.add(CollectionVersion(id=1, version=1))
+
+
+async def sqlite_draft_page(after_id, limit, filters):
+    query = sqlite_page_query(select(Draft).where(*draft_filter_clauses(filters)), after_id, limit)
+    async with read_session() as s:
+        drafts = (await s.scalars(query)).all()
+    drafts, next_position = page_after(drafts, limit, lambda d: d.id)
+    return [sqlite_draft_data(d) for d in drafts], [], next_position
+
+
+async def dynamodb_draft_page(start_key, limit, filters):
+    index_name, scan_args = dynamodb_page_args(start_key, limit, filters)
+    ddb_draft_response = None
+    if index_name is not None:
+        try:
+            ddb_draft_response = await ddb_client.query(IndexName=index_name, **scan_args)
+        except ClientError as e:
+            if not index_unavailable(e, index_name, scan_args):
+                raise
+    if ddb_draft_response is None:
+        ddb_draft_response = await ddb_client.scan(**scan_args)
+    return dynamodb_page_output(ddb_draft_response)
+
+
+async def fetch_s3_draft(key):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/get_object.html
+    file_response = await s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=key)
+    return decode_record(await read_body(file_response['Body']), file_response)
+
+
+async def current_s3_manifest():
+    try:
+        response = await s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=MANIFEST_KEY)
+    except ClientError as e:
+        if missing_s3_object(e):
+            return None
+        raise
+    return decode_manifest(await read_body(response['Body']))
+
+
+async def s3_snapshot_drafts():
+    if not current_app.config["S3_SNAPSHOT_READS"]:
+        return None
+    manifest = await current_s3_manifest()
+    async with read_session() as s:
+        version = await s.get(CollectionVersion, 1)
+    if not manifest_is_current(manifest, version.version if version else 0):
+        return None
+    drafts = cached_s3_snapshot(manifest)
+    if drafts is None:
+        response = await s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=manifest["key"])
+        drafts = cache_s3_snapshot(manifest, decode_snapshot(await read_body(response['Body']), response))
+    return drafts
+
+
+async def s3_draft_page(position, limit, filters):
+    if filters:
+        query = sqlite_page_query(select(Draft.id).where(*draft_filter_clauses(filters)), position, limit)
+        async with read_session() as s:
+            ids = (await s.scalars(query)).all()
+        ids, next_position = page_after(ids, limit, lambda draft_id: draft_id)
+        keys = [s3_draft_key(draft_id) for draft_id in ids]
+    else:
+        snapshot = await s3_snapshot_drafts()
+        if snapshot is not None:
+            drafts, next_position = snapshot_page(snapshot, position, limit)
+            return drafts, [], next_position
+        keys, next_position = s3_listing_keys(await s3_client.list_objects_v2(**s3_list_args(position, limit)))
+    fetched = await gather_all(fetch_s3_draft, keys, current_app.config["S3_FETCH_CONCURRENCY"])
+    return s3_page_output(fetched, next_position)
+
+
+draft_page_readers = {
+    "sqlite": sqlite_draft_page,
+    "dynamodb": dynamodb_draft_page,
+    "s3": s3_draft_page
+}
+
+
+async def read_draft_page(store, position, limit, filters):
+    try:
+        return await draft_page_readers[store](position, limit, filters)
+    except Exception as e:
+        print(f"Error retrieving {store} records: {e}")
+        return [], [{"error": str(e)}], None
+
+
+def blocking_page_reader(app):
+    # page reader for the ndjson stream, which is consumed on the request thread
+    # after the view has returned, so each page gets its own app context there
+    def read_page(store, position, limit, filters):
+        with app.app_context():
+            return run_coroutine(read_draft_page(store, position, limit, filters))
+    return read_page
+
+
+@v1_async.route('/drafts')
+async def get_drafts():
+    etag = await collection_etag()
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    try:
+        limit, filters, positions, source = parse_drafts_args(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    hedge = hedge_first_page(source, request.args)
+
+    if request.args.get('format') == 'ndjson':
+        prefetched = None
+        if hedge:
+            prefetched = await fastest_page(tuple(positions), limit or DEFAULT_PAGE_LIMIT, filters)
+            positions = {prefetched[0]: None}
+        read_page = blocking_page_reader(current_app._get_current_object())
+        if prefetched is not None:
+            read_page = prefetched_reader(*prefetched, read_page)
+        records = iter_draft_records(positions, filters, read_page)
+        # stream_with_context would push the request context on the loop thread
+        return ndjson_drafts_response(records, etag, stream=iter)
+
+    output, errors, next_positions = await coalesced(
+        "drafts", drafts_flight_key(etag), lambda: read_drafts(source, positions, limit, filters, hedge))
+    return drafts_response(output, errors, limit, next_positions, etag)
+
+
+async def read_drafts(source, positions, limit, filters, hedge):
+    prefetched = None
+    if hedge:
+        prefetched = await fastest_page(tuple(positions), limit or MAX_PAGE_LIMIT, filters)
+        positions = {prefetched[0]: None}
+
+    async def read_page(store, position, limit, filters):
+        if prefetched is not None and position is None:
+            return prefetched[1]
+        return await read_draft_page(store, position, limit, filters)
+
+    async def read_store(store, position):
+        if limit is not None:
+            return await read_page(store, position, limit, filters)
+        # no limit requested, so keep following pages instead of truncating
+        records = []
+        errors = []
+        while True:
+            page, page_errors, position = await read_page(store, position, MAX_PAGE_LIMIT, filters)
+            records.extend(page)
+            errors.extend(page_errors)
+            if position is None:
+                return records, errors, None
+
+    # the three stores are read at the same time
+    pages = await asyncio.gather(*(read_store(store, position) for store, position in positions.items()))
+    output = {store: [] for store in output_stores(source, positions)}
+    errors = {}
+    next_positions = {}
+    for store, (records, store_errors, next_position) in zip(positions, pages):
+        output[store] = records
+        if store_errors:
+            errors[store] = store_errors
+        next_positions[store] = next_position
+    return output, errors, next_positions
+
+
+async def fastest_page(stores, limit, filters):
+    delay, timeout = hedge_settings()
+    calls = {store: functools.partial(draft_page_readers[store], None, limit, filters) for store in stores}
+    return hedged_page_result(stores, *await hedged(calls, delay, timeout))
+
+
+async def get_dynamodb_draft(id):
+    ddb_response = await ddb_client.get_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}})
+    if 'Item' not in ddb_response:
+        return None
+    return dynamodb_draft_data(ddb_response['Item'])
+
+
+async def get_s3_draft(id):
+    return await fetch_s3_draft(s3_draft_key(id))
+
+
+async def put_dynamodb_draft(draft_id, draft_data):
+    await ddb_client.put_item(TableName=DDB_TABLE_NAME, Item=dynamodb_draft_item(draft_id, draft_data))
+
+
+async def put_s3_draft(draft_id, draft_data):
+    await s3_client.put_object(**s3_draft_object(draft_id, draft_data))
+
+
+async def update_dynamodb_draft(draft_id, draft_data):
+    await ddb_client.put_item(TableName=DDB_TABLE_NAME, Item=dynamodb_draft_item(draft_id, draft_data),
+                              ConditionExpression=ITEM_EXISTS)
+
+
+async def update_s3_draft(draft_id, draft_data, previous_data):
+    try:
+        await s3_client.put_object(**s3_draft_object(draft_id, draft_data), IfMatch=s3_draft_etag(draft_id, previous_data))
+    except ClientError as e:
+        if error_code(e) != 'PreconditionFailed':
+            raise
+        current = await s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_draft_key(draft_id))
+        async with session() as s:
+            draft_rec = await s.get(Draft, draft_id)
+        if draft_rec is None:
+            raise
+        await s3_client.put_object(**s3_draft_object(draft_id, draft_to_dict(draft_rec)), IfMatch=current["ETag"])
+
+
+async def commit_versioned(s):
+    try:
+        await s.commit()
+    except StaleDataError as e:
+        await s.rollback()
+        print(f"Version conflict: {e}")
+        return conflict_response()
+    return None
+
+
+async def run_backend_legs(legs):
+    return await run_legs(legs, current_app.config["BACKEND_TIMEOUTS"])
+
+
+@v1_async.route('/pools/stats')
+async def get_pool_stats():
+    return {"s3": async_pool_stats("s3"), "dynamodb": async_pool_stats("dynamodb")}
+
+
+@v1_async.route('/drafts/<id>')
+async def get_draft_record(id):
+    try:
+        source = parse_read_source(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if source == "fastest":
+        return await fastest_draft_record(id)
+    stores = source_stores(source)
+    results = {}
+    cacheable = True
+    etag = None
+    try:
+        etag, results["sqlite"] = await read_sqlite_record(id)
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+    except Exception as e:
+        print(f"Error retrieving record from sqlite db: {e}")
+        results["sqlite"]={"error": "Record not found"}
+        cacheable = isinstance(e, NotFound)
+    if "sqlite" not in stores:
+        del results["sqlite"]
+    remote = [store for store in ("dynamodb", "s3") if store in stores]
+    if not remote:
+        return with_etag(results, etag)
+
+    if source == "all":
+        cached = cached_draft_record(id, etag)
+        if cached is not None:
+            return with_etag(cached, etag)
+
+    flight_key = (draft_cache_key(id) or id, etag, tuple(remote))
+    legs = await coalesced("draft", flight_key, lambda: read_remote_records(id, remote))
+    cacheable = add_backend_records(results, legs) and cacheable
+    if cacheable and source == "all":
+        cache_draft_record(id, etag, results)
+    return with_etag(results, etag)
+
+
+async def read_sqlite_record(id):
+    async with read_session() as s:
+        draft_rec = await get_or_404(s, id)
+    return draft_etag(draft_rec), sqlite_draft_data(draft_rec, with_id=True)
+
+
+async def read_remote_records(id, remote):
+    readers = {"dynamodb": get_dynamodb_draft, "s3": get_s3_draft}
+    return await run_backend_legs({store: readers[store](id) for store in remote})
+
+
+async def get_sqlite_draft(id):
+    async with read_session() as s:
+        return await s.get(Draft, id)
+
+
+async def fastest_draft_record(id):
+    delay, timeout = hedge_settings()
+    readers = {"sqlite": get_sqlite_draft, "dynamodb": get_dynamodb_draft, "s3": get_s3_draft}
+    stores = source_stores("fastest")
+    calls = {store: functools.partial(readers[store], id) for store in stores}
+    store, record, errors = await hedged(calls, delay, timeout, accept=lambda record: record is not None)
+    return fastest_record_response(stores, store, record, errors)
+
+
+@v1_async.route('/drafts', methods=['POST'])
+async def add_draft_record():
+    draft_data = request.json
+    error = draft_payload_error(draft_data)
+    if error:
+        return {"error": error}, 400
+    async with session() as s:
+        dupe_player = (await s.scalars(
+            select(Draft.id).where(Draft.player_name == draft_data["player_name"]).limit(1))).first()
+        if dupe_player is not None:
+            return {"error": "Player already exists in draft db"}, 409
+        draft_rec = new_draft_record(draft_data)
+        s.add(draft_rec)
+        await bump_collection_version(s)
+        await s.flush()
+        s.add(draft_change(draft_rec.id, "insert", draft_data))
+        if replicate_async():
+            s.add(outbox_entry(draft_rec.id, "put", draft_data))
+            await s.commit()
+            notify_changes()
+            notify_replication()
+            invalidate_cached_drafts(draft_rec.id)
+            return {"id": draft_rec.id}, 201
+        await s.commit()
+    notify_changes()
+    draft_id = draft_rec.id
+
+    legs = await run_backend_legs({
+        "dynamodb": put_dynamodb_draft(draft_id, draft_data),
+        "s3": put_s3_draft(draft_id, draft_data)
+    })
+    invalidate_cached_drafts(draft_id)
+    if legs["dynamodb"][1] is not None:
+        print(f"DynamoDB put error: {legs['dynamodb'][1]}")
+    if legs["s3"][1] is not None:
+        print(f"S3 put error: {legs['s3'][1]}")
+
+    return {"id": draft_id}, 201
+
+
+@v1_async.route('/drafts:batch', methods=['POST'])
+async def add_draft_records_batch():
+    try:
+        payload = read_batch_payload()
+    except ValueError as e:
+        return {"error": f"invalid batch payload: {e}"}, 400
+    if len(payload) > MAX_BATCH_SIZE:
+        return {"error": f"batch is limited to {MAX_BATCH_SIZE} drafts"}, 413
+
+    results, valid = validate_batch(payload)
+    async with session() as s:
+        existing = set()
+        for chunk in chunked(batch_player_names(payload, valid), 500):
+            existing.update(await s.scalars(select(Draft.player_name).where(Draft.player_name.in_(chunk))))
+        to_insert = new_batch_drafts(payload, valid, existing, results)
+
+        draft_recs = [new_draft_record(payload[i]) for i in to_insert]
+        try:
+            s.add_all(draft_recs)
+            await bump_collection_version(s)
+            await s.flush()
+            for i, draft_rec in zip(to_insert, draft_recs):
+                s.add(draft_change(draft_rec.id, "insert", payload[i]))
+                if replicate_async():
+                    s.add(outbox_entry(draft_rec.id, "put", payload[i]))
+            await s.commit()
+        except Exception as e:
+            await s.rollback()
+            print(f"Error during batch insert: {e}")
+            for i in to_insert:
+                results[i].update(status=500, error="Failed to insert record")
+            return {"results": results, "created": 0, "failed": len(payload)}, 207
+    for i, draft_rec in zip(to_insert, draft_recs):
+        results[i].update(status=201, id=draft_rec.id)
+    if draft_recs:
+        notify_changes()
+    if replicate_async():
+        notify_replication()
+        invalidate_cached_drafts(*(draft_rec.id for draft_rec in draft_recs))
+        return batch_response(results, len(payload), len(draft_recs))
+
+    # the dynamodb batch writes and the s3 uploads run at the same time
+    index_by_id = {draft_rec.id: i for i, draft_rec in zip(to_insert, draft_recs)}
+    failed, uploads = await asyncio.gather(
+        batch_write_items_async(ddb_client, DDB_TABLE_NAME, batch_put_requests(payload, index_by_id)),
+        gather_all(lambda draft_id: put_s3_draft(draft_id, payload[index_by_id[draft_id]]),
+                   list(index_by_id), current_app.config["S3_FETCH_CONCURRENCY"])
+    )
+    add_batch_errors(results, index_by_id, failed, uploads)
+    invalidate_cached_drafts(*index_by_id)
+    return batch_response(results, len(payload), len(draft_recs))
+
+
+@v1_async.route('/drafts/<id>', methods=['DELETE'])
+async def delete_draft_record(id):
+    async with session() as s:
+        draft_rec = await get_or_404(s, id)
+        conflict = version_conflict(draft_rec)
+        if conflict:
+            return conflict
+        await s.delete(draft_rec)
+        await bump_collection_version(s)
+        s.add(draft_change(draft_rec.id, "delete"))
+        if replicate_async():
+            s.add(outbox_entry(draft_rec.id, "delete"))
+        conflict = await commit_versioned(s)
+        if conflict:
+            return conflict
+    notify_changes()
+    if replicate_async():
+        notify_replication()
+        invalidate_cached_drafts(draft_rec.id)
+        return {"message": "Successful deleted record from all storage systems!"}, 200
+    legs = await run_backend_legs({
+        "s3": s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_draft_key(id)),
+        "dynamodb": ddb_client.delete_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(id)}},
+                                           ConditionExpression=ITEM_EXISTS)
+    })
+    invalidate_cached_drafts(draft_rec.id)
+    return delete_response(legs)
+
+
+@v1_async.route('/drafts/<id>', methods=['PUT'])
+async def update_draft_record(id):
+    async with session() as s:
+        draft_rec = await get_or_404(s, id)
+        if not request.json:
+            return {"error": "No JSON data provided"}, 400
+        error = draft_payload_error(request.json)
+        if error:
+            return {"error": error}, 400
+        conflict = version_conflict(draft_rec, request.json)
+        if conflict:
+            return conflict
+        try:
+            previous_data = draft_to_dict(draft_rec)
+            draft_data = update_draft_fields(draft_rec, request.json)
+            await bump_collection_version(s)
+            s.add(draft_change(draft_rec.id, "update", draft_data))
+            if replicate_async():
+                s.add(outbox_entry(draft_rec.id, "put", draft_data))
+            conflict = await commit_versioned(s)
+            if conflict:
+                return conflict
+            notify_changes()
+            if replicate_async():
+                notify_replication()
+                invalidate_cached_drafts(draft_rec.id)
+                return {"message": "Draft record updated succesfully on all storage systems!"}, 200
+
+            legs = await run_backend_legs({
+                "s3": update_s3_draft(id, draft_data, previous_data),
+                "dynamodb": update_dynamodb_draft(id, draft_data)
+            })
+            invalidate_cached_drafts(draft_rec.id)
+            return update_response(legs)
+        except KeyError as e:
+            return {"error": f"missing required field: {e}"}, 400
+        except Exception:
+            await s.rollback()
+            return {"error": "Failed to update record"}, 500
@@ -0,0 +1,173 @@
+import os
+import threading
+from app.metrics import timed_call
+
+# connection settings for the s3 and dynamodb clients, read from the
+# environment so each deployment can size the pool for its own traffic
+AWS_SETTINGS = {
+    # "boto3" talks to AWS_ENDPOINT_URL (localstack or aws), "local" serves s3
+    # and dynamodb from the in process fakes in app/local_aws.py, no network.
+    # each process then has its own data, so it is meant for tests and benchmarks
+    "backend": os.environ.get("AWS_BACKEND", "boto3"),
+    "endpoint_url": os.environ.get("AWS_ENDPOINT_URL", "http://localhost:4566"),
+    "region_name": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+    "aws_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID", "test"),
+    "aws_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY", "test"),
+    "max_pool_connections": int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "64")),
+    "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", "3")),
+    "connect_timeout": float(os.environ.get("AWS_CONNECT_TIMEOUT", "2")),
+    "read_timeout": float(os.environ.get("AWS_READ_TIMEOUT", "10")),
+    "tcp_keepalive": os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() == "true",
+    # latency added to every call of the local backend, a fixed part plus a
+    # random part drawn from a seeded generator so runs are repeatable
+    "local_latency_ms": float(os.environ.get("AWS_LOCAL_LATENCY_MS", "0")),
+    "local_jitter_ms": float(os.environ.get("AWS_LOCAL_JITTER_MS", "0")),
+    "local_seed": int(os.environ.get("AWS_LOCAL_SEED", "6620")),
+}
+
+# clients are cached per process, a forked worker builds its own on first use
+_clients = {}
+_overrides = {}
+_clients_lock = threading.Lock()
+
+
+def client_config(settings: dict):
+    # https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+    # boto3/botocore.config are imported on the first client, not with this
+    # module, they are most of the import time of app.application
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=settings["max_pool_connections"],
+        retries={"mode": "adaptive", "max_attempts": settings["max_attempts"]},
+        connect_timeout=settings["connect_timeout"],
+        read_timeout=settings["read_timeout"],
+        tcp_keepalive=settings["tcp_keepalive"],
+    )
+
+
+def create_boto3_client(service: str, settings: dict):
+    import boto3
+    # sessions are not thread safe, so every client gets its own
+    session = boto3.session.Session()
+    return session.client(
+        service,
+        endpoint_url=settings["endpoint_url"],
+        region_name=settings["region_name"],
+        aws_access_key_id=settings["aws_access_key_id"],
+        aws_secret_access_key=settings["aws_secret_access_key"],
+        config=client_config(settings),
+    )
+
+
+def create_local_client(service: str, settings: dict):
+    from app.local_aws import local_client
+    return local_client(service, settings["local_latency_ms"] / 1000, settings["local_jitter_ms"] / 1000,
+                        settings["local_seed"])
+
+
+# AWS_BACKEND -> factory(service, settings), any object with the boto3 client
+# methods the app calls can be plugged in here
+CLIENT_BACKENDS = {
+    "boto3": create_boto3_client,
+    "local": create_local_client,
+}
+
+
+def create_client(service: str, settings: dict = AWS_SETTINGS):
+    factory = CLIENT_BACKENDS.get(settings["backend"])
+    if factory is None:
+        raise ValueError(f"unknown AWS_BACKEND: {settings['backend']}")
+    return factory(service, settings)
+
+
+def override_client(service: str, client) -> None:
+    # swap in another client (e.g. app/local_aws.py) for every caller, None restores boto3
+    with _clients_lock:
+        if client is None:
+            _overrides.pop(service, None)
+        else:
+            _overrides[service] = client
+
+
+def in_process_client(service: str):
+    # the client for service when it is not boto3, an override or the local
+    # backend, None otherwise. async code runs its calls on a worker thread
+    override = _overrides.get(service)
+    if override is not None:
+        return override
+    if AWS_SETTINGS["backend"] != "boto3":
+        return get_client(service)
+    return None
+
+
+def get_client(service: str):
+    override = _overrides.get(service)
+    if override is not None:
+        return override
+    key = (service, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = create_client(service)
+                _clients[key] = client
+    return client
+
+
+def configure_clients(**settings) -> None:
+    # override settings and drop existing clients so the next call rebuilds them
+    AWS_SETTINGS.update(settings)
+    with _clients_lock:
+        _clients.clear()
+
+
+class ClientProxy:
+    # stands in for a boto3 client and resolves the real one for the current
+    # process on every attribute access, so module level names stay fork safe
+    def __init__(self, service: str):
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(get_client(self._service), name)
+        # operations are timed for /metrics, exceptions/meta pass straight through
+        if callable(attr) and not isinstance(attr, type):
+            return timed_call(self._service, name, attr)
+        return attr
+
+    def resolve(self):
+        # the client this proxy currently stands for
+        return get_client(self._service)
+
+    def __repr__(self):
+        return f"ClientProxy({self._service!r})"
+
+
+def pool_stats(service: str) -> dict:
+    # connection pool usage for the current process, read from the urllib3 pools
+    # inside botocore's http session
+    client = _clients.get((service, os.getpid()))
+    stats = {"max_pool_connections": AWS_SETTINGS["max_pool_connections"], "pools": []}
+    # the local backend has no connection pool
+    endpoint = getattr(client, "_endpoint", None)
+    if endpoint is None:
+        return stats
+    manager = getattr(endpoint.http_session, "_manager", None)
+    if manager is None:
+        return stats
+    for pool_key in list(manager.pools.keys()):
+        pool = manager.pools.get(pool_key)
+        if pool is None or pool.pool is None:
+            continue
+        # the queue is pre-filled with maxsize slots, a slot is taken while a
+        # connection is checked out
+        maxsize = pool.pool.maxsize
+        stats["pools"].append({
+            "host": pool.host,
+            "port": pool.port,
+            "maxsize": maxsize,
+            "in_use": maxsize - pool.pool.qsize(),
+            "connections_opened": pool.num_connections,
+            "requests": pool.num_requests,
+        })
+    return stats
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+DDB_BATCH_SIZE = 25
+
+
+def chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def batch_write_items(dynamodb_client, table_name: str, write_requests: list,
+                      max_retries: int = 5, base_delay: float = 0.05) -> list:
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/batch_write_item.html
+    # writes in 25 item chunks, retrying UnprocessedItems with exponential backoff
+    # returns the write requests that still failed after all retries
+    failed = []
+    for chunk in chunked(write_requests, DDB_BATCH_SIZE):
+        pending = chunk
+        attempt = 0
+        while pending:
+            try:
+                response = dynamodb_client.batch_write_item(RequestItems={table_name: pending})
+            except Exception as e:
+                print(f"DynamoDB batch write error: {e}")
+                response = {"UnprocessedItems": {table_name: pending}}
+            pending = response.get("UnprocessedItems", {}).get(table_name, [])
+            if not pending:
+                break
+            if attempt >= max_retries:
+                failed.extend(pending)
+                break
+            time.sleep(base_delay * (2 ** attempt))
+            attempt += 1
+    return failed
+
+
+async def batch_write_items_async(dynamodb_client, table_name: str, write_requests: list,
+                                  max_retries: int = 5, base_delay: float = 0.05) -> list:
+    # batch_write_items for an aiobotocore client, backing off without blocking the event loop
+    failed = []
+    for chunk in chunked(write_requests, DDB_BATCH_SIZE):
+        pending = chunk
+        attempt = 0
+        while pending:
+            try:
+                response = await dynamodb_client.batch_write_item(RequestItems={table_name: pending})
+            except Exception as e:
+                print(f"DynamoDB batch write error: {e}")
+                response = {"UnprocessedItems": {table_name: pending}}
+            pending = response.get("UnprocessedItems", {}).get(table_name, [])
+            if not pending:
+                break
+            if attempt >= max_retries:
+                failed.extend(pending)
+                break
+            await asyncio.sleep(base_delay * (2 ** attempt))
+            attempt += 1
+    return failed
@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # in process LRU cache with a max size and a time to live per entry
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "size": len(self._entries), "max_size": self.max_size,
+                    "ttl": self.ttl, **self._stats}
+
+
+class SqliteCache:
+    # LRU/TTL cache kept in a local sqlite file so every worker process
+    # on the host shares the same entries and sees the same invalidations
+    def __init__(self, path: str, max_size: int = 1024, ttl: float = 30.0):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, and never reuse one inherited across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[stat] += amount
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self._count("misses")
+            return None
+        if row[1] <= now:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self._count("expirations")
+            self._count("misses")
+            return None
+        conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return json.loads(row[0])
+
+    def set(self, key, value) -> None:
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl, now)
+        )
+        evicted = conn.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            "SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        ).rowcount
+        if evicted > 0:
+            self._count("evictions", evicted)
+
+    def invalidate(self, key) -> None:
+        if self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,)).rowcount:
+            self._count("invalidations")
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def stats(self) -> dict:
+        size = self._connection().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        with self._lock:
+            return {"backend": "sqlite", "size": size, "max_size": self.max_size,
+                    "ttl": self.ttl, **self._stats}
+
+
+def make_cache(backend: str, max_size: int, ttl: float, path: str | None = None):
+    if backend == "memory":
+        return TTLCache(max_size=max_size, ttl=ttl)
+    if backend == "sqlite":
+        return SqliteCache(path, max_size=max_size, ttl=ttl)
+    raise ValueError(f"unknown cache backend: {backend}")
@@ -0,0 +1,97 @@
+import threading
+import time
+
+# change data feed behind GET /api/v1/drafts/changes. every write commits a
+# draft_change row in the same transaction as the draft row, numbered by an
+# AUTOINCREMENT key. sqlite has one writer at a time, so the numbers become
+# visible in the order they were handed out and "everything after seq N"
+# never misses a change that commits later with a lower number
+
+
+class ChangeNotifier:
+    # wakes the long polls and event streams of this process when a change
+    # commits. writes made by other worker processes are not seen here, which
+    # is why waiters also re-read sqlite every poll interval
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._generation = 0
+
+    def generation(self) -> int:
+        # read before querying, so a commit between the query and wait() is not missed
+        return self._generation
+
+    def notify(self) -> None:
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def wait(self, generation: int, timeout: float) -> bool:
+        # True when something committed since `generation` was read
+        with self._cond:
+            return self._cond.wait_for(lambda: self._generation != generation, timeout)
+
+
+def parse_since(raw: str | None) -> int | None:
+    # None means "from now on"
+    if raw is None or raw == "":
+        return None
+    try:
+        since = int(raw)
+    except ValueError:
+        raise ValueError("since must be an integer")
+    if since < 0:
+        raise ValueError("since must be at least 0")
+    return since
+
+
+def parse_wait(raw: str | None, max_wait: float) -> float:
+    if raw is None:
+        return 0.0
+    try:
+        wait = float(raw)
+    except ValueError:
+        raise ValueError("wait must be a number of seconds")
+    return min(max(wait, 0.0), max_wait)
+
+
+def wait_for_changes(read, notifier: ChangeNotifier, timeout: float, poll_interval: float, clock=time.monotonic):
+    # long poll: read() until it returns changes or timeout passes
+    deadline = clock() + timeout
+    while True:
+        generation = notifier.generation()
+        changes = read()
+        remaining = deadline - clock()
+        if changes or remaining <= 0:
+            return changes
+        notifier.wait(generation, min(remaining, poll_interval))
+
+
+def sse_event(seq: int, event: str, data: bytes) -> bytes:
+    # https://html.spec.whatwg.org/multipage/server-sent-events.html, data is
+    # one line of json, the id comes back as Last-Event-ID on a reconnect
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (seq, event.encode(), data.rstrip(b"\n"))
+
+
+def stream_changes(read, notifier: ChangeNotifier, since: int, duration: float, heartbeat: float,
+                   poll_interval: float, dumps_line, retry_ms: int = 1000, clock=time.monotonic):
+    # server-sent events for every change after `since`, for `duration`
+    # seconds. the client reconnects with Last-Event-ID and carries on, so no
+    # request holds a worker thread forever. a comment line goes out every
+    # `heartbeat` seconds without changes to keep proxies from closing the stream
+    yield b"retry: %d\n\n" % retry_ms
+    deadline = clock() + duration
+    last_sent = clock()
+    while clock() < deadline:
+        generation = notifier.generation()
+        changes = read(since)
+        for change in changes:
+            yield sse_event(change["seq"], change["operation"], dumps_line(change))
+            since = change["seq"]
+        now = clock()
+        if changes:
+            last_sent = now
+            continue
+        if now - last_sent >= heartbeat:
+            yield b": keep-alive\n\n"
+            last_sent = now
+        notifier.wait(generation, max(0.0, min(poll_interval, heartbeat, deadline - now)))
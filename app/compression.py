@@ -0,0 +1,81 @@
+import gzip
+import zlib
+
+try:
+    # optional, pip install brotli to offer br to clients that accept it
+    import brotli
+except ImportError:
+    brotli = None
+
+# mimetypes worth compressing, everything the api sends except 304s/empty bodies
+COMPRESSIBLE = {"application/json", "application/x-ndjson", "text/plain", "text/csv", "text/event-stream"}
+
+
+def available_encodings(preferred: list) -> list:
+    return [e for e in preferred if e == "gzip" or (e == "br" and brotli is not None)]
+
+
+def negotiate(accept_encodings, preferred: list) -> str | None:
+    # the first of our encodings the client accepts with a non zero quality,
+    # ties in the client's q values go to our order (br before gzip)
+    best = None
+    best_quality = 0
+    for encoding in available_encodings(preferred):
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_body(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding: str, level: int):
+    # incremental compression for streamed responses. output is only produced
+    # when the compressor has a block ready, so small lines are batched
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response, accept_encodings, config) -> None:
+    # negotiated gzip/brotli for bodies at or above COMPRESSION_MIN_SIZE, and
+    # for every streamed body, which has no size up front
+    if not config["RESPONSE_COMPRESSION"]:
+        return
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return
+    if response.mimetype not in COMPRESSIBLE or "Content-Encoding" in response.headers:
+        return
+    if "no-transform" in response.headers.get("Cache-Control", ""):
+        return
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encodings, config["COMPRESSION_ENCODINGS"])
+    if encoding is None:
+        return
+    level = config["COMPRESSION_LEVELS"][encoding]
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESSION_MIN_SIZE"]:
+            return
+        response.set_data(compress_body(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    # a strong etag names one exact byte sequence, the compressed body is a
+    # different one, so it is sent as weak (If-None-Match compares weakly)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
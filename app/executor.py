@@ -0,0 +1,108 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# thread pools are shared per process and rebuilt after a fork
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    key = (name, os.getpid())
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None or executor._max_workers != max_workers:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            _executors[key] = executor
+        return executor
+
+
+def fetch_all(fetch, keys: list, max_workers: int, pool_name: str = "fetch") -> list:
+    # run fetch(key) for every key on a bounded pool and return
+    # (key, result, error) tuples in the same order as keys
+    if not keys:
+        return []
+    executor = get_executor(pool_name, max_workers)
+    # each task runs in a copy of the caller's context so per request metrics follow it
+    futures = [executor.submit(contextvars.copy_context().run, fetch, key) for key in keys]
+    results = []
+    for key, future in zip(keys, futures):
+        try:
+            results.append((key, future.result(), None))
+        except Exception as e:
+            results.append((key, None, e))
+    return results
+
+
+def submit_legs(legs: dict, max_workers: int, pool_name: str = "backend") -> dict:
+    # start every independent backend call at once, legs maps a
+    # backend name to a zero argument callable
+    executor = get_executor(pool_name, max_workers)
+    started = time.monotonic()
+    return {name: (executor.submit(contextvars.copy_context().run, leg), started) for name, leg in legs.items()}
+
+
+def collect_legs(futures: dict, timeouts: dict) -> dict:
+    # wait for each leg up to its own timeout and return name -> (result, error)
+    # a leg that times out keeps running in the pool but its result is dropped
+    results = {}
+    for name, (future, started) in futures.items():
+        timeout = timeouts.get(name)
+        remaining = None if timeout is None else max(0, started + timeout - time.monotonic())
+        try:
+            results[name] = (future.result(timeout=remaining), None)
+        except TimeoutError:
+            future.cancel()
+            results[name] = (None, TimeoutError(f"{name} did not respond within {timeout}s"))
+        except Exception as e:
+            results[name] = (None, e)
+    return results
+
+
+def hedged(calls: dict, delay: float, timeout: float, max_workers: int, accept=None, pool_name: str = "backend"):
+    # hedged requests: calls maps a name to a zero argument callable, tried in
+    # order. the next one starts when the ones in flight have not answered
+    # within `delay` or have failed, the first answer accept() takes wins and
+    # the calls that have not started yet are cancelled (a running one keeps
+    # its thread but its result is dropped). returns (name, result, errors),
+    # name is None when nothing was accepted before the timeout
+    executor = get_executor(pool_name, max_workers)
+    remaining = list(calls.items())
+    pending = {}
+    errors = {}
+    deadline = time.monotonic() + timeout
+
+    def launch():
+        name, call = remaining.pop(0)
+        pending[executor.submit(contextvars.copy_context().run, call)] = name
+
+    launch()
+    while pending:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        done, _ = wait(pending, timeout=min(delay, left) if remaining else left, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                errors[name] = e
+                continue
+            if accept is None or accept(result):
+                for loser in pending:
+                    loser.cancel()
+                return name, result, errors
+            errors[name] = LookupError(f"{name} had no answer")
+        # nothing accepted yet, either the delay passed or a call failed
+        # (which needs no waiting out the delay): hedge with the next one
+        if remaining:
+            launch()
+    for loser in pending:
+        loser.cancel()
+        errors.setdefault(pending[loser], TimeoutError(f"{pending[loser]} did not respond within {timeout}s"))
+    return None, None, errors
@@ -0,0 +1,136 @@
+import csv
+import io
+
+from app.compression import compress_stream
+
+# GET /api/v1/drafts/export writes flat rows, one per draft, in batches as
+# they come out of sqlite, so memory stays at one batch whatever the table size
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+# csv and ndjson are gzipped as a whole file, parquet compresses its own pages
+EXPORT_COMPRESSIONS = {
+    "csv": (None, "gzip"),
+    "ndjson": (None, "gzip"),
+    "parquet": ("snappy", "gzip", "zstd", None),
+}
+
+
+def parse_export_args(args) -> tuple:
+    # format and compression of an export request, ValueError when invalid
+    export_format = args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    compression = args.get("compression") or None
+    if compression == "none":
+        compression = None
+    elif compression is None and export_format == "parquet":
+        compression = "snappy"
+    if compression not in EXPORT_COMPRESSIONS[export_format]:
+        choices = ", ".join(c or "none" for c in EXPORT_COMPRESSIONS[export_format])
+        raise ValueError(f"compression for {export_format} must be one of {choices}")
+    return export_format, compression
+
+
+def export_filename(export_format: str, compression: str | None) -> str:
+    if compression == "gzip" and export_format != "parquet":
+        return f"drafts.{export_format}.gz"
+    return f"drafts.{export_format}"
+
+
+def export_mimetype(export_format: str, compression: str | None) -> str:
+    if compression == "gzip" and export_format != "parquet":
+        return "application/gzip"
+    return EXPORT_FORMATS[export_format]
+
+
+def csv_chunks(columns: tuple, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # only the header, for an empty table
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(columns: tuple, batches, dumps_line):
+    for batch in batches:
+        yield b"".join(dumps_line(dict(zip(columns, row))) for row in batch)
+
+
+class _Drain(io.RawIOBase):
+    # write only file for the parquet writer, the bytes written since the
+    # last take() are sent and forgotten instead of piling up
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_chunks(columns: tuple, batches, compression: str | None, integer_columns=("id",),
+                   row_group_size: int = 65536):
+    # batches are collected into row groups of row_group_size, each one is sent
+    # once written. the footer with the row group offsets goes out last.
+    # pyarrow is optional and slow to import, so only a parquet export loads it
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([(c, pyarrow.int64() if c in integer_columns else pyarrow.string()) for c in columns])
+    sink = _Drain()
+    pending = []
+
+    def row_group():
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array([row[i] for row in pending], type=schema.field(i).type) for i in range(len(columns))],
+            schema=schema)
+        writer.write_table(table, row_group_size=row_group_size)
+        pending.clear()
+
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression=compression or "none")
+    try:
+        for batch in batches:
+            pending.extend(batch)
+            if len(pending) >= row_group_size:
+                row_group()
+                yield sink.take()
+        if pending:
+            row_group()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export_chunks(export_format: str, compression: str | None, columns: tuple, batches, dumps_line,
+                  gzip_level: int = 6, row_group_size: int = 65536):
+    # the response body of an export, batches is an iterable of lists of row tuples
+    if export_format == "parquet":
+        return parquet_chunks(columns, batches, compression, row_group_size=row_group_size)
+    if export_format == "csv":
+        chunks = csv_chunks(columns, batches)
+    else:
+        chunks = ndjson_chunks(columns, batches, dumps_line)
+    if compression == "gzip":
+        chunks = compress_stream(chunks, "gzip", gzip_level)
+    return chunks
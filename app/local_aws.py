@@ -0,0 +1,355 @@
+import hashlib
+import io
+import random
+import re
+import threading
+import time
+from botocore.exceptions import ClientError
+
+# in process stand-ins for the s3 and dynamodb operations this app uses, so
+# benchmarks and tests can run without localstack or a network
+
+
+def client_error(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class _Exceptions:
+    # mirrors client.exceptions.<Name> on real boto3 clients
+    def __init__(self, *names):
+        for name in names:
+            setattr(self, name, type(name, (ClientError,), {}))
+
+    def error(self, name: str, message: str, operation: str) -> ClientError:
+        return getattr(self, name)({"Error": {"Code": name, "Message": message}}, operation)
+
+
+class LocalS3Client:
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.RLock()
+        self.exceptions = _Exceptions("NoSuchKey", "NoSuchBucket", "BucketAlreadyOwnedByYou")
+
+    def _bucket(self, name: str, operation: str) -> dict:
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            raise self.exceptions.error("NoSuchBucket", f"The specified bucket does not exist: {name}", operation)
+        return bucket
+
+    def create_bucket(self, Bucket, **kwargs):
+        with self._lock:
+            if Bucket in self._buckets:
+                raise self.exceptions.error("BucketAlreadyOwnedByYou", f"Bucket {Bucket} already exists", "CreateBucket")
+            self._buckets[Bucket] = {}
+        return {"Location": f"/{Bucket}"}
+
+    def head_bucket(self, Bucket):
+        with self._lock:
+            if Bucket not in self._buckets:
+                raise client_error("404", "Not Found", "HeadBucket")
+        return {}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, ContentEncoding=None, ContentType=None,
+                   IfMatch=None, IfNoneMatch=None, **kwargs):
+        data = Body.encode() if isinstance(Body, str) else bytes(Body)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            bucket = self._bucket(Bucket, "PutObject")
+            # https://docs.aws.amazon.com/AmazonS3/latest/userguide/conditional-writes.html
+            current = bucket.get(Key)
+            if IfMatch is not None and current is None:
+                raise self.exceptions.error("NoSuchKey", "The specified key does not exist.", "PutObject")
+            if IfMatch is not None and IfMatch != current["ETag"]:
+                raise client_error("PreconditionFailed", "At least one of the pre-conditions you specified did not hold", "PutObject")
+            if IfNoneMatch == "*" and current is not None:
+                raise client_error("PreconditionFailed", "At least one of the pre-conditions you specified did not hold", "PutObject")
+            bucket[Key] = {
+                "Body": data,
+                "ETag": etag,
+                "Metadata": dict(Metadata or {}),
+                "ContentEncoding": ContentEncoding,
+                "ContentType": ContentType or "binary/octet-stream",
+            }
+        return {"ETag": etag}
+
+    def _object(self, Bucket, Key, operation):
+        with self._lock:
+            obj = self._bucket(Bucket, operation).get(Key)
+        if obj is None:
+            raise self.exceptions.error("NoSuchKey", "The specified key does not exist.", operation)
+        return obj
+
+    def get_object(self, Bucket, Key, **kwargs):
+        obj = self._object(Bucket, Key, "GetObject")
+        response = {k: v for k, v in obj.items() if k != "Body" and v is not None}
+        response["Body"] = io.BytesIO(obj["Body"])
+        response["ContentLength"] = len(obj["Body"])
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        try:
+            obj = self._object(Bucket, Key, "HeadObject")
+        except ClientError:
+            # head requests have no body, so s3 only reports a bare 404
+            raise client_error("404", "Not Found", "HeadObject")
+        response = {k: v for k, v in obj.items() if k != "Body" and v is not None}
+        response["ContentLength"] = len(obj["Body"])
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self._bucket(Bucket, "DeleteObject").pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        with self._lock:
+            bucket = self._bucket(Bucket, "DeleteObjects")
+            keys = [obj["Key"] for obj in Delete["Objects"]]
+            for key in keys:
+                bucket.pop(key, None)
+        return {} if Delete.get("Quiet") else {"Deleted": [{"Key": key} for key in keys]}
+
+    def list_objects_v2(self, Bucket, MaxKeys=1000, ContinuationToken=None, Prefix="", StartAfter=None, **kwargs):
+        with self._lock:
+            bucket = self._bucket(Bucket, "ListObjectsV2")
+            keys = sorted(k for k in bucket if k.startswith(Prefix))
+            after = ContinuationToken or StartAfter
+            if after is not None:
+                keys = [k for k in keys if k > after]
+            page = keys[:MaxKeys]
+            contents = [{"Key": k, "Size": len(bucket[k]["Body"]), "ETag": bucket[k]["ETag"]} for k in page]
+        response = {"KeyCount": len(page), "IsTruncated": len(keys) > MaxKeys, "MaxKeys": MaxKeys}
+        if contents:
+            response["Contents"] = contents
+        if len(keys) > MaxKeys:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+
+_CONDITION = re.compile(
+    r"^(?:(?P<func>attribute_exists|attribute_not_exists)\((?P<fattr>[#\w]+)\)"
+    r"|begins_with\((?P<battr>[#\w]+),\s*(?P<bval>:\w+)\)"
+    r"|(?P<rattr>[#\w]+) BETWEEN (?P<lo>:\w+) AND (?P<hi>:\w+)"
+    r"|(?P<cattr>[#\w]+)\s*(?P<op>=|<>|<=|>=|<|>)\s*(?P<cval>:\w+))$"
+)
+
+
+def _value(attribute_value: dict):
+    (kind, value), = attribute_value.items()
+    return float(value) if kind == "N" else value
+
+
+def _split_between(expression: str) -> list:
+    # "a BETWEEN :lo AND :hi AND b = :b" splits on the AND that is not part of BETWEEN
+    parts = []
+    tokens = expression.split(" AND ")
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if " BETWEEN " in token and i + 1 < len(tokens):
+            token = f"{token} AND {tokens[i + 1]}"
+            i += 1
+        parts.append(token.strip())
+        i += 1
+    return parts
+
+
+def _matches_one(condition: str, item: dict, names: dict, values: dict) -> bool:
+    match = _CONDITION.match(condition)
+    if match is None:
+        raise client_error("ValidationException", f"Unsupported expression: {condition}", "Expression")
+    resolve = lambda attr: names.get(attr, attr)
+    if match["func"]:
+        exists = resolve(match["fattr"]) in item
+        return exists if match["func"] == "attribute_exists" else not exists
+    if match["battr"]:
+        current = item.get(resolve(match["battr"]))
+        return current is not None and str(_value(current)).startswith(_value(values[match["bval"]]))
+    if match["rattr"]:
+        current = item.get(resolve(match["rattr"]))
+        return current is not None and _value(values[match["lo"]]) <= _value(current) <= _value(values[match["hi"]])
+    current = item.get(resolve(match["cattr"]))
+    if current is None:
+        return match["op"] == "<>"
+    left, right = _value(current), _value(values[match["cval"]])
+    return {
+        "=": left == right, "<>": left != right, "<": left < right,
+        "<=": left <= right, ">": left > right, ">=": left >= right,
+    }[match["op"]]
+
+
+def conditions_match(expression, item, names, values) -> bool:
+    if not expression:
+        return True
+    return all(_matches_one(c, item or {}, names or {}, values or {}) for c in _split_between(expression))
+
+
+class LocalDynamoDBClient:
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.RLock()
+        self.exceptions = _Exceptions("ResourceNotFoundException", "ResourceInUseException",
+                                      "ConditionalCheckFailedException")
+
+    def _table(self, name: str, operation: str) -> dict:
+        table = self._tables.get(name)
+        if table is None:
+            raise self.exceptions.error("ResourceNotFoundException", f"Requested resource not found: {name}", operation)
+        return table
+
+    @staticmethod
+    def _key(table: dict, item: dict) -> tuple:
+        return tuple(_value(item[attribute]) for attribute in table["key"])
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(), **kwargs):
+        with self._lock:
+            if TableName in self._tables:
+                raise self.exceptions.error("ResourceInUseException", f"Table already exists: {TableName}", "CreateTable")
+            self._tables[TableName] = {
+                "key": [k["AttributeName"] for k in KeySchema],
+                "indexes": {
+                    index["IndexName"]: [k["AttributeName"] for k in index["KeySchema"]]
+                    for index in GlobalSecondaryIndexes
+                },
+                "items": {},
+            }
+        return self.describe_table(TableName)
+
+    def describe_table(self, TableName):
+        with self._lock:
+            table = self._table(TableName, "DescribeTable")
+            return {"Table": {
+                "TableName": TableName,
+                "TableStatus": "ACTIVE",
+                "ItemCount": len(table["items"]),
+                "GlobalSecondaryIndexes": [
+                    {"IndexName": name, "IndexStatus": "ACTIVE"} for name in table["indexes"]
+                ],
+            }}
+
+    def put_item(self, TableName, Item, ConditionExpression=None,
+                 ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "PutItem")
+            key = self._key(table, Item)
+            if not conditions_match(ConditionExpression, table["items"].get(key),
+                                    ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self.exceptions.error("ConditionalCheckFailedException", "The conditional request failed", "PutItem")
+            table["items"][key] = dict(Item)
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "GetItem")
+            item = table["items"].get(self._key(table, Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "DeleteItem")
+            key = self._key(table, Key)
+            if not conditions_match(ConditionExpression, table["items"].get(key),
+                                    ExpressionAttributeNames, ExpressionAttributeValues):
+                raise self.exceptions.error("ConditionalCheckFailedException", "The conditional request failed", "DeleteItem")
+            table["items"].pop(key, None)
+        return {}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        with self._lock:
+            for table_name, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise client_error("ValidationException", "Too many items requested for the BatchWriteItem call", "BatchWriteItem")
+                table = self._table(table_name, "BatchWriteItem")
+                for request in requests:
+                    if "PutRequest" in request:
+                        item = request["PutRequest"]["Item"]
+                        table["items"][self._key(table, item)] = dict(item)
+                    else:
+                        table["items"].pop(self._key(table, request["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": {}}
+
+    def _page(self, items, key_attributes, Limit, ExclusiveStartKey):
+        # items are already in key order, resume after ExclusiveStartKey
+        if ExclusiveStartKey is not None:
+            start = tuple(_value(ExclusiveStartKey[a]) for a in key_attributes)
+            items = [item for item in items if tuple(_value(item[a]) for a in key_attributes) > start]
+        last_key = None
+        if Limit is not None and len(items) > Limit:
+            items = items[:Limit]
+            last_key = {a: items[-1][a] for a in key_attributes}
+        return items, last_key
+
+    def scan(self, TableName, Limit=None, ExclusiveStartKey=None, FilterExpression=None,
+             ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "Scan")
+            items = [dict(table["items"][k]) for k in sorted(table["items"])]
+            key_attributes = table["key"]
+        # like dynamodb, Limit counts items read before the filter is applied
+        page, last_key = self._page(items, key_attributes, Limit, ExclusiveStartKey)
+        found = [i for i in page if conditions_match(FilterExpression, i, ExpressionAttributeNames, ExpressionAttributeValues)]
+        response = {"Items": found, "Count": len(found), "ScannedCount": len(page)}
+        if last_key is not None:
+            response["LastEvaluatedKey"] = last_key
+        return response
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, Limit=None, ExclusiveStartKey=None,
+              FilterExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            table = self._table(TableName, "Query")
+            if IndexName is not None and IndexName not in table["indexes"]:
+                raise client_error("ValidationException", "The table does not have the specified index", "Query")
+            index_key = table["indexes"][IndexName] if IndexName else table["key"]
+            items = [dict(i) for i in table["items"].values() if all(a in i for a in index_key)]
+            key_attributes = list(dict.fromkeys(index_key + table["key"]))
+        items.sort(key=lambda i: tuple(_value(i[a]) for a in key_attributes))
+        items = [i for i in items if conditions_match(KeyConditionExpression, i, ExpressionAttributeNames, ExpressionAttributeValues)]
+        page, last_key = self._page(items, key_attributes, Limit, ExclusiveStartKey)
+        found = [i for i in page if conditions_match(FilterExpression, i, ExpressionAttributeNames, ExpressionAttributeValues)]
+        response = {"Items": found, "Count": len(found), "ScannedCount": len(page)}
+        if last_key is not None:
+            response["LastEvaluatedKey"] = last_key
+        return response
+
+
+class LatencyClient:
+    # wraps a fake and sleeps before every operation, latency seconds plus up
+    # to jitter seconds drawn from a generator seeded with seed
+    def __init__(self, client, latency: float, jitter: float = 0.0, seed=None):
+        self._client = client
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        # exceptions and other attributes pass straight through
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self.delay())
+            return attr(*args, **kwargs)
+        return call
+
+
+LOCAL_CLIENTS = {
+    "s3": LocalS3Client,
+    "dynamodb": LocalDynamoDBClient,
+}
+
+
+def local_client(service: str, latency: float = 0.0, jitter: float = 0.0, seed=None):
+    # a new, empty fake for service, slowed down when latency or jitter is set
+    client = LOCAL_CLIENTS[service]()
+    if latency or jitter:
+        client = LatencyClient(client, latency, jitter, seed)
+    return client
@@ -0,0 +1,186 @@
+import bisect
+import contextvars
+import threading
+import time
+
+# latency buckets in seconds and payload buckets in bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per bucket counts..., +Inf count], sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    labels = _format_labels(self.labels + ("le",), label_values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # read at scrape time from a callback returning {label values tuple: value}
+    def __init__(self, name: str, help: str, labels: tuple, collect):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return lines
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+backend_latency = registry.register(Histogram(
+    "draft_backend_request_seconds", "Latency of calls to sqlite, dynamodb and s3", ("backend", "operation")))
+backend_errors = registry.register(Counter(
+    "draft_backend_errors_total", "Failed calls to sqlite, dynamodb and s3", ("backend", "operation")))
+request_latency = registry.register(Histogram(
+    "draft_http_request_seconds", "Latency of HTTP requests", ("method", "route", "status")))
+response_size = registry.register(Histogram(
+    "draft_http_response_bytes", "Size of HTTP response bodies", ("method", "route"), buckets=SIZE_BUCKETS))
+
+
+class RequestTimings:
+    # per request totals for the Server-Timing header, shared with worker threads
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.backends = {}
+        self._lock = threading.Lock()
+
+    def add(self, backend: str, seconds: float) -> None:
+        with self._lock:
+            total, count = self.backends.get(backend, (0.0, 0))
+            self.backends[backend] = (total + seconds, count + 1)
+
+    def server_timing(self) -> str:
+        # durations are summed per backend, parallel legs can add up to more than total
+        with self._lock:
+            parts = [f'{backend};dur={total * 1000:.2f};desc="{count} calls"'
+                     for backend, (total, count) in sorted(self.backends.items())]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+def record_backend_call(backend: str, operation: str, seconds: float, failed: bool = False) -> None:
+    backend_latency.observe(seconds, backend, operation)
+    if failed:
+        backend_errors.inc(backend, operation)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(backend, seconds)
+
+
+def timed_call(backend: str, operation: str, fn):
+    # wraps fn so every call is recorded against backend/operation
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record_backend_call(backend, operation, time.perf_counter() - start, failed)
+    return call
+
+
+def timed_async_call(backend: str, operation: str, fn):
+    # timed_call for coroutine functions
+    async def call(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record_backend_call(backend, operation, time.perf_counter() - start, failed)
+    return call
@@ -0,0 +1,43 @@
+import base64
+import json
+
+# every store a page token can carry a position for
+PAGE_STORES = ("sqlite", "dynamodb", "s3")
+
+
+def start_positions(stores: tuple = PAGE_STORES) -> dict:
+    # None means "start from the beginning" for that store
+    return {store: None for store in stores}
+
+
+def encode_page_token(positions: dict) -> str | None:
+    # stores that are exhausted are left out of the token entirely,
+    # so a token with no positions means there is nothing left to read
+    remaining = {store: pos for store, pos in positions.items() if pos is not None}
+    if not remaining:
+        return None
+    raw = json.dumps(remaining, separators=(",", ":"), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_page_token(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        positions = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"invalid next_token: {e}")
+    if not isinstance(positions, dict) or not set(positions) <= set(PAGE_STORES):
+        raise ValueError("invalid next_token")
+    return positions
+
+
+def parse_limit(raw: str | None, max_limit: int) -> int | None:
+    if raw is None:
+        return None
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    return min(limit, max_limit)
@@ -0,0 +1,260 @@
+# consistency check between sqlite (the source of truth), dynamodb and s3.
+# every store is read page by page and each record is reduced to an id and a
+# content hash kept in a temporary sqlite file, so memory stays bounded by the
+# page size however many drafts there are. the diff is then a few joins, and
+# a repair rewrites the differing ids from sqlite with batched writes
+#
+# usage: python -m app.reconcile               report only, exit status 1 on drift
+#        python -m app.reconcile --repair      also fix dynamodb and s3 from sqlite
+#        python -m app.reconcile --json report.json
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+from flask import current_app
+
+from app.application import (db, Draft, OutboxEntry, ddb_client, s3_client, S3_BUCKET_NAME, DDB_TABLE_NAME,
+                             dynamodb_draft_item, fetch_s3_draft, put_s3_draft, read_session, s3_draft_key,
+                             s3_draft_etag)
+from app.batch import batch_write_items, chunked
+from app.executor import fetch_all
+from app.s3_format import DRAFT_KEY_PREFIX
+from app.serialization import draft_fields, draft_to_dict, dynamodb_item_to_dict
+
+REPLICAS = ("dynamodb", "s3")
+DRIFT_KINDS = ("missing", "extra", "diverged")
+# S3 DeleteObjects takes at most 1000 keys
+S3_DELETE_BATCH = 1000
+DRAFT_KEY = re.compile(rf"^{DRAFT_KEY_PREFIX}(\d+)\.json$")
+
+
+def record_hash(draft_data: dict) -> str:
+    # the same draft hashes the same whichever store it was read from
+    return hashlib.sha1(json.dumps(draft_fields(draft_data), sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class HashStore:
+    # (store, id) -> hash in a throwaway sqlite file
+    def __init__(self, directory=None):
+        handle, self.path = tempfile.mkstemp(prefix="draft-reconcile-", suffix=".db", dir=directory)
+        os.close(handle)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE hashes (store TEXT, id INTEGER, hash TEXT, etag TEXT,"
+                          " PRIMARY KEY (store, id)) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE pending (id INTEGER PRIMARY KEY)")
+
+    def add(self, store: str, rows: list) -> None:
+        # rows are (id, hash, etag) tuples, a later duplicate id wins
+        self.conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                              [(store, *row) for row in rows])
+
+    def count(self, store: str) -> int:
+        return self.conn.execute("SELECT count(*) FROM hashes WHERE store = ?", (store,)).fetchone()[0]
+
+    def drift_query(self, store: str, kind: str) -> str:
+        # ids of one kind of drift in `store`, leaving out ids with replication in flight
+        if kind == "missing":
+            query = ("SELECT s.id FROM hashes s LEFT JOIN hashes r ON r.store = :store AND r.id = s.id"
+                     " WHERE s.store = 'sqlite' AND r.id IS NULL")
+        elif kind == "extra":
+            query = ("SELECT r.id FROM hashes r LEFT JOIN hashes s ON s.store = 'sqlite' AND s.id = r.id"
+                     " WHERE r.store = :store AND s.id IS NULL")
+        else:
+            query = ("SELECT s.id FROM hashes s JOIN hashes r ON r.store = :store AND r.id = s.id"
+                     " WHERE s.store = 'sqlite' AND r.hash IS NOT s.hash")
+        return f"SELECT id FROM ({query}) WHERE id NOT IN (SELECT id FROM pending) ORDER BY id"
+
+    def drift_ids(self, store: str, kind: str, chunk_size: int):
+        cursor = self.conn.execute(self.drift_query(store, kind), {"store": store})
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield [draft_id for (draft_id,) in rows]
+
+    def drift_count(self, store: str, kind: str) -> int:
+        return self.conn.execute(f"SELECT count(*) FROM ({self.drift_query(store, kind)})", {"store": store}).fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+        os.remove(self.path)
+
+
+def scan_sqlite(hashes: HashStore, page_size: int) -> None:
+    # one read transaction, yield_per keeps a page of rows in memory at a time
+    session = read_session()
+    query = db.select(Draft).order_by(Draft.id).execution_options(yield_per=page_size)
+    for page in session.scalars(query).partitions():
+        rows = []
+        for draft_rec in page:
+            draft_data = draft_to_dict(draft_rec)
+            # the etag the s3 object should have, so a listing alone proves
+            # most objects are current without downloading them
+            rows.append((draft_rec.id, record_hash(draft_data), s3_draft_etag(draft_rec.id, draft_data)))
+        hashes.add("sqlite", rows)
+    # drafts with replication still in flight are expected to differ for now
+    pending = (session.query(OutboxEntry.draft_id)
+               .filter(OutboxEntry.attempts < current_app.config["OUTBOX_MAX_ATTEMPTS"]).distinct())
+    hashes.conn.executemany("INSERT OR IGNORE INTO pending VALUES (?)", [tuple(row) for row in pending])
+
+
+def scan_dynamodb(hashes: HashStore, page_size: int) -> None:
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/scan.html
+    scan_args = {"TableName": DDB_TABLE_NAME, "Limit": page_size}
+    while True:
+        response = ddb_client.scan(**scan_args)
+        rows = []
+        for item in response.get("Items", []):
+            draft_data = dynamodb_item_to_dict(item)
+            rows.append((int(draft_data["id"]), record_hash(draft_data), None))
+        hashes.add("dynamodb", rows)
+        if "LastEvaluatedKey" not in response:
+            return
+        scan_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def scan_s3(hashes: HashStore, page_size: int) -> None:
+    # listing only: the etag of each object goes in now, hashes are filled in
+    # by resolve_s3_hashes for the objects whose etag is not the expected one
+    list_args = {"Bucket": S3_BUCKET_NAME, "Prefix": DRAFT_KEY_PREFIX, "MaxKeys": page_size}
+    while True:
+        response = s3_client.list_objects_v2(**list_args)
+        contents = response.get("Contents", [])
+        rows = []
+        for obj in contents:
+            match = DRAFT_KEY.match(obj["Key"])
+            if match is not None:
+                rows.append((int(match.group(1)), None, obj["ETag"]))
+        hashes.add("s3", rows)
+        if not response.get("IsTruncated") or not contents:
+            return
+        list_args["StartAfter"] = contents[-1]["Key"]
+
+
+def resolve_s3_hashes(hashes: HashStore, page_size: int) -> None:
+    # an object with the etag sqlite's row would produce has the same content
+    hashes.conn.execute(
+        "UPDATE hashes SET hash = (SELECT s.hash FROM hashes s WHERE s.store = 'sqlite' AND s.id = hashes.id)"
+        " WHERE store = 's3' AND etag = (SELECT s.etag FROM hashes s WHERE s.store = 'sqlite' AND s.id = hashes.id)")
+    # the rest (older formats, other compression, real differences) are downloaded
+    # a page at a time by id, the table is updated between pages
+    last_id = -1
+    while True:
+        ids = [draft_id for (draft_id,) in hashes.conn.execute(
+            "SELECT r.id FROM hashes r JOIN hashes s ON s.store = 'sqlite' AND s.id = r.id"
+            " WHERE r.store = 's3' AND r.hash IS NULL AND r.id > ? ORDER BY r.id LIMIT ?", (last_id, page_size))]
+        if not ids:
+            return
+        last_id = ids[-1]
+        fetched = fetch_all(lambda draft_id: fetch_s3_draft(s3_draft_key(draft_id)), ids,
+                            current_app.config["S3_FETCH_CONCURRENCY"], "s3_fetch")
+        # an object that cannot be read or decoded keeps a NULL hash and counts as diverged
+        hashes.conn.executemany("UPDATE hashes SET hash = ? WHERE store = 's3' AND id = ?",
+                                [(record_hash(data), draft_id) for draft_id, data, error in fetched if error is None])
+
+
+def repair_ids(store: str, ids: list) -> int:
+    # make `store` match sqlite for these ids as sqlite is now: rewrite the ids
+    # that exist and delete the ones that do not. returns how many failed
+    rows = {d.id: draft_to_dict(d) for d in db.session.query(Draft).filter(Draft.id.in_(ids))}
+    if store == "dynamodb":
+        write_requests = [{"PutRequest": {"Item": dynamodb_draft_item(draft_id, rows[draft_id])}} if draft_id in rows
+                          else {"DeleteRequest": {"Key": {"id": {"N": str(draft_id)}}}} for draft_id in ids]
+        return len(batch_write_items(ddb_client, DDB_TABLE_NAME, write_requests))
+
+    failed = 0
+    puts = [draft_id for draft_id in ids if draft_id in rows]
+    for draft_id, _, error in fetch_all(lambda draft_id: put_s3_draft(draft_id, rows[draft_id]), puts,
+                                        current_app.config["S3_FETCH_CONCURRENCY"], "s3_upload"):
+        if error is not None:
+            print(f"Error repairing s3 object {draft_id}: {error}")
+            failed += 1
+    deletes = [draft_id for draft_id in ids if draft_id not in rows]
+    for keys in chunked([s3_draft_key(draft_id) for draft_id in deletes], S3_DELETE_BATCH):
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_objects.html
+        response = s3_client.delete_objects(Bucket=S3_BUCKET_NAME,
+                                            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True})
+        failed += len(response.get("Errors", []))
+    return failed
+
+
+def reconcile(repair: bool = False, page_size: int = 1000, max_ids: int = 100, directory=None) -> dict:
+    # runs inside an app context. the report has exact counts per store and
+    # kind of drift, and at most max_ids of the ids for each
+    started = time.perf_counter()
+    hashes = HashStore(directory)
+    try:
+        scan_sqlite(hashes, page_size)
+        scan_dynamodb(hashes, page_size)
+        scan_s3(hashes, page_size)
+        resolve_s3_hashes(hashes, page_size)
+        hashes.conn.commit()
+
+        report = {
+            "checked": {store: hashes.count(store) for store in ("sqlite",) + REPLICAS},
+            "pending_replication": hashes.conn.execute("SELECT count(*) FROM pending").fetchone()[0],
+        }
+        for store in REPLICAS:
+            report[store] = {kind: hashes.drift_count(store, kind) for kind in DRIFT_KINDS}
+            report[store]["ids"] = {kind: next(hashes.drift_ids(store, kind, max_ids), []) for kind in DRIFT_KINDS}
+        report["consistent"] = not any(report[store][kind] for store in REPLICAS for kind in DRIFT_KINDS)
+
+        if repair and not report["consistent"]:
+            report["repaired"] = {}
+            report["repair_failures"] = {}
+            for store in REPLICAS:
+                repaired = failed = 0
+                for kind in DRIFT_KINDS:
+                    for ids in hashes.drift_ids(store, kind, page_size):
+                        store_failed = repair_ids(store, ids)
+                        repaired += len(ids) - store_failed
+                        failed += store_failed
+                report["repaired"][store] = repaired
+                report["repair_failures"][store] = failed
+    finally:
+        hashes.close()
+    report["duration_s"] = round(time.perf_counter() - started, 3)
+    current_app.extensions["reconcile_report"] = report
+    return report
+
+
+def scheduled_reconcile() -> dict:
+    # the PeriodicTask job behind RECONCILE_INTERVAL
+    config = current_app.config
+    report = reconcile(repair=config["RECONCILE_REPAIR"], page_size=config["RECONCILE_PAGE_SIZE"])
+    if not report["consistent"]:
+        drift = {store: {kind: report[store][kind] for kind in DRIFT_KINDS} for store in REPLICAS}
+        print(f"Reconcile found drift: {drift}, repaired: {report.get('repaired')}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="diff dynamodb and s3 against sqlite, optionally repair them")
+    parser.add_argument("--repair", action="store_true", help="rewrite drifted records from sqlite")
+    parser.add_argument("--page-size", type=int, default=1000, help="records read and repaired per batch")
+    parser.add_argument("--max-ids", type=int, default=100, help="ids listed per kind of drift in the report")
+    parser.add_argument("--tmp-dir", help="where the temporary hash database goes")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    from app.application import create_app
+    with create_app().app_context():
+        report = reconcile(args.repair, args.page_size, args.max_ids, args.tmp_dir)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    # 0 when the stores agree or every drifted record was repaired
+    return 0 if report["consistent"] or (args.repair and not any(report["repair_failures"].values())) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
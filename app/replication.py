@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+
+def backoff_delay(attempts: int, base: float, cap: float = 300.0) -> float:
+    # exponential backoff for an outbox entry that failed `attempts` times
+    return min(cap, base * (2 ** max(0, attempts - 1)))
+
+
+class OutboxWorker:
+    # background thread that drains the replication outbox
+    # drain() handles one batch and returns how many entries it processed,
+    # pending() returns how many entries are still waiting to replicate
+    def __init__(self, app, drain, pending, poll_interval: float = 0.5):
+        self.app = app
+        self.drain = drain
+        self.pending = pending
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._drain_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self) -> None:
+        # a forked worker process does not inherit the thread, so start a new one
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def run_once(self) -> int:
+        with self._drain_lock:
+            with self.app.app_context():
+                return self.drain()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        # barrier for tests and shutdown: drain on the calling thread until
+        # nothing is left or the timeout passes, True when fully drained
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.run_once()
+            with self.app.app_context():
+                if self.pending() == 0:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                print(f"Error draining replication outbox: {e}")
+                processed = 0
+            # keep going while there is a backlog, otherwise wait for a write
+            if processed == 0:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
@@ -0,0 +1,156 @@
+import gzip
+import json
+
+from app.serialization import DRAFT_FIELDS
+
+try:
+    # zstd is optional, pip install zstandard to use the "zstd" formats
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# per record objects stay at draft_{id}.json whatever the format, so updates and
+# deletes do not need to know how a record was written. the format is stored in
+# the object metadata and in Content-Encoding, which is how reads pick it up.
+# objects written before formats existed have neither and are plain json
+DRAFT_KEY_PREFIX = "draft_"
+SNAPSHOT_PREFIX = "snapshots/"
+MANIFEST_KEY = f"{SNAPSHOT_PREFIX}manifest.json"
+FORMAT_METADATA = "draft-format"
+
+RECORD_FORMATS = ("json", "gzip", "zstd")
+SNAPSHOT_LAYOUTS = ("ndjson", "columnar")
+# the keys of a snapshot record, also the columns of the columnar layout
+SNAPSHOT_FIELDS = ("id",) + DRAFT_FIELDS
+
+
+def compress(data: bytes, encoding: str | None) -> bytes:
+    if encoding is None:
+        return data
+    if encoding == "gzip":
+        # mtime=0 keeps the bytes (and the etag) stable for the same record
+        return gzip.compress(data, mtime=0)
+    if encoding == "zstd":
+        return _zstd().ZstdCompressor().compress(data)
+    raise ValueError(f"unknown content encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: str | None) -> bytes:
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "zstd":
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"unknown content encoding: {encoding}")
+
+
+def _zstd():
+    if zstandard is None:
+        raise ValueError("zstd needs the zstandard package")
+    return zstandard
+
+
+def record_encoding(record_format: str) -> str | None:
+    if record_format not in RECORD_FORMATS:
+        raise ValueError(f"unknown s3 record format: {record_format}")
+    return None if record_format == "json" else record_format
+
+
+def encode_record(draft: dict, record_format: str = "json") -> dict:
+    # put_object arguments (without Bucket/Key) for one draft
+    encoding = record_encoding(record_format)
+    body = json.dumps(draft, separators=(",", ":")).encode()
+    args = {
+        "Body": compress(body, encoding),
+        "ContentType": "application/json",
+        "Metadata": {FORMAT_METADATA: record_format},
+    }
+    if encoding is not None:
+        args["ContentEncoding"] = encoding
+    return args
+
+
+def object_encoding(response: dict) -> str | None:
+    # get_object/head_object response -> the encoding its body was written with
+    record_format = response.get("Metadata", {}).get(FORMAT_METADATA)
+    if record_format in RECORD_FORMATS:
+        return record_encoding(record_format)
+    return response.get("ContentEncoding")
+
+
+def decode_record(data: bytes, response: dict) -> dict:
+    return json.loads(decompress(data, object_encoding(response)))
+
+
+def snapshot_key(collection_version: int, layout: str, record_format: str) -> str:
+    extension = {"json": "", "gzip": ".gz", "zstd": ".zst"}[record_format]
+    suffix = "ndjson" if layout == "ndjson" else "json"
+    return f"{SNAPSHOT_PREFIX}drafts-{collection_version}.{suffix}{extension}"
+
+
+def encode_snapshot(drafts: list, layout: str = "ndjson", record_format: str = "gzip") -> dict:
+    # one object for the whole table: a draft per line, or one list per column
+    # (the field names are written once and the columns compress better)
+    if layout == "ndjson":
+        body = "".join(json.dumps(d, separators=(",", ":")) + "\n" for d in drafts).encode()
+        content_type = "application/x-ndjson"
+    elif layout == "columnar":
+        body = json.dumps({field: [d[field] for d in drafts] for field in SNAPSHOT_FIELDS},
+                          separators=(",", ":")).encode()
+        content_type = "application/json"
+    else:
+        raise ValueError(f"unknown s3 snapshot layout: {layout}")
+    encoding = record_encoding(record_format)
+    args = {
+        "Body": compress(body, encoding),
+        "ContentType": content_type,
+        "Metadata": {FORMAT_METADATA: record_format, "draft-layout": layout},
+    }
+    if encoding is not None:
+        args["ContentEncoding"] = encoding
+    return args
+
+
+def decode_snapshot(data: bytes, response: dict) -> list:
+    body = decompress(data, object_encoding(response))
+    if response.get("Metadata", {}).get("draft-layout") == "columnar":
+        columns = json.loads(body)
+        return [dict(zip(SNAPSHOT_FIELDS, row)) for row in zip(*(columns[field] for field in SNAPSHOT_FIELDS))]
+    return [json.loads(line) for line in body.splitlines() if line]
+
+
+def snapshot_manifest(key: str, collection_version: int, drafts: list, layout: str, record_format: str,
+                      size: int, created_at: float) -> dict:
+    return {
+        "key": key,
+        "collection_version": collection_version,
+        "count": len(drafts),
+        "layout": layout,
+        "format": record_format,
+        "size": size,
+        "created_at": created_at,
+    }
+
+
+def decode_manifest(data: bytes) -> dict:
+    return json.loads(data)
+
+
+def manifest_is_current(manifest: dict | None, collection_version: int) -> bool:
+    # the snapshot a manifest points to holds the table at its collection
+    # version, it can stand in for the draft objects while sqlite is there too
+    return manifest is not None and manifest["collection_version"] == collection_version
+
+
+def snapshot_page(drafts: list, position: str | None, limit: int | None):
+    # a page of a snapshot in the same order and with the same positions as a
+    # list_objects_v2 listing of the draft_ objects, so the next page can come
+    # from either one
+    keyed = sorted((f"{DRAFT_KEY_PREFIX}{d['id']}.json", d) for d in drafts)
+    if position is not None:
+        keyed = [(key, d) for key, d in keyed if key > position]
+    if limit is None or len(keyed) <= limit:
+        return [d for _, d in keyed], None
+    page = keyed[:limit]
+    return [d for _, d in page], page[-1][0]
@@ -0,0 +1,45 @@
+import os
+import threading
+
+
+class PeriodicTask:
+    # background thread that runs func(), inside an app context, every
+    # `interval` seconds. errors are printed and the next run goes ahead
+    def __init__(self, app, func, interval: float, name: str):
+        self.app = app
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self) -> None:
+        # a forked worker process does not inherit the thread, so start a new one
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self):
+        with self.app.app_context():
+            self.last_result = self.func()
+        self.last_error = None
+        return self.last_result
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error running {self.name}: {e}")
@@ -0,0 +1,99 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    # optional, pip install orjson for the faster JSON backend
+    import orjson
+except ImportError:
+    orjson = None
+
+# api field -> Draft column, the one place this mapping is written down. the
+# converters below are all built from it
+DRAFT_COLUMNS = {
+    "pick_number": "draft_pick_number",
+    "pro_team": "pro_team_name",
+    "player_name": "player_name",
+    "amateur_team": "amateur_team_name",
+}
+DRAFT_FIELDS = tuple(DRAFT_COLUMNS)
+
+
+def draft_to_dict(d) -> dict:
+    # Draft row -> api dict
+    return {field: getattr(d, column) for field, column in DRAFT_COLUMNS.items()}
+
+
+def draft_to_dict_with_id(d) -> dict:
+    return {"id": d.id, **draft_to_dict(d)}
+
+
+def draft_fields(p: dict) -> dict:
+    # api payload -> api dict with just the draft fields, KeyError on a missing one
+    return {field: p[field] for field in DRAFT_FIELDS}
+
+
+def draft_columns(p: dict) -> dict:
+    # api dict -> Draft constructor / column keyword arguments
+    return {column: p[field] for field, column in DRAFT_COLUMNS.items()}
+
+
+def dynamodb_item_to_dict(i: dict) -> dict:
+    # dynamodb item -> api dict, the id stays the string dynamodb returns it as
+    return {"id": i["id"]["N"], **{field: i[field]["S"] if field in i else None for field in DRAFT_FIELDS}}
+
+
+def dynamodb_string_attributes(p: dict) -> dict:
+    # api dict -> the string attributes of a dynamodb item. a null field is
+    # left out, the team indexes only take string keys and skip such items
+    return {field: {"S": p[field]} for field in DRAFT_FIELDS if p[field] is not None}
+
+
+def apply_draft_fields(draft_rec, draft_data: dict) -> None:
+    for column, value in draft_columns(draft_data).items():
+        setattr(draft_rec, column, value)
+
+
+class DraftJSONProvider(DefaultJSONProvider):
+    # flask's json provider with a swappable encoder. "orjson" encodes to bytes
+    # in C, "stdlib" is flask's own json.dumps. both sort keys and fall back to
+    # flask's default() for dates, decimals and the like, so responses only
+    # differ in non-ascii characters being sent as utf-8 instead of escaped
+    def __init__(self, app, backend: str = "auto"):
+        super().__init__(app)
+        if backend == "auto":
+            backend = "orjson" if orjson is not None else "stdlib"
+        if backend == "orjson" and orjson is None:
+            raise ValueError("JSON_BACKEND orjson needs the orjson package")
+        if backend not in ("orjson", "stdlib"):
+            raise ValueError(f"unknown JSON_BACKEND: {backend}")
+        self.backend = backend
+
+    def _orjson_dumps(self, obj, sort_keys: bool) -> bytes:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs) -> str:
+        # anything beyond the defaults (indent, custom separators, cls, ...) goes to json.dumps
+        if self.backend == "orjson" and set(kwargs) <= {"separators"}:
+            return self._orjson_dumps(obj, self.sort_keys).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.backend == "orjson" and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def dumps_line(self, obj) -> bytes:
+        # one ndjson line, keys in the order they were built
+        if self.backend == "orjson":
+            return self._orjson_dumps(obj, False) + b"\n"
+        return (json.dumps(obj, default=self.default, separators=(",", ":")) + "\n").encode()
+
+    def response(self, *args, **kwargs):
+        if self.backend != "orjson" or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj, self.sort_keys) + b"\n", mimetype=self.mimetype)
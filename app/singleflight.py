@@ -0,0 +1,125 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+# request coalescing: concurrent calls with the same key share one execution.
+# the first caller runs fn, callers arriving while it runs wait for it and get
+# its result, or its exception. nothing is kept once the call returns, so
+# unlike the read-through cache a request never gets an answer that was
+# produced before it started. keys are (group, detail) tuples, the group
+# names the kind of read for the counters
+
+
+class _FlightStats:
+    def __init__(self, max_tracked_keys: int = 1000):
+        # per key counters for the most recently used keys, per group totals for all of them
+        self.max_tracked_keys = max_tracked_keys
+        self._keys = OrderedDict()
+        self._groups = {}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: tuple, coalesced: bool) -> None:
+        outcome = 1 if coalesced else 0
+        with self._stats_lock:
+            counts = self._keys.get(key)
+            if counts is None:
+                counts = self._keys[key] = [0, 0]
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_tracked_keys:
+                self._keys.popitem(last=False)
+            counts[outcome] += 1
+            self._groups.setdefault(key[0], [0, 0])[outcome] += 1
+
+    def group_counts(self) -> dict:
+        # group -> (executed, coalesced)
+        with self._stats_lock:
+            return {group: tuple(counts) for group, counts in self._groups.items()}
+
+    def stats(self, top: int = 20) -> dict:
+        with self._stats_lock:
+            busiest = sorted(self._keys.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            return {
+                "in_flight": self.in_flight(),
+                "groups": {group: {"executed": e, "coalesced": c} for group, (e, c) in self._groups.items()},
+                # the keys with the most coalesced calls
+                "keys": [{"group": key[0], "key": str(key[1]), "executed": e, "coalesced": c}
+                         for key, (e, c) in busiest if c],
+            }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(_FlightStats):
+    # for the blocking views, callers are request threads
+    def __init__(self, max_tracked_keys: int = 1000):
+        super().__init__(max_tracked_keys)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def do(self, key: tuple, fn):
+        # returns (result, coalesced)
+        with self._lock:
+            call = self._calls.get(key)
+            coalesced = call is not None
+            if not coalesced:
+                call = self._calls[key] = _Call()
+        self._count(key, coalesced)
+        if coalesced:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight(_FlightStats):
+    # for the coroutine views, which all run on one event loop per process
+    def __init__(self, max_tracked_keys: int = 1000):
+        super().__init__(max_tracked_keys)
+        self._calls = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: tuple, fn):
+        # fn is a zero argument coroutine function, returns (result, coalesced)
+        future = self._calls.get(key)
+        if future is not None:
+            self._count(key, True)
+            # shielded, a follower that goes away must not cancel the shared call
+            return await asyncio.shield(future), True
+        self._count(key, False)
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # marks the exception as retrieved when nobody was waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
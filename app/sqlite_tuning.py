@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# https://www.sqlite.org/pragma.html
+# "performance" lets readers and a writer work at the same time (WAL), only
+# fsyncs at checkpoints (safe in WAL, a power cut can lose the last commits but
+# never corrupts the file), waits for the write lock instead of failing with
+# "database is locked", and keeps more of the file in memory.
+# "default" leaves sqlite's own settings alone
+SQLITE_PROFILES = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,
+        # negative sizes are in KiB, so 64MB
+        "cache_size": -65536,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def sqlite_pragmas(profile: str, overrides: dict | None = None) -> dict:
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"unknown sqlite profile: {profile}")
+    return {**SQLITE_PROFILES[profile], **(overrides or {})}
+
+
+def is_memory_database(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def sqlite_engine_options(url, pool_size: int, max_overflow: int, pool_timeout: float,
+                          statement_cache: int) -> dict:
+    # create_engine() arguments for a file database. pysqlite keeps prepared
+    # statements per connection in a cache of cached_statements entries, so a
+    # pooled connection reuses the compiled SELECT/INSERT/UPDATE of every handler
+    if is_memory_database(url):
+        # one shared connection, there is nothing to size
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "connect_args": {"cached_statements": statement_cache},
+    }
+
+
+def apply_pragmas(engine, pragmas: dict, read_only: bool = False) -> None:
+    # runs once per new pooled connection
+    if not pragmas and not read_only:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def create_read_engine(engine, pragmas: dict, options: dict):
+    # a second pool of query_only connections for the GET handlers, so reads
+    # never queue behind writers for a pooled connection. None for in memory
+    # databases, where another connection would be another database
+    if is_memory_database(engine.url):
+        return None
+    read_engine = create_engine(engine.url, **options)
+    apply_pragmas(read_engine, pragmas, read_only=True)
+    return read_engine
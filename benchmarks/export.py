@@ -0,0 +1,74 @@
+# GET /api/v1/drafts/export over a large table: wall time, bytes and peak
+# python memory for each format, against the old way of pulling the same rows
+# as one json document from GET /drafts?source=primary
+#
+# tracemalloc roughly triples the wall times, compare them with each other only
+#
+# usage: python -m benchmarks.export --rows 100000
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app.application import create_app, db, Draft, new_draft_record
+
+CASES = [
+    ("GET /drafts?source=primary", "/api/v1/drafts?source=primary"),
+    ("export csv", "/api/v1/drafts/export?format=csv"),
+    ("export csv gzip", "/api/v1/drafts/export?format=csv&compression=gzip"),
+    ("export ndjson", "/api/v1/drafts/export?format=ndjson"),
+    ("export parquet", "/api/v1/drafts/export?format=parquet"),
+]
+
+
+def seed(bench_app, rows):
+    with bench_app.app_context():
+        db.create_all()
+        for start in range(0, rows, 10000):
+            db.session.add_all(new_draft_record({"pick_number": f"({n % 60 + 1})", "pro_team": f"Team {n % 30}",
+                                                 "player_name": f"Player {n}", "amateur_team": f"School {n % 200}"})
+                               for n in range(start, min(rows, start + 10000)))
+            db.session.commit()
+        return Draft.query.count()
+
+
+def measure(client, url):
+    # the body is read chunk by chunk and dropped, like a client writing it to disk
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url, buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return response.status_code, elapsed, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="draft-export-")
+    bench_app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                            "DRAFT_CACHE_BACKEND": None})
+    rows = seed(bench_app, args.rows)
+    client = bench_app.test_client()
+    print(f"rows={rows}")
+    print(f"{'case':30} {'status':>6} {'seconds':>8} {'MB sent':>8} {'peak MB':>8}")
+    for name, url in CASES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                status, elapsed, size, peak = measure(client, url)
+            except Exception as e:
+                status, elapsed, size, peak = str(e)[:6], 0.0, 0, 0
+        print(f"{name:30} {status:>6} {elapsed:8.2f} {size / 1e6:8.2f} {peak / 1e6:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# offline load test for the draft api
+# seeds N drafts, then drives a mixed GET/POST/PUT/DELETE workload through the
+# flask app from several threads, with s3 and dynamodb served by the in-process
+# fakes in app/local_aws.py so no localstack or network is needed
+#
+# usage: python -m benchmarks.loadtest --seed 1000 --requests 5000 --concurrency 8
+#        python -m benchmarks.loadtest --json results.json   (to track between releases)
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+from app.aws_clients import override_client
+from app.local_aws import local_client
+from app.application import create_app, db, s3_client, ddb_client, flush_outbox, S3_BUCKET_NAME, DDB_TABLE_NAME
+from instance.aws_ddb_setup import initialize_dynamodb
+from instance.aws_s3_setup import initialize_s3
+
+DEFAULT_MIX = "get=60,list=5,post=15,put=15,delete=5"
+
+
+class Recorder:
+    # thread safe latency samples keyed by name
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.samples[name].append(seconds)
+
+
+class TimedClient:
+    # wraps a client so every operation is recorded as a backend leg
+    def __init__(self, client, backend, recorder):
+        self._client = client
+        self._backend = backend
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._recorder.add(f"{self._backend}.{name}", time.perf_counter() - start)
+        return timed
+
+
+def percentile(samples, pct):
+    # nearest rank percentile
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, wall_time):
+    return {
+        name: {
+            "count": len(values),
+            "rps": round(len(values) / wall_time, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+        for name, values in sorted(samples.items())
+    }
+
+
+def make_bench_app(db_path, config):
+    # same app as production, on a throwaway sqlite file
+    return create_app(dict(config, SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path}"))
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def run(args):
+    legs = Recorder()
+    endpoints = Recorder()
+    # the fakes answer in microseconds, --latency-ms/--jitter-ms make them behave more like a network store
+    latency, jitter = args.latency_ms / 1000, args.jitter_ms / 1000
+    override_client("s3", TimedClient(local_client("s3", latency, jitter, args.random_seed), "s3", legs))
+    override_client("dynamodb", TimedClient(local_client("dynamodb", latency, jitter, args.random_seed), "dynamodb", legs))
+    workdir = tempfile.mkdtemp(prefix="draft-bench-")
+    config = {"REPLICATION_MODE": args.replication, "API_MODE": args.api_mode}
+    if args.no_cache:
+        config["DRAFT_CACHE_BACKEND"] = None
+    bench_app = make_bench_app(os.path.join(workdir, "bench.db"), config)
+
+    with bench_app.app_context():
+        db.create_all()
+        initialize_s3(s3_client=s3_client, bucket_name=S3_BUCKET_NAME)
+        initialize_dynamodb(dynamodb_client=ddb_client, table_name=DDB_TABLE_NAME)
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(db.engine, "after_cursor_execute")
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            legs.add(f"sqlite.{statement.split()[0].lower()}", time.perf_counter() - conn.info["query_start"].pop())
+
+    names = itertools.count()
+    teams = [f"Team {i}" for i in range(30)]
+    rng = random.Random(args.random_seed)
+
+    def new_draft():
+        n = next(names)
+        return {
+            "pick_number": f"({n % 60 + 1})",
+            "pro_team": teams[n % len(teams)],
+            "player_name": f"Player {n}",
+            "amateur_team": f"School {n % 200}",
+        }
+
+    # seed through the bulk endpoint
+    ids = []
+    seed_client = bench_app.test_client()
+    for start in range(0, args.seed, 1000):
+        batch = [new_draft() for _ in range(min(1000, args.seed - start))]
+        response = seed_client.post("/api/v1/drafts:batch", json=batch)
+        ids.extend(r["id"] for r in response.get_json()["results"] if "id" in r)
+    if args.replication == "async":
+        with bench_app.app_context():
+            flush_outbox(60)
+    ids_lock = threading.Lock()
+
+    def pick_id():
+        with ids_lock:
+            return rng.choice(ids) if ids else 1
+
+    weights = parse_mix(args.mix)
+    operations = rng.choices(list(weights), weights=list(weights.values()), k=args.requests)
+    local = threading.local()
+
+    def do(operation):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = bench_app.test_client()
+        start = time.perf_counter()
+        if operation == "get":
+            name = "GET /drafts/<id>"
+            client.get(f"/api/v1/drafts/{pick_id()}")
+        elif operation == "list":
+            name = "GET /drafts"
+            client.get(f"/api/v1/drafts?limit={args.page_size}")
+        elif operation == "post":
+            name = "POST /drafts"
+            response = client.post("/api/v1/drafts", json=new_draft())
+            if response.status_code == 201:
+                with ids_lock:
+                    ids.append(response.get_json()["id"])
+        elif operation == "put":
+            name = "PUT /drafts/<id>"
+            client.put(f"/api/v1/drafts/{pick_id()}", json=new_draft())
+        elif operation == "delete":
+            name = "DELETE /drafts/<id>"
+            with ids_lock:
+                draft_id = ids.pop(rng.randrange(len(ids))) if ids else 1
+            client.delete(f"/api/v1/drafts/{draft_id}")
+        else:
+            raise ValueError(f"unknown operation {operation}")
+        endpoints.add(name, time.perf_counter() - start)
+
+    # leg timings from seeding are not part of the workload
+    legs.samples.clear()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(do, operations))
+    wall_time = time.perf_counter() - started
+
+    if args.replication == "async":
+        # replicate the tail before the fakes are taken away from the worker
+        with bench_app.app_context():
+            flush_outbox(60)
+        bench_app.extensions.pop("outbox_worker").stop()
+    override_client("s3", None)
+    override_client("dynamodb", None)
+    return {
+        "config": vars(args),
+        "wall_time_s": round(wall_time, 3),
+        "rps": round(args.requests / wall_time, 1),
+        "endpoints": summarize(endpoints.samples, wall_time),
+        "backend_legs": summarize(legs.samples, wall_time),
+    }
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'name':<28}{'count':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in rows.items():
+        print(f"{name:<28}{row['count']:>8}{row['rps']:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=1000, help="drafts created before the run")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights, default {DEFAULT_MIX}")
+    parser.add_argument("--page-size", type=int, default=100, help="limit used by the list requests")
+    parser.add_argument("--replication", choices=["sync", "async"], default="sync")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--api-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--random-seed", type=int, default=6620)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every s3/dynamodb call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random extra latency, seeded by --random-seed")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own log output")
+    args = parser.parse_args()
+
+    if args.verbose:
+        results = run(args)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run(args)
+    print(f"{args.requests} requests in {results['wall_time_s']}s ({results['rps']} req/s), concurrency {args.concurrency}")
+    print_table("endpoints", results["endpoints"])
+    print_table("backend legs", results["backend_legs"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
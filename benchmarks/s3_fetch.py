@@ -0,0 +1,48 @@
+# compares serial vs parallel s3 object fetches for the GET /drafts listing
+# usage: python -m benchmarks.s3_fetch --objects 1000 --latency-ms 5 --concurrency 16
+import argparse
+import json
+import time
+
+from app.executor import fetch_all
+
+
+class SlowS3Client:
+    # stands in for s3/localstack with a fixed per request round trip
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        return json.dumps({"key": Key})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    s3 = SlowS3Client(args.latency_ms / 1000)
+    keys = [f"draft_{i}.json" for i in range(args.objects)]
+
+    def fetch(key):
+        return json.loads(s3.get_object(Bucket="draft-bucket", Key=key))
+
+    start = time.perf_counter()
+    serial = [fetch(key) for key in keys]
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = [result for _, result, _ in fetch_all(fetch, keys, args.concurrency)]
+    parallel_time = time.perf_counter() - start
+
+    assert serial == parallel
+    print(f"objects={args.objects} latency={args.latency_ms}ms concurrency={args.concurrency}")
+    print(f"serial:   {serial_time:.3f}s")
+    print(f"parallel: {parallel_time:.3f}s ({serial_time / parallel_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# cpu time and encoded size of a GET /drafts style payload: Draft rows to dicts,
+# dicts to JSON with each JSON backend, and the JSON body with each response
+# compression. everything runs in process, there is no http or storage involved
+#
+# usage: python -m benchmarks.serialization --records 10000 --repeat 5
+import argparse
+import json
+import time
+
+from flask import Flask
+
+from app.compression import available_encodings, compress_body
+from app.serialization import DraftJSONProvider, draft_columns, draft_to_dict, orjson
+from app.application import DEFAULT_CONFIG, Draft
+
+
+def hand_written(draft_rec):
+    # how every handler built a draft dict before app/serialization.py
+    return {
+        "pick_number": draft_rec.draft_pick_number,
+        "pro_team": draft_rec.pro_team_name,
+        "player_name": draft_rec.player_name,
+        "amateur_team": draft_rec.amateur_team_name
+    }
+
+
+def cpu_ms(func, repeat):
+    # best of `repeat` runs, process time so other processes do not count
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        result = func()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    rows = [Draft(id=n, **draft_columns({"pick_number": f"({n % 60 + 1})", "pro_team": f"Team {n % 30}",
+                                         "player_name": f"Player {n}", "amateur_team": f"School {n % 200}"}))
+            for n in range(args.records)]
+    results = {"records": args.records, "to_dict": {}, "encode": {}, "compress": {}}
+
+    for name, convert in (("hand written", hand_written), ("draft_to_dict", draft_to_dict)):
+        results["to_dict"][name], records = cpu_ms(lambda: [convert(r) for r in rows], args.repeat)
+    # one store only, three copies of the same list would flatter the compressors
+    payload = {"sqlite_draft_data": records}
+
+    flask_app = Flask(__name__)
+    body = None
+    for backend in ["stdlib"] + (["orjson"] if orjson is not None else []):
+        provider = DraftJSONProvider(flask_app, backend)
+        with flask_app.app_context():
+            ms, response = cpu_ms(lambda: provider.response(payload), args.repeat)
+        body = response.get_data()
+        results["encode"][backend] = {"cpu_ms": ms, "bytes": len(body)}
+
+    results["compress"]["identity"] = {"cpu_ms": 0.0, "bytes": len(body)}
+    for encoding in available_encodings(DEFAULT_CONFIG["COMPRESSION_ENCODINGS"]):
+        level = DEFAULT_CONFIG["COMPRESSION_LEVELS"][encoding]
+        ms, compressed = cpu_ms(lambda: compress_body(body, encoding, level), args.repeat)
+        results["compress"][encoding] = {"cpu_ms": ms, "bytes": len(compressed)}
+
+    print(f"{args.records} records, best of {args.repeat}")
+    print(f"\n{'rows -> dicts':<16}{'cpu ms':>10}")
+    for name, ms in results["to_dict"].items():
+        print(f"{name:<16}{ms:>10}")
+    for section in ("encode", "compress"):
+        print(f"\n{section:<16}{'cpu ms':>10}{'bytes':>12}")
+        for name, row in results[section].items():
+            print(f"{name:<16}{row['cpu_ms']:>10}{row['bytes']:>12}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
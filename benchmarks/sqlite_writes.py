@@ -0,0 +1,131 @@
+# concurrent sqlite writes with the default sqlite settings vs the "performance"
+# profile (WAL, synchronous=NORMAL, busy timeout, mmap/cache, sized pool and a
+# read only pool for readers). writer threads do what POST /drafts does in
+# sqlite (insert a draft and bump the collection version in one transaction)
+# while reader threads run the GET /drafts page query
+#
+# usage: python -m benchmarks.sqlite_writes --writers 16 --writes 200 --readers 4
+#        python -m benchmarks.sqlite_writes --dir /var/tmp   (run on a real disk, fsync matters)
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from app.application import (create_app, db, Draft, bump_collection_version, new_draft_record,
+                             filtered_draft_query, read_session)
+from benchmarks.loadtest import percentile
+
+PROFILES = {
+    # what the app ran with before: sqlite defaults and sqlalchemy's default pool
+    "default": {"SQLITE_PROFILE": "default", "SQLALCHEMY_ENGINE_OPTIONS": {}, "SQLITE_READ_ONLY_GETS": False},
+    "performance": {"SQLITE_PROFILE": "performance"},
+}
+
+
+def run_profile(name, args):
+    workdir = tempfile.mkdtemp(prefix="draft-sqlite-", dir=args.dir)
+    bench_app = create_app(dict(PROFILES[name], SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'bench.db')}"))
+    with bench_app.app_context():
+        db.create_all()
+    names = itertools.count()
+    write_latencies = []
+    read_latencies = []
+    errors = {"locked": 0, "other": 0}
+    lock = threading.Lock()
+    writers_done = threading.Event()
+
+    def count_error(e):
+        with lock:
+            errors["locked" if "locked" in str(e) else "other"] += 1
+
+    def writer():
+        for _ in range(args.writes):
+            n = next(names)
+            start = time.perf_counter()
+            with bench_app.app_context():
+                try:
+                    db.session.add(new_draft_record({"pick_number": f"({n % 60 + 1})", "pro_team": f"Team {n % 30}",
+                                                     "player_name": f"Player {n}", "amateur_team": f"School {n % 200}"}))
+                    bump_collection_version()
+                    db.session.commit()
+                except OperationalError as e:
+                    db.session.rollback()
+                    count_error(e)
+                    continue
+            with lock:
+                write_latencies.append(time.perf_counter() - start)
+
+    def reader():
+        while not writers_done.is_set():
+            start = time.perf_counter()
+            with bench_app.test_request_context():
+                try:
+                    filtered_draft_query({}, read_session()).order_by(Draft.id.desc()).limit(100).all()
+                except OperationalError as e:
+                    count_error(e)
+                    continue
+            with lock:
+                read_latencies.append(time.perf_counter() - start)
+
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer) for _ in range(args.writers)]
+    started = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    wall_time = time.perf_counter() - started
+    writers_done.set()
+    for thread in readers:
+        thread.join()
+
+    def summary(samples):
+        if not samples:
+            return {"count": 0, "per_s": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+        return {
+            "count": len(samples),
+            "per_s": round(len(samples) / wall_time, 1),
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        }
+    return {"wall_time_s": round(wall_time, 3), "writes": summary(write_latencies),
+            "reads": summary(read_latencies), "errors": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16, help="threads committing drafts")
+    parser.add_argument("--writes", type=int, default=200, help="commits per writer thread")
+    parser.add_argument("--readers", type=int, default=4, help="threads reading pages while the writers run")
+    parser.add_argument("--dir", help="where to put the database files, default is the system temp dir")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name in PROFILES:
+        # the app prints errors on its own, keep the table readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = run_profile(name, args)
+    print(f"writers={args.writers} writes={args.writes} readers={args.readers}")
+    print(f"{'profile':<14}{'op':<8}{'count':>8}{'per s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'locked':>8}")
+    for name, result in results.items():
+        for op in ("writes", "reads"):
+            row = result[op]
+            locked = result["errors"]["locked"] if op == "writes" else ""
+            print(f"{name:<14}{op:<8}{row['count']:>8}{row['per_s']:>10}{str(row['p50_ms']):>10}"
+                  f"{str(row['p95_ms']):>10}{str(row['p99_ms']):>10}{locked:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "profiles": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
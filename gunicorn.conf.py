@@ -0,0 +1,27 @@
+# https://docs.gunicorn.org/en/stable/settings.html
+# worker and thread counts come from the environment so each host can use all of its cores
+import multiprocessing
+import os
+
+bind = os.environ.get("DRAFT_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("DRAFT_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("DRAFT_THREADS", "4"))
+worker_class = "gthread"
+timeout = int(os.environ.get("DRAFT_WORKER_TIMEOUT", "30"))
+keepalive = 5
+# load the app once in the master so resource setup runs a single time
+preload_app = True
+# the master does not replicate, each worker starts its outbox worker in post_fork
+raw_env = ["DRAFT_OUTBOX_AUTOSTART=false"]
+
+
+def on_starting(server):
+    from app.application import initialize_resources
+    initialize_resources(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    from app.application import reset_worker_state, start_outbox_worker
+    app = server.app.wsgi()
+    reset_worker_state(app)
+    start_outbox_worker(app)
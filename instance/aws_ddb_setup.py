@@ -1,6 +1,58 @@
-import boto3
+import time
+import weakref
 
-def initialize_dynamodb(dynamodb_client: boto3.client, table_name: str) -> None:
+from botocore.exceptions import ClientError
+
+# global secondary indexes used by the filtered GET /drafts queries
+TEAM_INDEXES = {
+    'pro_team': 'pro_team-index',
+    'amateur_team': 'amateur_team-index'
+}
+
+# tables known to be active, per client, so repeated calls (every test, every
+# app start in a process) cost nothing after the first describe_table
+_ready = weakref.WeakKeyDictionary()
+
+
+def table_status(dynamodb_client, table_name: str):
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/describe_table.html
+    try:
+        return dynamodb_client.describe_table(TableName=table_name)['Table']['TableStatus']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+
+
+def wait_until_active(dynamodb_client, table_name: str, timeout: float = 60.0, delay: float = 0.5) -> bool:
+    # polled instead of the table_exists waiter, which waits 20 seconds between checks
+    deadline = time.monotonic() + timeout
+    while table_status(dynamodb_client, table_name) != 'ACTIVE':
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay)
+    return True
+
+
+def initialize_dynamodb(dynamodb_client, table_name: str) -> None:
+    # a ClientProxy stands in for whichever client the process uses right now
+    client = dynamodb_client.resolve() if hasattr(type(dynamodb_client), "resolve") else dynamodb_client
+    if table_name in _ready.get(client, ()):
+        return
+    try:
+        status = table_status(dynamodb_client, table_name)
+    except ClientError as e:
+        print(f"Error checking DynamoDB table: {e}")
+        return
+    if status is None and not create_table(dynamodb_client, table_name):
+        return
+    if wait_until_active(dynamodb_client, table_name):
+        _ready.setdefault(client, set()).add(table_name)
+    else:
+        print(f"DynamoDB table {table_name} is not active")
+
+
+def create_table(dynamodb_client, table_name: str) -> bool:
     try:
         #https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/create_table.html
         dynamodb_client.create_table(
@@ -9,6 +61,18 @@ def initialize_dynamodb(dynamodb_client: boto3.client, table_name: str) -> None:
                     'AttributeName': 'id',
                     'AttributeType': 'N'
                 },
+                {
+                    'AttributeName': 'pro_team',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'amateur_team',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'pick_value',
+                    'AttributeType': 'N'
+                },
             ],
             TableName=table_name,
             KeySchema=[
@@ -17,8 +81,24 @@ def initialize_dynamodb(dynamodb_client: boto3.client, table_name: str) -> None:
                     'KeyType': 'HASH'
                 },
             ],
+            # team lookups sorted by numeric pick so pick ranges are key conditions
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': index_name,
+                    'KeySchema': [
+                        {'AttributeName': attribute, 'KeyType': 'HASH'},
+                        {'AttributeName': 'pick_value', 'KeyType': 'RANGE'}
+                    ],
+                    'Projection': {'ProjectionType': 'ALL'}
+                }
+                for attribute, index_name in TEAM_INDEXES.items()
+            ],
             BillingMode='PAY_PER_REQUEST'
         )
         print(f"Table {table_name} created successfully!")
-    except Exception as e:
-        print(f"Error creating DynamoDB table: {e}")
\ No newline at end of file
+    except ClientError as e:
+        # another worker created it in the meantime
+        if e.response['Error']['Code'] != 'ResourceInUseException':
+            print(f"Error creating DynamoDB table: {e}")
+            return False
+    return True
@@ -1,9 +1,31 @@
-import boto3
+import weakref
 
-def initialize_s3(s3_client: boto3.client, bucket_name: str) -> None:
+from botocore.exceptions import ClientError
+
+# buckets known to exist, per client, so repeated calls (every test, every
+# app start in a process) cost nothing after the first head_bucket
+_ready = weakref.WeakKeyDictionary()
+
+
+def initialize_s3(s3_client, bucket_name: str) -> None:
+    # a ClientProxy stands in for whichever client the process uses right now
+    client = s3_client.resolve() if hasattr(type(s3_client), "resolve") else s3_client
+    if bucket_name in _ready.get(client, ()):
+        return
     try:
-        #https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/create_bucket.html
-        s3_client.create_bucket(Bucket=bucket_name)
-        print(f"successfully created s3 bucket: {bucket_name}")
-    except Exception as e:
-        print(f"Error creating s3 bucket: {e}")
\ No newline at end of file
+        #https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/head_bucket.html
+        s3_client.head_bucket(Bucket=bucket_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchBucket', 'NotFound'):
+            print(f"Error checking s3 bucket: {e}")
+            return
+        try:
+            #https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/create_bucket.html
+            s3_client.create_bucket(Bucket=bucket_name)
+            print(f"successfully created s3 bucket: {bucket_name}")
+        except ClientError as e:
+            # another worker created it in the meantime
+            if e.response['Error']['Code'] not in ('BucketAlreadyOwnedByYou', 'BucketAlreadyExists'):
+                print(f"Error creating s3 bucket: {e}")
+                return
+    _ready.setdefault(client, set()).add(bucket_name)
@@ -0,0 +1,71 @@
+import pytest
+import time
+
+from app.admission import MemoryAdmission, SqliteAdmission
+from app.application import create_app
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def admission(request, tmp_path):
+    if request.param == "memory":
+        return MemoryAdmission()
+    return SqliteAdmission(str(tmp_path / "admission.db"))
+
+
+def test_token_bucket_burst_and_refill(admission):
+    assert admission.take_token("client GET /drafts", rate=20, burst=2) == 0
+    assert admission.take_token("client GET /drafts", rate=20, burst=2) == 0
+    wait = admission.take_token("client GET /drafts", rate=20, burst=2)
+    assert 0 < wait <= 0.05
+    # other clients and routes have buckets of their own
+    assert admission.take_token("other GET /drafts", rate=20, burst=2) == 0
+    time.sleep(0.06)
+    assert admission.take_token("client GET /drafts", rate=20, burst=2) == 0
+
+
+def test_concurrency_slots(admission):
+    first = admission.acquire_slot("GET /drafts", 2)
+    second = admission.acquire_slot("GET /drafts", 2)
+    assert first is not None and second is not None
+    assert admission.acquire_slot("GET /drafts", 2) is None
+    assert admission.stats()["in_flight"] == {"GET /drafts": 2}
+    admission.release_slot("GET /drafts", first)
+    assert admission.acquire_slot("GET /drafts", 2) is not None
+
+
+def test_sqlite_admission_shared_between_workers(tmp_path):
+    path = str(tmp_path / "admission.db")
+    worker_a = SqliteAdmission(path)
+    worker_b = SqliteAdmission(path)
+    assert worker_a.take_token("client", rate=0.01, burst=1) == 0
+    assert worker_b.take_token("client", rate=0.01, burst=1) > 0
+    assert worker_a.acquire_slot("batch", 1) is not None
+    assert worker_b.acquire_slot("batch", 1) is None
+
+
+def test_rejected_requests(tmp_path):
+    limited_app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'admission.db'}",
+        "ADMISSION_BACKEND": "memory",
+        "RATE_LIMITS": {"default": [1000, 1000], "GET /api/v1/": [0.5, 2]},
+        "CONCURRENCY_LIMITS": {"GET /api/v1/pools/stats": 0, "GET /api/v1/cache/stats": 1},
+    })
+    client = limited_app.test_client()
+    assert client.get('/api/v1/').status_code == 200
+    assert client.get('/api/v1/').status_code == 200
+    response = client.get('/api/v1/')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    # limits are per client
+    assert client.get('/api/v1/', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+    # the slot is given back when the request ends
+    assert client.get('/api/v1/cache/stats').status_code == 200
+    assert client.get('/api/v1/cache/stats').status_code == 200
+    response = client.get('/api/v1/pools/stats')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'draft_admission_total{route="GET /api/v1/",decision="rate_limited"} 1' in metrics
+    assert 'draft_admission_total{route="GET /api/v1/pools/stats",decision="over_capacity"} 1' in metrics
@@ -1,27 +1,42 @@
 import pytest
+import gzip
 import json
+import shutil
+import sqlite3
 import sys
+import time
 import os
 
+import sqlalchemy
+
 #add app dir to the python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
 
-from app.application import app, db, Draft, s3_client, ddb_client, S3_BUCKET_NAME, DDB_TABLE_NAME
+from app.application import (db, Draft, s3_client, ddb_client, S3_BUCKET_NAME, DDB_TABLE_NAME, flush_outbox, create_app, upgrade_schema,
+                             OutboxEntry, outbox_entry, claim_outbox_entries, s3_draft_object)
 from instance.aws_s3_setup import initialize_s3
 from instance.aws_ddb_setup import initialize_dynamodb
 
 
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """One app for the whole run on its own sqlite file, the s3 bucket and dynamodb table are created once"""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    })
+    with app.app_context():
+        initialize_s3(s3_client=s3_client, bucket_name=S3_BUCKET_NAME)
+        initialize_dynamodb(dynamodb_client=ddb_client, table_name=DDB_TABLE_NAME)
+    return app
+
+
 @pytest.fixture
-def client():
+def client(app):
     """Create a test client and set up test db"""
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:' #in memory db for tests
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
-            # initialize AWS resources
-            initialize_s3(s3_client=s3_client, bucket_name=S3_BUCKET_NAME)
-            initialize_dynamodb(dynamodb_client=ddb_client, table_name=DDB_TABLE_NAME)
             yield client
             db.drop_all()
 
@@ -282,4 +297,603 @@ def test_update_draft_invalid_target(client):
     response = client.put('/api/v1/drafts/4545445',
                           data=json.dumps(updates),
                           content_type='application/json')
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+
+def test_update_draft_validation(client, sample_draft_data):
+    draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                      content_type='application/json').data)['id']
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(sample_draft_data, pick_number=12))
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'] == "field must be a string: pick_number"
+    response = client.put(f'/api/v1/drafts/{draft_id}', json={"player_name": "Missing Fields"})
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'].startswith("missing required field")
+    # nothing was written
+    assert json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)['sqlite']['pick_number'] == "(77)"
+    assert Draft(draft_pick_number=12).pick_number_value == 0
+
+
+def test_update_draft_version_conflict(client, sample_draft_data):
+    post_response = client.post('/api/v1/drafts',
+                                data=json.dumps(sample_draft_data),
+                                content_type='application/json')
+    draft_id = json.loads(post_response.data)['id']
+    etag = client.get(f'/api/v1/drafts/{draft_id}').headers['ETag']
+
+    updates = dict(sample_draft_data, player_name="John Calgary")
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=updates, headers={'If-Match': etag})
+    assert response.status_code == 200
+
+    # the etag read before the update is stale now
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=updates, headers={'If-Match': etag})
+    assert response.status_code == 409
+    assert response.get_json()['version'] == 2
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(updates, version=1))
+    assert response.status_code == 409
+    response = client.delete(f'/api/v1/drafts/{draft_id}', headers={'If-Match': etag})
+    assert response.status_code == 409
+
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(updates, version=2))
+    assert response.status_code == 200
+    assert client.delete(f'/api/v1/drafts/{draft_id}').status_code == 200
+
+
+def s3_calls(client, operation):
+    prefix = f'draft_backend_request_seconds_count{{backend="s3",operation="{operation}"}} '
+    lines = [line for line in client.get('/metrics').data.decode().splitlines() if line.startswith(prefix)]
+    return float(lines[0].split()[-1]) if lines else 0.0
+
+
+def test_update_writes_s3_in_one_call(app, client, sample_draft_data):
+    app.config['S3_RECORD_FORMAT'] = 'gzip'
+    try:
+        draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                          content_type='application/json').data)['id']
+    finally:
+        app.config['S3_RECORD_FORMAT'] = 'json'
+    # the object is gzip, not what the row gives today: its etag is looked up, then the row put on it
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(sample_draft_data, amateur_team="Gonzaga"))
+    assert response.status_code == 200
+
+    before = {operation: s3_calls(client, operation) for operation in ('head_object', 'get_object', 'put_object')}
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(sample_draft_data, amateur_team="UCLA"))
+    assert response.status_code == 200
+    assert response.get_json()['stores'] == {"sqlite": "ok", "dynamodb": "ok", "s3": "ok"}
+    after = {operation: s3_calls(client, operation) for operation in before}
+    assert after == dict(before, put_object=before['put_object'] + 1)
+    assert json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)['s3']['amateur_team'] == "UCLA"
+
+
+def test_update_after_failed_s3_put(client, sample_draft_data):
+    draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                      content_type='application/json').data)['id']
+    assert client.put(f'/api/v1/drafts/{draft_id}', json=dict(sample_draft_data, amateur_team="Gonzaga")).status_code == 200
+    # as if the s3 put of that update had failed, the object still holds the posted row
+    s3_client.put_object(**s3_draft_object(draft_id, sample_draft_data))
+
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(sample_draft_data, amateur_team="Kansas"))
+    assert response.status_code == 200
+    assert response.get_json()['stores'] == {"sqlite": "ok", "dynamodb": "ok", "s3": "ok"}
+    record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+    assert {store: record[store]['amateur_team'] for store in record} == {
+        "sqlite": "Kansas", "dynamodb": "Kansas", "s3": "Kansas"}
+
+
+def test_write_with_missing_replicas(client, sample_draft_data):
+    draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                      content_type='application/json').data)['id']
+    ddb_client.delete_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(draft_id)}})
+    s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{draft_id}.json')
+
+    # sqlite has the update, the replicas are reported instead of a 404
+    response = client.put(f'/api/v1/drafts/{draft_id}', json=dict(sample_draft_data, amateur_team="Gonzaga"))
+    assert response.status_code == 207
+    assert response.get_json()['stores'] == {"sqlite": "ok", "dynamodb": "not_found", "s3": "not_found"}
+    assert json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)['sqlite']['amateur_team'] == "Gonzaga"
+
+    # deleting a missing s3 key succeeds, dynamodb's conditional delete notices
+    response = client.delete(f'/api/v1/drafts/{draft_id}')
+    assert response.status_code == 207
+    assert response.get_json()['stores'] == {"sqlite": "ok", "dynamodb": "not_found", "s3": "ok"}
+    assert 'error' in json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)['sqlite']
+
+
+def test_get_drafts_paginated(client, sample_draft_data):
+    for i in range(3):
+        draft = dict(sample_draft_data, player_name=f"Player {i}")
+        client.post('/api/v1/drafts',
+                    data=json.dumps(draft),
+                    content_type='application/json')
+    first_page = json.loads(client.get('/api/v1/drafts?limit=2').data)
+    assert len(first_page['sqlite_draft_data']) == 2
+    assert first_page['next_token'] is not None
+
+    second_page = json.loads(client.get(f"/api/v1/drafts?limit=2&next_token={first_page['next_token']}").data)
+    assert len(second_page['sqlite_draft_data']) == 1
+    names = [d['player_name'] for d in first_page['sqlite_draft_data'] + second_page['sqlite_draft_data']]
+    assert names == ["Player 0", "Player 1", "Player 2"]
+
+
+def test_get_drafts_invalid_page_params(client):
+    assert client.get('/api/v1/drafts?limit=zero').status_code == 400
+    assert client.get('/api/v1/drafts?next_token=not-a-token').status_code == 400
+
+
+def test_read_source(client, sample_draft_data):
+    draft_id = client.post('/api/v1/drafts', json=sample_draft_data).get_json()['id']
+
+    primary = client.get('/api/v1/drafts?source=primary').get_json()
+    assert 'sqlite_draft_data' in primary
+    assert 'dynamo_db_draft_data' not in primary and 's3_draft_data' not in primary
+    # the token of a single source read keeps reading that store
+    page = client.get('/api/v1/drafts?source=dynamodb&limit=1').get_json()
+    assert len(page['dynamo_db_draft_data']) == 1
+    assert 'sqlite_draft_data' not in page and 's3_draft_data' not in page
+
+    fastest = client.get('/api/v1/drafts?source=fastest').get_json()
+    stores = [key for key in fastest if key.endswith('_draft_data')]
+    assert len(stores) == 1 and fastest[stores[0]]
+
+    record = client.get(f'/api/v1/drafts/{draft_id}?source=s3')
+    assert list(record.get_json()) == ['s3']
+    record = client.get(f'/api/v1/drafts/{draft_id}?source=fastest')
+    assert len(record.get_json()) == 1
+    assert client.get(f'/api/v1/drafts/{draft_id}?source=primary').get_json()['sqlite']['id'] == draft_id
+
+    assert client.get('/api/v1/drafts?source=nearest').status_code == 400
+    assert client.get(f'/api/v1/drafts/{draft_id}?source=nearest').status_code == 400
+
+
+def test_get_drafts_ndjson_stream(client, sample_draft_data):
+    client.post('/api/v1/drafts',
+                data=json.dumps(sample_draft_data),
+                content_type='application/json')
+    response = client.get('/api/v1/drafts?format=ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.data.decode().splitlines()]
+    sqlite_records = [r for r in records if r['source'] == 'sqlite']
+    assert sqlite_records[0]['player_name'] == sample_draft_data['player_name']
+
+
+def test_batch_import(client, sample_draft_data):
+    client.post('/api/v1/drafts',
+                data=json.dumps(sample_draft_data),
+                content_type='application/json')
+    batch = [dict(sample_draft_data, player_name=f"Batch Player {i}") for i in range(30)]
+    batch.append(sample_draft_data)                 # already in the db
+    batch.append(dict(batch[0]))                    # duplicate within the batch
+    batch.append({"player_name": "Missing Fields"})
+    batch.append(dict(sample_draft_data, player_name="Wrong Type", pick_number=12))
+    # accepted like it is by POST /drafts
+    batch.append(dict(sample_draft_data, player_name="No College", amateur_team=None))
+    response = client.post('/api/v1/drafts:batch',
+                           data=json.dumps(batch),
+                           content_type='application/json')
+    assert response.status_code == 207
+    data = json.loads(response.data)
+    assert data['created'] == 31
+    statuses = [r['status'] for r in data['results']]
+    assert statuses == [201] * 30 + [409, 409, 400, 400, 201]
+    assert data['results'][32]['error'] == "missing required field: pick_number, pro_team, amateur_team"
+    assert data['results'][33]['error'] == "field must be a string: pick_number"
+    assert all('errors' not in r for r in data['results'])
+
+    draft_id = data['results'][29]['id']
+    record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+    assert record['sqlite']['player_name'] == "Batch Player 29"
+    assert record['dynamodb']['player_name'] == "Batch Player 29"
+    assert record['s3']['player_name'] == "Batch Player 29"
+
+    record = json.loads(client.get(f"/api/v1/drafts/{data['results'][34]['id']}").data)
+    assert record['sqlite']['amateur_team'] is None
+    assert record['dynamodb']['amateur_team'] is None
+    assert record['s3']['amateur_team'] is None
+
+
+def test_post_draft_validation(client, sample_draft_data):
+    response = client.post('/api/v1/drafts',
+                           data=json.dumps(dict(sample_draft_data, amateur_team=None)),
+                           content_type='application/json')
+    assert response.status_code == 201
+    response = client.post('/api/v1/drafts',
+                           data=json.dumps({"player_name": "Missing Fields"}),
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'].startswith("missing required field")
+
+
+def test_batch_import_ndjson(client, sample_draft_data):
+    lines = "\n".join(json.dumps(dict(sample_draft_data, player_name=f"Line {i}")) for i in range(3))
+    response = client.post('/api/v1/drafts:batch',
+                           data=lines,
+                           content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert json.loads(response.data)['created'] == 3
+
+
+def test_get_draft_record_cache_invalidated_on_update(client, sample_draft_data):
+    post_response = client.post('/api/v1/drafts',
+                                data=json.dumps(sample_draft_data),
+                                content_type='application/json')
+    draft_id = json.loads(post_response.data)['id']
+    client.get(f'/api/v1/drafts/{draft_id}')
+    hits_before = json.loads(client.get('/api/v1/cache/stats').data)['hits']
+    client.get(f'/api/v1/drafts/{draft_id}')
+    assert json.loads(client.get('/api/v1/cache/stats').data)['hits'] == hits_before + 1
+
+    client.put(f'/api/v1/drafts/{draft_id}',
+               data=json.dumps(dict(sample_draft_data, player_name="Cache Buster")),
+               content_type='application/json')
+    record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+    assert record['sqlite']['player_name'] == "Cache Buster"
+
+
+def test_pool_stats(client):
+    client.get('/api/v1/drafts')
+    response = client.get('/api/v1/pools/stats')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['s3']['max_pool_connections'] > 0
+    assert isinstance(data['dynamodb']['pools'], list)
+
+
+def test_get_draft_record_etag(client, sample_draft_data):
+    post_response = client.post('/api/v1/drafts',
+                                data=json.dumps(sample_draft_data),
+                                content_type='application/json')
+    draft_id = json.loads(post_response.data)['id']
+    response = client.get(f'/api/v1/drafts/{draft_id}')
+    etag = response.headers['ETag']
+    assert etag
+
+    not_modified = client.get(f'/api/v1/drafts/{draft_id}', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b''
+
+    client.put(f'/api/v1/drafts/{draft_id}',
+               data=json.dumps(dict(sample_draft_data, pro_team="Utah Jazz")),
+               content_type='application/json')
+    modified = client.get(f'/api/v1/drafts/{draft_id}', headers={'If-None-Match': etag})
+    assert modified.status_code == 200
+    assert modified.headers['ETag'] != etag
+
+
+def test_get_drafts_collection_etag(client, sample_draft_data):
+    etag = client.get('/api/v1/drafts').headers['ETag']
+    assert client.get('/api/v1/drafts', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/v1/drafts',
+                data=json.dumps(sample_draft_data),
+                content_type='application/json')
+    response = client.get('/api/v1/drafts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_get_drafts_filtered(client, sample_draft_data):
+    drafts = [
+        dict(sample_draft_data, player_name="Filter A", pro_team="Filter Team", pick_number="(3)"),
+        dict(sample_draft_data, player_name="Filter B", pro_team="Filter Team", pick_number="(15)"),
+        dict(sample_draft_data, player_name="Filter C", pro_team="Filter Team", pick_number="(40)"),
+        dict(sample_draft_data, player_name="Other D", pro_team="Other Team", pick_number="(10)"),
+    ]
+    for draft in drafts:
+        client.post('/api/v1/drafts',
+                    data=json.dumps(draft),
+                    content_type='application/json')
+    response = client.get('/api/v1/drafts?pro_team=Filter%20Team&pick_from=1&pick_to=20')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert sorted(d['player_name'] for d in data['sqlite_draft_data']) == ["Filter A", "Filter B"]
+    assert sorted(d['player_name'] for d in data['dynamo_db_draft_data']) == ["Filter A", "Filter B"]
+    assert sorted(d['player_name'] for d in data['s3_draft_data']) == ["Filter A", "Filter B"]
+
+    prefix = json.loads(client.get('/api/v1/drafts?player_name=Oth').data)
+    assert [d['player_name'] for d in prefix['sqlite_draft_data']] == ["Other D"]
+
+    assert client.get('/api/v1/drafts?pick_from=first').status_code == 400
+
+
+def test_s3_record_format_and_snapshot(app, client, sample_draft_data):
+    app.config['S3_RECORD_FORMAT'] = 'gzip'
+    try:
+        ids = []
+        for name in ("Snapshot A", "Snapshot B"):
+            response = client.post('/api/v1/drafts', json=dict(sample_draft_data, player_name=name))
+            ids.append(response.get_json()['id'])
+        head = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{ids[0]}.json')
+        assert head['Metadata']['draft-format'] == 'gzip'
+        assert client.get(f'/api/v1/drafts/{ids[0]}').get_json()['s3']['player_name'] == "Snapshot A"
+
+        response = client.post('/api/v1/s3/snapshot')
+        assert response.status_code == 201
+        assert response.get_json()['count'] == 2
+        assert client.get('/api/v1/s3/snapshot').get_json()['current'] is True
+
+        # served from the snapshot, so the deleted object is still listed
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=f'draft_{ids[1]}.json')
+        data = client.get('/api/v1/drafts').get_json()
+        assert sorted(d['player_name'] for d in data['s3_draft_data']) == ["Snapshot A", "Snapshot B"]
+
+        # any write makes it stale and the objects are listed again
+        client.post('/api/v1/drafts', json=dict(sample_draft_data, player_name="Snapshot C"))
+        assert client.get('/api/v1/s3/snapshot').get_json()['current'] is False
+        names = [d['player_name'] for d in client.get('/api/v1/drafts').get_json()['s3_draft_data']]
+        assert "Snapshot C" in names and "Snapshot B" not in names
+    finally:
+        app.config['S3_RECORD_FORMAT'] = 'json'
+        manifest = client.get('/api/v1/s3/snapshot').get_json()
+        if 'key' in manifest:
+            s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=manifest['key'])
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key='snapshots/manifest.json')
+
+
+def test_response_compression(client, sample_draft_data):
+    for i in range(20):
+        client.post('/api/v1/drafts', json=dict(sample_draft_data, player_name=f"Compressed {i}"))
+    plain = client.get('/api/v1/drafts')
+    assert 'Content-Encoding' not in plain.headers
+
+    response = client.get('/api/v1/drafts', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == plain.get_json()
+    # the compressed body carries a weak etag that still revalidates
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/api/v1/drafts', headers={'If-None-Match': etag}).status_code == 304
+
+    stream = client.get('/api/v1/drafts?format=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert stream.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(stream.data).decode().count('\n') >= 20
+
+    # small bodies are sent as they are
+    small = client.get('/api/v1/drafts?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+
+@pytest.fixture
+def async_replication(app, client):
+    app.config['REPLICATION_MODE'] = 'async'
+    yield client
+    flush_outbox()
+    app.extensions.pop('outbox_worker').stop()
+    app.config['REPLICATION_MODE'] = 'sync'
+
+
+def test_async_replication_converges(async_replication, sample_draft_data):
+    client = async_replication
+    post_response = client.post('/api/v1/drafts',
+                                data=json.dumps(sample_draft_data),
+                                content_type='application/json')
+    assert post_response.status_code == 201
+    draft_id = json.loads(post_response.data)['id']
+    client.put(f'/api/v1/drafts/{draft_id}',
+               data=json.dumps(dict(sample_draft_data, amateur_team="Gonzaga")),
+               content_type='application/json')
+
+    assert flush_outbox()
+    stats = json.loads(client.get('/api/v1/outbox/stats').data)
+    assert stats['pending'] == 0
+    assert stats['lag_seconds'] == 0.0
+
+    record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+    assert record['dynamodb']['amateur_team'] == "Gonzaga"
+    assert record['s3']['amateur_team'] == "Gonzaga"
+
+    client.delete(f'/api/v1/drafts/{draft_id}')
+    assert flush_outbox()
+    record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+    assert 'error' in record['dynamodb']
+    assert 'error' in record['s3']
+
+
+def test_outbox_drains_on_startup(app, client, sample_draft_data):
+    draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                      content_type='application/json').data)['id']
+    # an update committed by a process that stopped before replicating it
+    db.session.add(outbox_entry(draft_id, "put", dict(sample_draft_data, amateur_team="Gonzaga")))
+    db.session.commit()
+
+    restarted = create_app({'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+                            'REPLICATION_MODE': 'async', 'OUTBOX_POLL_INTERVAL': 0.05})
+    try:
+        deadline = time.monotonic() + 10
+        while OutboxEntry.query.count() and time.monotonic() < deadline:
+            time.sleep(0.02)
+            db.session.rollback()
+        assert OutboxEntry.query.count() == 0
+    finally:
+        restarted.extensions.pop('outbox_worker').stop()
+    record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+    assert record['dynamodb']['amateur_team'] == "Gonzaga"
+    assert record['s3']['amateur_team'] == "Gonzaga"
+
+
+def test_outbox_claims(app, client, sample_draft_data):
+    now = time.time()
+    db.session.add_all([outbox_entry(1, "put", sample_draft_data),
+                        outbox_entry(1, "put", dict(sample_draft_data, amateur_team="Gonzaga")),
+                        outbox_entry(2, "delete")])
+    db.session.commit()
+    claimed, superseded = claim_outbox_entries("worker-a", now)
+    assert superseded == 1
+    assert [(e.draft_id, e.operation, e.owner) for e in claimed] == [(1, "put", "worker-a"), (2, "delete", "worker-a")]
+    assert json.loads(claimed[0].payload)['amateur_team'] == "Gonzaga"
+    # another process finds nothing to claim while the lease lives, not even
+    # a newer write to a draft that is being replicated
+    assert claim_outbox_entries("worker-b", now) == ([], 0)
+    db.session.add(outbox_entry(1, "delete"))
+    db.session.commit()
+    assert claim_outbox_entries("worker-b", now) == ([], 0)
+    # worker a died, after its lease the newest entries go to worker b
+    claimed, superseded = claim_outbox_entries("worker-b", now + app.config['OUTBOX_LEASE'] + 1)
+    assert superseded == 1
+    assert [(e.draft_id, e.operation, e.owner) for e in claimed] == [(2, "delete", "worker-b"), (1, "delete", "worker-b")]
+
+
+def test_metrics_and_server_timing(client, sample_draft_data):
+    post_response = client.post('/api/v1/drafts',
+                                data=json.dumps(sample_draft_data),
+                                content_type='application/json')
+    draft_id = json.loads(post_response.data)['id']
+    response = client.get(f'/api/v1/drafts/{draft_id}')
+    server_timing = response.headers['Server-Timing']
+    assert 'sqlite;dur=' in server_timing
+    assert 'dynamodb;dur=' in server_timing
+    assert 's3;dur=' in server_timing
+    assert 'total;dur=' in server_timing
+
+    metrics = client.get('/metrics')
+    assert metrics.status_code == 200
+    body = metrics.data.decode()
+    assert 'draft_backend_request_seconds_count{backend="dynamodb",operation="get_item"}' in body
+    assert 'draft_backend_request_seconds_count{backend="sqlite",operation="select"}' in body
+    assert 'draft_http_request_seconds_bucket{method="GET",route="/api/v1/drafts/<id>",status="200",le="+Inf"}' in body
+    assert 'draft_http_response_bytes_count{method="POST",route="/api/v1/drafts"}' in body
+
+
+def test_create_app_config(monkeypatch, tmp_path):
+    monkeypatch.setenv('DRAFT_REPLICATION_MODE', 'async')
+    monkeypatch.setenv('DRAFT_BACKEND_CONCURRENCY', '8')
+    other_app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'other.db'}"})
+    assert other_app.config['REPLICATION_MODE'] == 'async'
+    assert other_app.config['BACKEND_CONCURRENCY'] == 8
+    other_app.extensions.pop('outbox_worker').stop()
+    with other_app.app_context():
+        db.create_all()
+        assert Draft.query.count() == 0
+    assert other_app.test_client().get('/').status_code == 200
+
+
+def test_upgrade_schema(tmp_path):
+    # the committed instance/data.db has the draft table of the first release
+    db_path = tmp_path / 'old.db'
+    shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'instance', 'data.db'), db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM draft")
+        conn.execute("INSERT INTO draft (id, draft_pick_number, pro_team_name, player_name, amateur_team_name) "
+                     "VALUES (7, '(12)', 'Utah Jazz', 'Old Player', NULL)")
+    old_app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{db_path}"})
+    with old_app.app_context():
+        db.create_all()
+        assert upgrade_schema() == [('draft', 'pick_number_value'), ('draft', 'version')]
+        assert upgrade_schema() == []
+        draft_rec = db.session.get(Draft, 7)
+        assert (draft_rec.pick_number_value, draft_rec.version) == (12, 1)
+        assert 'ix_draft_pro_team_name' in {index['name'] for index in sqlalchemy.inspect(db.engine).get_indexes('draft')}
+    client = old_app.test_client()
+    assert client.get('/api/v1/drafts?pick_from=10&pick_to=15&source=primary').get_json()['sqlite_draft_data'] == [
+        {"pick_number": "(12)", "pro_team": "Utah Jazz", "player_name": "Old Player", "amateur_team": None}]
+
+
+def test_change_feed(client, sample_draft_data):
+    start = json.loads(client.get('/api/v1/drafts/changes').data)
+    assert start['changes'] == []
+    since = start['next_since']
+
+    draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                      content_type='application/json').data)['id']
+    client.put(f'/api/v1/drafts/{draft_id}', data=json.dumps(dict(sample_draft_data, amateur_team="Gonzaga")),
+               content_type='application/json')
+    client.delete(f'/api/v1/drafts/{draft_id}')
+
+    feed = json.loads(client.get(f'/api/v1/drafts/changes?since={since}').data)
+    assert [c['operation'] for c in feed['changes']] == ['insert', 'update', 'delete']
+    assert all(c['id'] == draft_id for c in feed['changes'])
+    assert feed['changes'][1]['draft']['amateur_team'] == "Gonzaga"
+    assert 'draft' not in feed['changes'][2]
+    assert feed['next_since'] == feed['changes'][-1]['seq']
+
+    page = json.loads(client.get(f'/api/v1/drafts/changes?since={since}&limit=2').data)
+    assert len(page['changes']) == 2 and page['has_more']
+    # nothing new, the long poll returns empty once wait passes
+    empty = json.loads(client.get(f"/api/v1/drafts/changes?since={feed['next_since']}&wait=0.05").data)
+    assert empty == {"changes": [], "next_since": feed['next_since'], "has_more": False}
+    assert client.get('/api/v1/drafts/changes?since=x').status_code == 400
+
+
+def test_change_feed_event_stream(app, client, sample_draft_data):
+    since = json.loads(client.get('/api/v1/drafts/changes').data)['next_since']
+    client.post('/api/v1/drafts', data=json.dumps(sample_draft_data), content_type='application/json')
+    app.config['CHANGES_STREAM_DURATION'] = 0.05
+    try:
+        response = client.get('/api/v1/drafts/changes', headers={'Accept': 'text/event-stream',
+                                                                  'Last-Event-ID': str(since),
+                                                                  'Accept-Encoding': 'gzip'})
+        assert response.mimetype == 'text/event-stream'
+        # events are never held back for compression
+        assert 'Content-Encoding' not in response.headers
+        body = response.get_data(as_text=True)
+    finally:
+        app.config['CHANGES_STREAM_DURATION'] = 300.0
+    assert f"id: {since + 1}\nevent: insert\n" in body
+
+
+def test_change_feed_pruned(app, client, sample_draft_data):
+    from app.application import prune_draft_changes
+    for name in ("One", "Two"):
+        client.post('/api/v1/drafts', data=json.dumps(dict(sample_draft_data, player_name=name)),
+                    content_type='application/json')
+    newest = json.loads(client.get('/api/v1/drafts/changes').data)['next_since']
+    app.config['CHANGES_RETENTION'] = 0
+    try:
+        prune_draft_changes()
+    finally:
+        app.config['CHANGES_RETENTION'] = 7 * 24 * 3600
+    gone = client.get(f'/api/v1/drafts/changes?since={newest - 2}')
+    assert gone.status_code == 410
+    assert json.loads(gone.data)['next_since'] == newest
+    assert client.get(f'/api/v1/drafts/changes?since={newest - 1}').status_code == 200
+
+
+def test_export_drafts(client, sample_draft_data):
+    for i in range(3):
+        client.post('/api/v1/drafts', data=json.dumps(dict(sample_draft_data, player_name=f"Player {i}",
+                                                           pro_team="Boston Celtics" if i else "Utah Jazz")),
+                    content_type='application/json')
+    response = client.get('/api/v1/drafts/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'drafts.csv' in response.headers['Content-Disposition']
+    lines = response.data.decode().splitlines()
+    assert lines[0] == "id,pick_number,pro_team,player_name,amateur_team"
+    assert len(lines) == 4
+    assert client.get('/api/v1/drafts/export', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    filtered = client.get('/api/v1/drafts/export?format=ndjson&compression=gzip&pro_team=Utah+Jazz')
+    assert filtered.mimetype == 'application/gzip'
+    records = [json.loads(line) for line in gzip.decompress(filtered.data).splitlines()]
+    assert [r['player_name'] for r in records] == ["Player 0"]
+    assert client.get('/api/v1/drafts/export?format=xml').status_code == 400
+
+
+def test_export_without_pyarrow(client, monkeypatch):
+    # a None entry makes the import fail as if pyarrow was not installed
+    monkeypatch.setitem(sys.modules, 'pyarrow.parquet', None)
+    response = client.get('/api/v1/drafts/export?format=parquet')
+    assert response.status_code == 501
+    assert 'pyarrow' in json.loads(response.data)['error']
+    assert client.get('/api/v1/drafts/export?format=csv').status_code == 200
+
+
+def test_coalescing_stats(app, client, sample_draft_data):
+    draft_id = json.loads(client.post('/api/v1/drafts', data=json.dumps(sample_draft_data),
+                                      content_type='application/json').data)['id']
+    assert client.get(f'/api/v1/drafts/{draft_id}').status_code == 200
+    assert client.get('/api/v1/drafts?limit=5').status_code == 200
+    stats = json.loads(client.get('/api/v1/coalescing/stats').data)
+    assert stats['enabled'] is True
+    assert stats['in_flight'] == 0
+    assert stats['groups']['draft']['executed'] >= 1
+    assert stats['groups']['drafts']['executed'] >= 1
+    assert 'draft_coalesced_reads{group="draft",outcome="executed"}' in client.get('/metrics').data.decode()
+
+    app.config['SINGLE_FLIGHT'] = False
+    try:
+        record = json.loads(client.get(f'/api/v1/drafts/{draft_id}').data)
+        assert record['sqlite']['player_name'] == sample_draft_data['player_name']
+    finally:
+        app.config['SINGLE_FLIGHT'] = True
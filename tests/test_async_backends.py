@@ -0,0 +1,87 @@
+import asyncio
+import contextvars
+import time
+
+from app.async_backends import AsyncClientProxy, ensure_sync, gather_all, hedged, read_body, run_coroutine, run_legs
+from app.aws_clients import override_client
+from app.local_aws import LocalS3Client
+
+
+def test_gather_all_keeps_order_and_limits_concurrency():
+    running = []
+    peak = []
+
+    async def fetch(key):
+        running.append(key)
+        peak.append(len(running))
+        # later keys finish first
+        await asyncio.sleep((5 - key) / 1000)
+        running.remove(key)
+        if key == 3:
+            raise KeyError(key)
+        return key * 2
+    results = run_coroutine(gather_all(fetch, list(range(5)), max_concurrency=2))
+    assert [key for key, _, _ in results] == [0, 1, 2, 3, 4]
+    assert [result for _, result, _ in results] == [0, 2, 4, None, 8]
+    assert isinstance(results[3][2], KeyError)
+    assert max(peak) == 2
+
+
+def test_run_legs_overlap_with_timeouts():
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "slow"
+    start = time.monotonic()
+    results = run_coroutine(run_legs({"dynamodb": slow(), "s3": slow(), "late": asyncio.sleep(1)}, {"late": 0.3}))
+    assert time.monotonic() - start < 0.5
+    assert results["dynamodb"] == ("slow", None)
+    assert results["s3"] == ("slow", None)
+    assert isinstance(results["late"][1], TimeoutError)
+
+
+def test_hedged_cancels_the_losers():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def fast():
+        return "fast"
+    name, result, errors = run_coroutine(hedged({"slow": slow, "fast": fast}, 0.01, 1))
+    assert (name, result, errors) == ("fast", "fast", {})
+    run_coroutine(asyncio.sleep(0))
+    assert cancelled == ["slow"]
+
+
+def test_ensure_sync_runs_views_on_the_backend_loop():
+    request_id = contextvars.ContextVar("request_id")
+
+    async def view(x):
+        await asyncio.sleep(0)
+        return x, request_id.get()
+
+    def plain():
+        return "plain"
+    request_id.set("abc")
+    # the caller's context follows the coroutine onto the loop thread
+    assert ensure_sync(view)(1) == (1, "abc")
+    assert ensure_sync(plain) is plain
+
+
+def test_async_client_proxy_uses_overrides():
+    override_client("s3", LocalS3Client())
+    try:
+        s3 = AsyncClientProxy("s3")
+
+        async def roundtrip():
+            await s3.create_bucket(Bucket="bucket")
+            await s3.put_object(Bucket="bucket", Key="k", Body=b"value")
+            response = await s3.get_object(Bucket="bucket", Key="k")
+            return await read_body(response["Body"])
+        assert run_coroutine(roundtrip()) == b"value"
+    finally:
+        override_client("s3", None)
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.aws_clients import AWS_SETTINGS, ClientProxy, client_config, get_client, configure_clients, pool_stats
+from app.local_aws import LatencyClient, LocalS3Client
+
+
+@pytest.fixture
+def boto3_backend():
+    # these tests look at real boto3 clients, also when the suite runs with AWS_BACKEND=local
+    original = AWS_SETTINGS["backend"]
+    configure_clients(backend="boto3")
+    yield
+    configure_clients(backend=original)
+
+
+def test_client_config_uses_settings():
+    config = client_config(dict(AWS_SETTINGS, max_pool_connections=7, max_attempts=4))
+    assert config.max_pool_connections == 7
+    assert config.retries == {"mode": "adaptive", "max_attempts": 4}
+    assert config.tcp_keepalive == AWS_SETTINGS["tcp_keepalive"]
+
+
+def test_clients_are_shared_per_process(boto3_backend):
+    assert get_client("s3") is get_client("s3")
+    proxy = ClientProxy("s3")
+    assert proxy.meta is get_client("s3").meta
+    assert proxy.meta.config.max_pool_connections == AWS_SETTINGS["max_pool_connections"]
+
+
+def test_configure_clients_rebuilds(boto3_backend):
+    before = get_client("dynamodb")
+    original = AWS_SETTINGS["read_timeout"]
+    try:
+        configure_clients(read_timeout=3.0)
+        after = get_client("dynamodb")
+        assert after is not before
+        assert after.meta.config.read_timeout == 3.0
+    finally:
+        configure_clients(read_timeout=original)
+
+
+def test_import_builds_no_clients():
+    # boto3 and the flask app are only loaded on first use
+    code = "import sys, app.application as a; print('boto3' in sys.modules, 'app' in vars(a))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert out.stdout.split() == ["False", "False"]
+
+
+def test_local_backend_with_latency():
+    original = dict(AWS_SETTINGS)
+    try:
+        configure_clients(backend="local", local_latency_ms=20, local_jitter_ms=0)
+        s3 = ClientProxy("s3")
+        assert isinstance(get_client("s3"), LatencyClient)
+        s3.create_bucket(Bucket="b")
+        start = time.monotonic()
+        s3.put_object(Bucket="b", Key="k", Body="1")
+        assert time.monotonic() - start >= 0.02
+        assert s3.get_object(Bucket="b", Key="k")["Body"].read() == b"1"
+        assert pool_stats("s3")["pools"] == []
+
+        configure_clients(local_latency_ms=0)
+        # a rebuilt local client starts empty and without the wrapper
+        assert isinstance(get_client("s3"), LocalS3Client)
+        with pytest.raises(ValueError):
+            configure_clients(backend="nope")
+            get_client("dynamodb")
+    finally:
+        configure_clients(**original)
+
+
+def test_latency_jitter_is_seeded():
+    first = LatencyClient(LocalS3Client(), 0.001, jitter=0.005, seed=1)
+    second = LatencyClient(LocalS3Client(), 0.001, jitter=0.005, seed=1)
+    delays = [first.delay() for _ in range(5)]
+    assert delays == [second.delay() for _ in range(5)]
+    assert all(0.001 <= d <= 0.006 for d in delays)
@@ -0,0 +1,41 @@
+from app.batch import batch_write_items, chunked
+
+
+class FlakyDynamoDB:
+    # leaves the last item of every call unprocessed the first time it is seen
+    def __init__(self):
+        self.calls = []
+        self.seen = set()
+
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems["drafts"]
+        self.calls.append(len(requests))
+        last = requests[-1]["PutRequest"]["Item"]["id"]["N"]
+        if last in self.seen:
+            return {"UnprocessedItems": {}}
+        self.seen.add(last)
+        return {"UnprocessedItems": {"drafts": [requests[-1]]}}
+
+
+def put(i):
+    return {"PutRequest": {"Item": {"id": {"N": str(i)}}}}
+
+
+def test_chunked():
+    assert list(chunked(list(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_batch_write_items_retries_unprocessed():
+    client = FlakyDynamoDB()
+    failed = batch_write_items(client, "drafts", [put(i) for i in range(30)], base_delay=0)
+    assert failed == []
+    # 25 + retry of 1, then 5 + retry of 1
+    assert client.calls == [25, 1, 5, 1]
+
+
+def test_batch_write_items_gives_up():
+    class Broken:
+        def batch_write_item(self, RequestItems):
+            raise RuntimeError("down")
+    failed = batch_write_items(Broken(), "drafts", [put(1), put(2)], max_retries=2, base_delay=0)
+    assert failed == [put(1), put(2)]
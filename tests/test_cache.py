@@ -0,0 +1,49 @@
+import pytest
+import time
+
+from app.cache import TTLCache, SqliteCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return TTLCache(max_size=2, ttl=0.2)
+    return SqliteCache(str(tmp_path / "cache.db"), max_size=2, ttl=0.2)
+
+
+def test_cache_lru_eviction(cache):
+    cache.set("1", {"id": 1})
+    cache.set("2", {"id": 2})
+    # touch 1 so 2 becomes the least recently used
+    time.sleep(0.01)
+    assert cache.get("1") == {"id": 1}
+    time.sleep(0.01)
+    cache.set("3", {"id": 3})
+    assert cache.get("2") is None
+    assert cache.get("3") == {"id": 3}
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_cache_ttl_and_invalidate(cache):
+    cache.set("1", {"id": 1})
+    cache.invalidate("1")
+    assert cache.get("1") is None
+    cache.set("2", {"id": 2})
+    time.sleep(0.25)
+    assert cache.get("2") is None
+    stats = cache.stats()
+    assert stats["invalidations"] == 1
+    assert stats["expirations"] == 1
+
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker_a = SqliteCache(path)
+    worker_b = SqliteCache(path)
+    worker_a.set("1", {"id": 1})
+    assert worker_b.get("1") == {"id": 1}
+    worker_b.invalidate("1")
+    assert worker_a.get("1") is None
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from app.change_feed import ChangeNotifier, parse_since, parse_wait, wait_for_changes, sse_event, stream_changes
+
+
+def test_parse_since_and_wait():
+    assert parse_since(None) is None
+    assert parse_since("") is None
+    assert parse_since("12") == 12
+    with pytest.raises(ValueError):
+        parse_since("-1")
+    with pytest.raises(ValueError):
+        parse_since("x")
+    assert parse_wait(None, 30) == 0.0
+    assert parse_wait("90", 30) == 30
+    with pytest.raises(ValueError):
+        parse_wait("soon", 30)
+
+
+def test_long_poll_wakes_on_notify():
+    notifier = ChangeNotifier()
+    changes = []
+
+    def write():
+        time.sleep(0.05)
+        changes.append({"seq": 1})
+        notifier.notify()
+    threading.Thread(target=write).start()
+    start = time.monotonic()
+    # the poll interval is longer than the test, only notify() can end the wait early
+    assert wait_for_changes(lambda: list(changes), notifier, timeout=5, poll_interval=5) == [{"seq": 1}]
+    assert time.monotonic() - start < 1
+
+
+def test_long_poll_times_out_empty():
+    start = time.monotonic()
+    assert wait_for_changes(lambda: [], ChangeNotifier(), timeout=0.05, poll_interval=0.01) == []
+    assert time.monotonic() - start >= 0.05
+
+
+def test_stream_changes_sends_events_and_heartbeats():
+    changes = [{"seq": 1, "operation": "insert"}, {"seq": 2, "operation": "delete"}]
+    reads = []
+
+    def read(since):
+        reads.append(since)
+        return [c for c in changes if c["seq"] > since]
+    events = list(stream_changes(read, ChangeNotifier(), 0, duration=0.1, heartbeat=0.02, poll_interval=0.01,
+                                 dumps_line=lambda c: b'{"seq":%d}\n' % c["seq"]))
+    assert events[0] == b"retry: 1000\n\n"
+    assert events[1] == sse_event(1, "insert", b'{"seq":1}')
+    assert events[2] == b'id: 2\nevent: delete\ndata: {"seq":2}\n\n'
+    assert b": keep-alive\n\n" in events
+    # later reads carry on after the last event sent
+    assert reads[0] == 0 and set(reads[1:]) == {2}
@@ -0,0 +1,62 @@
+import time
+
+from app.executor import fetch_all, submit_legs, collect_legs, hedged
+
+
+def test_fetch_all_keeps_order():
+    def fetch(key):
+        # later keys finish first
+        time.sleep((5 - key) / 1000)
+        return key * 2
+    results = fetch_all(fetch, list(range(5)), max_workers=5)
+    assert [key for key, _, _ in results] == [0, 1, 2, 3, 4]
+    assert [result for _, result, _ in results] == [0, 2, 4, 6, 8]
+
+
+def test_fetch_all_reports_failures_per_key():
+    def fetch(key):
+        if key == "bad":
+            raise KeyError(key)
+        return key
+    results = fetch_all(fetch, ["a", "bad", "c"], max_workers=2)
+    assert results[0] == ("a", "a", None)
+    assert results[1][1] is None and isinstance(results[1][2], KeyError)
+    assert results[2] == ("c", "c", None)
+
+
+def test_legs_run_in_parallel_with_timeouts():
+    def slow():
+        time.sleep(0.2)
+        return "slow"
+    start = time.monotonic()
+    futures = submit_legs({"dynamodb": slow, "s3": slow, "late": lambda: time.sleep(1)}, max_workers=3)
+    results = collect_legs(futures, {"late": 0.3})
+    # both slow legs overlap, so the total tracks the slowest leg
+    assert time.monotonic() - start < 0.5
+    assert results["dynamodb"] == ("slow", None)
+    assert results["s3"] == ("slow", None)
+    assert isinstance(results["late"][1], TimeoutError)
+
+
+def test_hedged_takes_first_accepted_answer():
+    def answer(value, delay):
+        def call():
+            time.sleep(delay)
+            return value
+        return call
+    start = time.monotonic()
+    # the first call is slow, so the second is started after the hedge delay and wins
+    name, result, errors = hedged({"slow": answer("slow", 0.5), "fast": answer("fast", 0)}, 0.05, 1, max_workers=2)
+    assert (name, result, errors) == ("fast", "fast", {})
+    assert time.monotonic() - start < 0.3
+
+    def fail():
+        raise KeyError("missing")
+    # a failure or a rejected answer moves on to the next call without waiting out the delay
+    name, result, errors = hedged({"fail": fail, "none": answer(None, 0), "ok": answer(1, 0)}, 5, 1,
+                                  max_workers=2, accept=lambda r: r is not None)
+    assert (name, result) == ("ok", 1)
+    assert isinstance(errors["fail"], KeyError) and isinstance(errors["none"], LookupError)
+
+    name, result, errors = hedged({"late": answer("late", 0.5)}, 0.01, 0.1, max_workers=1)
+    assert name is None and isinstance(errors["late"], TimeoutError)
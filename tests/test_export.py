@@ -0,0 +1,64 @@
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.export import parse_export_args, export_chunks, export_filename, export_mimetype
+
+COLUMNS = ("id", "player_name")
+BATCHES = [[(1, "A"), (2, "B, Jr.")], [(3, "C")]]
+
+
+def dumps_line(obj):
+    return (json.dumps(obj) + "\n").encode()
+
+
+def test_parse_export_args():
+    assert parse_export_args({}) == ("csv", None)
+    assert parse_export_args({"format": "ndjson", "compression": "gzip"}) == ("ndjson", "gzip")
+    assert parse_export_args({"compression": "none"}) == ("csv", None)
+    with pytest.raises(ValueError):
+        parse_export_args({"format": "xlsx"})
+    with pytest.raises(ValueError):
+        parse_export_args({"compression": "zstd"})
+    assert export_filename("csv", "gzip") == "drafts.csv.gz"
+    assert export_mimetype("csv", "gzip") == "application/gzip"
+    assert export_mimetype("ndjson", None) == "application/x-ndjson"
+
+
+def test_import_skips_pyarrow():
+    # pyarrow is loaded by the first parquet export, not at startup
+    code = "import sys, app.application; print('pyarrow' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert out.stdout.split() == ["False"]
+
+
+def test_csv_is_written_per_batch():
+    chunks = list(export_chunks("csv", None, COLUMNS, iter(BATCHES), dumps_line))
+    # the header goes out with the first batch, nothing is held back
+    assert chunks == [b'id,player_name\n1,A\n2,"B, Jr."\n', b"3,C\n"]
+    assert list(export_chunks("csv", None, COLUMNS, iter([]), dumps_line)) == [b"id,player_name\n"]
+
+
+def test_ndjson_gzip():
+    body = b"".join(export_chunks("ndjson", "gzip", COLUMNS, iter(BATCHES), dumps_line))
+    lines = gzip.decompress(body).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": 1, "player_name": "A"}, {"id": 2, "player_name": "B, Jr."}, {"id": 3, "player_name": "C"}]
+
+
+def test_parquet_row_groups():
+    parquet = pytest.importorskip("pyarrow.parquet")
+    chunks = list(export_chunks("parquet", "snappy", COLUMNS, iter(BATCHES), dumps_line, row_group_size=2))
+    # a row group is sent as soon as it is full, the footer last
+    assert len([c for c in chunks if c]) >= 2
+    table = parquet.read_table(io.BytesIO(b"".join(chunks)))
+    assert table.num_rows == 3
+    assert parquet.ParquetFile(io.BytesIO(b"".join(chunks))).num_row_groups == 2
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.column("player_name").to_pylist() == ["A", "B, Jr.", "C"]
@@ -0,0 +1,99 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from app.local_aws import LocalS3Client, LocalDynamoDBClient
+from instance.aws_ddb_setup import initialize_dynamodb
+from instance.aws_s3_setup import initialize_s3
+
+
+@pytest.fixture
+def ddb():
+    client = LocalDynamoDBClient()
+    initialize_dynamodb(dynamodb_client=client, table_name="drafts")
+    for i in range(1, 6):
+        client.put_item(TableName="drafts", Item={
+            "id": {"N": str(i)},
+            "pro_team": {"S": "A" if i % 2 else "B"},
+            "pick_value": {"N": str(i * 10)},
+            "player_name": {"S": f"Player {i}"},
+        })
+    return client
+
+
+def test_scan_pages(ddb):
+    first = ddb.scan(TableName="drafts", Limit=3)
+    assert [i["id"]["N"] for i in first["Items"]] == ["1", "2", "3"]
+    second = ddb.scan(TableName="drafts", Limit=3, ExclusiveStartKey=first["LastEvaluatedKey"])
+    assert [i["id"]["N"] for i in second["Items"]] == ["4", "5"]
+    assert "LastEvaluatedKey" not in second
+
+
+def test_query_index_with_range(ddb):
+    response = ddb.query(TableName="drafts", IndexName="pro_team-index",
+                         KeyConditionExpression="#t = :t AND #p BETWEEN :lo AND :hi",
+                         FilterExpression="begins_with(#n, :n)",
+                         ExpressionAttributeNames={"#t": "pro_team", "#p": "pick_value", "#n": "player_name"},
+                         ExpressionAttributeValues={":t": {"S": "A"}, ":lo": {"N": "10"}, ":hi": {"N": "30"},
+                                                    ":n": {"S": "Player"}})
+    assert [i["id"]["N"] for i in response["Items"]] == ["1", "3"]
+
+
+def test_conditional_put(ddb):
+    with pytest.raises(ddb.exceptions.ConditionalCheckFailedException):
+        ddb.put_item(TableName="drafts", Item={"id": {"N": "99"}}, ConditionExpression="attribute_exists(id)")
+    ddb.put_item(TableName="drafts", Item={"id": {"N": "1"}}, ConditionExpression="attribute_exists(id)")
+
+
+def test_s3_objects():
+    s3 = LocalS3Client()
+    s3.create_bucket(Bucket="b")
+    for i in range(3):
+        s3.put_object(Bucket="b", Key=f"draft_{i}.json", Body="{}")
+    page = s3.list_objects_v2(Bucket="b", MaxKeys=2)
+    rest = s3.list_objects_v2(Bucket="b", ContinuationToken=page["NextContinuationToken"])
+    assert [o["Key"] for o in page["Contents"] + rest["Contents"]] == ["draft_0.json", "draft_1.json", "draft_2.json"]
+    assert s3.get_object(Bucket="b", Key="draft_1.json")["Body"].read() == b"{}"
+    s3.delete_object(Bucket="b", Key="draft_1.json")
+    with pytest.raises(s3.exceptions.NoSuchKey):
+        s3.get_object(Bucket="b", Key="draft_1.json")
+
+
+def test_s3_conditional_put():
+    s3 = LocalS3Client()
+    s3.create_bucket(Bucket="b")
+    etag = s3.put_object(Bucket="b", Key="k", Body="1")["ETag"]
+    s3.put_object(Bucket="b", Key="k", Body="2", IfMatch=etag)
+    # the object changed since etag was read
+    with pytest.raises(ClientError) as stale:
+        s3.put_object(Bucket="b", Key="k", Body="3", IfMatch=etag)
+    assert stale.value.response["Error"]["Code"] == "PreconditionFailed"
+    with pytest.raises(s3.exceptions.NoSuchKey):
+        s3.put_object(Bucket="b", Key="missing", Body="3", IfMatch=etag)
+    with pytest.raises(ClientError):
+        s3.put_object(Bucket="b", Key="k", Body="3", IfNoneMatch="*")
+
+
+def test_initialize_is_cached_per_client():
+    calls = []
+
+    class Counting(LocalDynamoDBClient):
+        def describe_table(self, TableName):
+            calls.append(TableName)
+            return super().describe_table(TableName)
+
+    ddb = Counting()
+    initialize_dynamodb(dynamodb_client=ddb, table_name="drafts")
+    checks = len(calls)
+    initialize_dynamodb(dynamodb_client=ddb, table_name="drafts")
+    assert len(calls) == checks
+    assert ddb.describe_table(TableName="drafts")["Table"]["TableStatus"] == "ACTIVE"
+    # a table another process already created is adopted, not an error
+    other = LocalDynamoDBClient()
+    other._tables = ddb._tables
+    initialize_dynamodb(dynamodb_client=other, table_name="drafts")
+
+    s3 = LocalS3Client()
+    initialize_s3(s3_client=s3, bucket_name="b")
+    s3.put_object(Bucket="b", Key="k", Body="1")
+    initialize_s3(s3_client=s3, bucket_name="b")
+    assert s3.get_object(Bucket="b", Key="k")["Body"].read() == b"1"
@@ -0,0 +1,36 @@
+import pytest
+
+from app.metrics import Counter, Histogram, RequestTimings, current_timings, timed_call
+
+
+def test_histogram_render():
+    histogram = Histogram("latency_seconds", "test", ("backend",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "s3")
+    histogram.observe(0.5, "s3")
+    histogram.observe(5, "s3")
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{backend="s3",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{backend="s3",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{backend="s3",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{backend="s3"} 3' in lines
+
+
+def test_counter_escapes_labels():
+    counter = Counter("errors_total", "test", ("operation",))
+    counter.inc('say "hi"')
+    assert 'errors_total{operation="say \\"hi\\""} 1' in counter.render()
+
+
+def test_timed_call_records_errors_and_request_timings():
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        def boom():
+            raise RuntimeError("down")
+        with pytest.raises(RuntimeError):
+            timed_call("test_backend", "boom", boom)()
+        assert timed_call("test_backend", "ok", lambda: 1)() == 1
+    finally:
+        current_timings.reset(token)
+    assert timings.backends["test_backend"][1] == 2
+    assert "test_backend;dur=" in timings.server_timing()
@@ -0,0 +1,60 @@
+import pytest
+
+from app.aws_clients import override_client
+from app.local_aws import LocalS3Client, LocalDynamoDBClient
+from app.application import create_app, db, s3_client, ddb_client, dynamodb_draft_item, S3_BUCKET_NAME, DDB_TABLE_NAME
+from app.reconcile import reconcile
+from app.s3_format import encode_record
+from instance.aws_ddb_setup import initialize_dynamodb
+from instance.aws_s3_setup import initialize_s3
+
+
+@pytest.fixture
+def local_app(tmp_path):
+    # the in process fakes keep these stores apart from the other tests
+    override_client("s3", LocalS3Client())
+    override_client("dynamodb", LocalDynamoDBClient())
+    local_app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'reconcile.db'}"})
+    with local_app.app_context():
+        db.create_all()
+        initialize_s3(s3_client=s3_client, bucket_name=S3_BUCKET_NAME)
+        initialize_dynamodb(dynamodb_client=ddb_client, table_name=DDB_TABLE_NAME)
+    yield local_app
+    override_client("s3", None)
+    override_client("dynamodb", None)
+
+
+def test_reconcile_reports_and_repairs(local_app, tmp_path):
+    client = local_app.test_client()
+    ids = []
+    for i in range(6):
+        response = client.post('/api/v1/drafts', json={"pick_number": f"({i})", "pro_team": "Team",
+                                                        "player_name": f"Player {i}", "amateur_team": "School"})
+        ids.append(response.get_json()['id'])
+
+    with local_app.app_context():
+        assert reconcile(page_size=2, directory=tmp_path)["consistent"]
+
+        ddb_client.delete_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': str(ids[0])}})
+        ddb_client.put_item(TableName=DDB_TABLE_NAME, Item=dynamodb_draft_item(999, {
+            "pick_number": "(1)", "pro_team": "Ghost", "player_name": "Ghost", "amateur_team": "Ghost"}))
+        changed = {"id": ids[1], "pick_number": "(1)", "pro_team": "Team", "player_name": "Changed", "amateur_team": "School"}
+        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=f"draft_{ids[1]}.json", **encode_record(changed))
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=f"draft_{ids[2]}.json")
+        # same content in another format is not drift, only a different etag
+        same = {"id": ids[3], "pick_number": "(3)", "pro_team": "Team", "player_name": "Player 3", "amateur_team": "School"}
+        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=f"draft_{ids[3]}.json", **encode_record(same, "gzip"))
+
+        report = reconcile(page_size=2, directory=tmp_path)
+        assert not report["consistent"]
+        assert report["checked"] == {"sqlite": 6, "dynamodb": 6, "s3": 5}
+        assert report["dynamodb"]["ids"] == {"missing": [ids[0]], "extra": [999], "diverged": []}
+        assert report["s3"]["ids"] == {"missing": [ids[2]], "extra": [], "diverged": [ids[1]]}
+
+        repaired = reconcile(repair=True, page_size=2, directory=tmp_path)
+        assert repaired["repaired"] == {"dynamodb": 2, "s3": 2}
+        assert reconcile(page_size=2, directory=tmp_path)["consistent"]
+        assert 'Item' not in ddb_client.get_item(TableName=DDB_TABLE_NAME, Key={'id': {'N': '999'}})
+
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'draft_reconcile_drift{store="s3",kind="diverged"} 0' in metrics
@@ -0,0 +1,59 @@
+import gzip
+import json
+
+import pytest
+
+from app.s3_format import (encode_record, decode_record, encode_snapshot, decode_snapshot, snapshot_key,
+                           snapshot_manifest, snapshot_page, decode_manifest, manifest_is_current)
+
+DRAFTS = [
+    {"id": i, "pick_number": f"({i})", "pro_team": "Boston Celtics", "player_name": f"Player {i}", "amateur_team": "Duke"}
+    for i in (1, 2, 10, 11)
+]
+
+
+def stored(put_args):
+    # what get_object returns for an object written with put_args
+    return put_args["Body"], {k: v for k, v in put_args.items() if k != "Body"}
+
+
+@pytest.mark.parametrize("record_format", ["json", "gzip", "zstd"])
+def test_record_round_trip(record_format):
+    if record_format == "zstd":
+        pytest.importorskip("zstandard")
+    put_args = encode_record(DRAFTS[0], record_format)
+    assert put_args["Metadata"] == {"draft-format": record_format}
+    assert decode_record(*stored(put_args)) == DRAFTS[0]
+
+
+def test_legacy_and_unknown_records():
+    # objects written before formats existed have no metadata
+    assert decode_record(json.dumps(DRAFTS[0]).encode(), {}) == DRAFTS[0]
+    assert decode_record(gzip.compress(json.dumps(DRAFTS[0]).encode()), {"ContentEncoding": "gzip"}) == DRAFTS[0]
+    with pytest.raises(ValueError):
+        encode_record(DRAFTS[0], "brotli")
+
+
+@pytest.mark.parametrize("layout", ["ndjson", "columnar"])
+def test_snapshot_round_trip(layout):
+    put_args = encode_snapshot(DRAFTS, layout, "gzip")
+    assert decode_snapshot(*stored(put_args)) == DRAFTS
+    assert snapshot_key(7, layout, "gzip").endswith(".gz")
+
+
+def test_manifest_is_current():
+    manifest = snapshot_manifest(snapshot_key(7, "ndjson", "gzip"), 7, DRAFTS, "ndjson", "gzip", 123, 1.5)
+    manifest = decode_manifest(json.dumps(manifest).encode())
+    assert manifest_is_current(manifest, 7)
+    assert not manifest_is_current(manifest, 8)
+    assert not manifest_is_current(None, 0)
+
+
+def test_snapshot_page_matches_listing_order():
+    # keys sort as draft_1, draft_10, draft_11, draft_2 in an s3 listing
+    page, position = snapshot_page(DRAFTS, None, 2)
+    assert [d["id"] for d in page] == [1, 10]
+    assert position == "draft_10.json"
+    page, position = snapshot_page(DRAFTS, position, 2)
+    assert [d["id"] for d in page] == [11, 2]
+    assert position is None
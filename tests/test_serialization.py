@@ -0,0 +1,48 @@
+import gzip
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from app.compression import compress_stream, negotiate
+from app.serialization import (DraftJSONProvider, draft_to_dict, draft_to_dict_with_id, draft_fields, draft_columns,
+                               dynamodb_item_to_dict, dynamodb_string_attributes)
+
+DRAFT = {"pick_number": "(77)", "pro_team": "Boston Celtics", "player_name": "Jöhn Doe", "amateur_team": "Duke"}
+
+
+def test_draft_converters():
+    row = SimpleNamespace(id=3, **draft_columns(DRAFT))
+    assert draft_to_dict(row) == DRAFT
+    assert draft_to_dict_with_id(row) == {"id": 3, **DRAFT}
+    assert draft_fields(dict(DRAFT, version=2)) == DRAFT
+    with pytest.raises(KeyError):
+        draft_fields({"pick_number": "(1)"})
+
+    item = {"id": {"N": "3"}, **dynamodb_string_attributes(DRAFT)}
+    assert dynamodb_item_to_dict(item) == {"id": "3", **DRAFT}
+
+
+@pytest.mark.parametrize("backend", ["stdlib", "orjson"])
+def test_json_provider_backends(backend):
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    provider = DraftJSONProvider(Flask(__name__), backend)
+    data = {"b": [1, 2.5, None], "a": DRAFT}
+    assert provider.loads(provider.dumps(data)) == data
+    assert provider.dumps(data).index('"a"') < provider.dumps(data).index('"b"')
+    # ndjson lines keep the order the record was built in
+    assert provider.dumps_line({"source": "s3", "id": 1}).startswith(b'{"source"')
+    with pytest.raises(ValueError):
+        DraftJSONProvider(Flask(__name__), "simplejson")
+
+
+def test_negotiate_and_stream():
+    accept = parse_accept_header("gzip;q=1.0, identity;q=0.5", Accept)
+    assert negotiate(accept, ["br", "gzip"]) == "gzip"
+    assert negotiate(parse_accept_header("identity", Accept), ["br", "gzip"]) is None
+
+    lines = [f'{{"id":{i}}}\n' for i in range(1000)]
+    assert gzip.decompress(b"".join(compress_stream(lines, "gzip", 6))).decode() == "".join(lines)
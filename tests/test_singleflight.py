@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"id": 1}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flight.do, ("draft", "1"), fetch) for _ in range(8)]
+        # let every caller join the flight before the leader finishes
+        while sum(flight.stats()["groups"].get("draft", {}).values()) < 8:
+            pass
+        release.set()
+        results = [f.result() for f in futures]
+    assert len(calls) == 1
+    assert all(result == {"id": 1} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    stats = flight.stats()
+    assert stats["in_flight"] == 0
+    assert stats["groups"]["draft"] == {"executed": 1, "coalesced": 7}
+    assert stats["keys"] == [{"group": "draft", "key": "1", "executed": 1, "coalesced": 7}]
+
+    # the flight is over, the next call runs again instead of reusing the result
+    assert flight.do(("draft", "1"), lambda: "fresh") == ("fresh", False)
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise LookupError("gone")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, ("draft", "2"), fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, ("draft", "2"), fail)
+        while flight.stats()["groups"]["draft"]["coalesced"] < 1:
+            pass
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(LookupError):
+                future.result()
+    assert flight.in_flight() == 0
+
+
+def test_tracked_keys_are_bounded():
+    flight = SingleFlight(max_tracked_keys=2)
+    for key in range(5):
+        flight.do(("draft", key), lambda: None)
+    assert flight.stats()["groups"]["draft"] == {"executed": 5, "coalesced": 0}
+    assert len(flight._keys) == 2
+
+
+def test_async_single_flight():
+    async def run():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "page"
+        results = await asyncio.gather(*(flight.do(("drafts", "etag"), fetch) for _ in range(5)))
+        assert len(calls) == 1
+        assert [result for result, _ in results] == ["page"] * 5
+        assert flight.group_counts() == {"drafts": (1, 4)}
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise LookupError("gone")
+        failed = await asyncio.gather(*(flight.do(("drafts", "x"), fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(error, LookupError) for error in failed)
+        assert flight.in_flight() == 0
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.sqlite_tuning import SQLITE_PROFILES, sqlite_pragmas, sqlite_engine_options, apply_pragmas, create_read_engine
+
+
+def test_sqlite_pragmas_merges_overrides():
+    pragmas = sqlite_pragmas("performance", {"busy_timeout": 100})
+    assert pragmas["journal_mode"] == "WAL"
+    assert pragmas["busy_timeout"] == 100
+    assert sqlite_pragmas("default") == {}
+    with pytest.raises(ValueError):
+        sqlite_pragmas("fastest")
+
+
+def test_engine_options_skip_memory_databases():
+    assert sqlite_engine_options("sqlite://", 5, 5, 1.0, 64) == {}
+    assert sqlite_engine_options("sqlite:///:memory:", 5, 5, 1.0, 64) == {}
+    options = sqlite_engine_options("sqlite:////tmp/drafts.db", 5, 2, 1.0, 64)
+    assert options["pool_size"] == 5
+    assert options["connect_args"] == {"cached_statements": 64}
+
+
+def test_pragmas_applied_on_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+    apply_pragmas(engine, SQLITE_PROFILES["performance"])
+    with engine.begin() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        conn.execute(text("CREATE TABLE t (x INTEGER)"))
+
+    read_engine = create_read_engine(engine, SQLITE_PROFILES["performance"], {})
+    with read_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM t")).scalar() == 0
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO t VALUES (1)"))
+    assert create_read_engine(create_engine("sqlite://"), {}, {}) is None
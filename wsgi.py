@@ -0,0 +1,4 @@
+# production entry point, e.g. gunicorn -c gunicorn.conf.py wsgi:app
+from app.application import create_app
+
+app = create_app()